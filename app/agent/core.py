@@ -1,101 +1,488 @@
+import asyncio
+import email.utils
+import json
 import logging
-from typing import Any, Dict
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
 
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, wait_exponential
 
-from app.agent.json_utils import extract_json_object
+from app.agent.deadline import Deadline, DeadlineExceeded, SharedDeadline, remaining_or
+from app.agent.json_utils import parse_model_locally, record_repair_outcome
+from app.agent.keyword_rules import match_keywords
+from app.agent.llm_limiter import AdmissionTimeout, FairLimiter
+from app.agent.plan_stream import PlanEvent, PlanStreamParser
 from app.agent.prompts import SYSTEM_PROMPT, PLAN_INSTRUCTION
-from app.agent.schemas import AgentPlan
-from app.agent.tools import TOOL_REGISTRY
+from app.agent.schemas import AgentPlan, ToolCall
+from app.agent.singleflight import SingleFlight, llm_request_key
+from app.agent.tools import READ_ONLY_TOOLS, TOOL_REGISTRY
+from app.infra.cache import LRUTTLCache, SQLiteCache, TieredCache
+from app.infra.db import get_db
+from app.infra.executor import TOOL_EXECUTOR, run_blocking
+from app.infra.http_client import get_http_client, llm_timeout
 from app.infra.settings import settings
 
 log = logging.getLogger("agent")
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=0.5, max=4))
-async def call_llm(messages: list[dict]) -> str:
+# 相同的在途 LLM 请求只打一次上游（例如多个学生同时触发同一个 RAG 查询）
+LLM_SINGLEFLIGHT = SingleFlight("llm")
+
+# 内容寻址的响应缓存：进程内 LRU + SQLite（跨重启、同机多 worker 共享）
+LLM_CACHE = TieredCache(
+    LRUTTLCache(settings.LLM_CACHE_MEMORY_ENTRIES, default_ttl=settings.LLM_CACHE_TTL_SEC),
+    SQLiteCache("llm", get_db, max_rows=settings.LLM_CACHE_MAX_ROWS, default_ttl=settings.LLM_CACHE_TTL_SEC),
+)
+
+# 准入层：限制同时在途的上游请求数和发出速率，按 user_id 公平排队
+LLM_LIMITER = FairLimiter(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    rate_per_sec=settings.LLM_RATE_PER_SEC,
+    burst=settings.LLM_RATE_BURST,
+)
+
+
+# 只有这些状态码值得重试；其余 4xx（参数错误、鉴权失败等）重试也没用
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# 一次 LLM 调用可能抛出、调用方应当降级处理（而不是让接口 500）的异常
+LLM_CALL_ERRORS = (DeadlineExceeded, httpx.HTTPError, AdmissionTimeout)
+
+
+async def call_llm(messages: list[dict], temperature: float = 0.2, use_cache: bool = True,
+                   user_id: str | None = None, deadline: Optional[Deadline] = None) -> str:
     """
-    封装一次 LLM 调用，并带有指数退避重试。
-    重试覆盖：网络抖动、5xx、短时限流等。
+    封装一次 LLM 调用：
+    - 先查响应缓存（同样的 prompt 不再重复花钱）
+    - 相同 model/temperature/messages 的并发请求合并为一次上游调用（single-flight）
+    - 每次上游尝试都要先过准入层（并发上限 + 限速 + 按用户公平排队）
+    - 上游调用本身带重试：只重试可重试的状态码，遵守 Retry-After，不超过 deadline
     :param messages: LLM 调用的消息列表
+    :param temperature: 控制输出的“随机”程度，0 到 1 之间
+    :param use_cache: False 表示本次必须拿新鲜输出（例如 judge），不读也不写缓存
+    :param user_id: 用于公平排队；不传则归入匿名队列
+    :param deadline: 请求级时间预算；用完抛 DeadlineExceeded
     :return: LLM 回复的文本
     """
-    headers = {"Authorization": f"Bearer {settings.LLM_API_KEY}"}
+    if deadline is not None:
+        deadline.check("call_llm")
+
+    key = llm_request_key(settings.LLM_MODEL, temperature, messages)
+    cacheable = (
+        use_cache
+        and settings.LLM_CACHE_ENABLED
+        and temperature <= settings.LLM_CACHE_MAX_TEMPERATURE
+    )
+    if cacheable:
+        cached = await LLM_CACHE.aget(key)
+        if cached is not None:
+            log.info(f"llm_cache_hit key={key[:12]}")
+            return cached
+
+    # 拷贝一份：调用方（例如 repair 循环）之后会继续 append messages
+    snapshot = list(messages)
+
+    # 不走缓存的调用单独合并，避免“要新鲜输出”的请求搭上可缓存请求的便车
+    flight_key = key if cacheable else f"nocache:{key}"
+    # 共享的上游调用按所有等待方里最晚的 deadline 重试，不受发起方（leader）预算的限制；
+    # 每个调用方自己的预算只用来限制它等多久（下面 do 的 timeout）
+    budget = LLM_SINGLEFLIGHT.shared_state(flight_key, lambda: SharedDeadline(deadline))
+    budget.join(deadline)
+
+    async def _fetch() -> str:
+        text = await _post_chat_completion(snapshot, temperature, user_id, budget)
+        if cacheable:
+            await LLM_CACHE.aset(key, text)
+        return text
+
+    try:
+        return await LLM_SINGLEFLIGHT.do(
+            flight_key, _fetch, timeout=deadline.remaining() if deadline is not None else None
+        )
+    except asyncio.TimeoutError:
+        # 等共享请求时把自己的预算等完了
+        raise DeadlineExceeded("deadline exceeded: waiting for in-flight llm call") from None
+
+
+async def forget_llm_response(messages: list[dict], temperature: float = 0.2) -> None:
+    """
+    把某次 call_llm 的缓存结果删掉：调用方发现输出解析 / 校验不过时调用，
+    否则同样的输入在 TTL 内会一直重放这次坏输出。
+    """
+    key = llm_request_key(settings.LLM_MODEL, temperature, messages)
+    await LLM_CACHE.adelete(key)
+    log.info(f"llm_cache_forget key={key[:12]}")
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    # 连接失败、读超时等网络层错误
+    return isinstance(exc, httpx.TransportError)
+
+
+def _retry_after_seconds(exc: Optional[BaseException]) -> float:
+    """
+    解析 Retry-After：支持秒数和 HTTP-date 两种格式；没有或解析失败返回 0。
+    """
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return 0.0
+    value = exc.response.headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, when.timestamp() - time.time())
+
+
+_backoff = wait_exponential(min=0.5, max=4)
+
+
+def _wait_backoff_or_retry_after(retry_state: RetryCallState) -> float:
+    """
+    退避时间 = max(指数退避, 服务端 Retry-After)，Retry-After 有上限。
+    """
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    retry_after = min(_retry_after_seconds(exc), settings.LLM_RETRY_AFTER_MAX_SEC)
+    return max(_backoff(retry_state), retry_after)
+
+
+def _stop_when_budget_exhausted(deadline: Optional[Deadline | SharedDeadline], stopped: Dict[str, bool]):
+    """
+    tenacity 先算 wait 再判断 stop：如果“等完这次退避后剩余预算”不够再做一次尝试，就不再重试。
+    因预算停下时在 stopped 里记一笔，调用方据此把最后一次的异常换成 DeadlineExceeded。
+    """
+    def _stop(retry_state: RetryCallState) -> bool:
+        if deadline is None:
+            return False
+        left = deadline.remaining() - (retry_state.upcoming_sleep or 0.0)
+        if left < settings.LLM_MIN_ATTEMPT_SEC:
+            log.warning(f"llm_retry_stopped budget_left={left:.2f}s attempt={retry_state.attempt_number}")
+            stopped["budget"] = True
+            return True
+        return False
+    return _stop
+
+
+def _llm_retrying(deadline: Optional[Deadline | SharedDeadline], stopped: Dict[str, bool]) -> AsyncRetrying:
+    return AsyncRetrying(
+        retry=retry_if_exception(_is_retryable),
+        stop=stop_after_attempt(settings.LLM_MAX_ATTEMPTS) | _stop_when_budget_exhausted(deadline, stopped),
+        wait=_wait_backoff_or_retry_after,
+        reraise=True,
+    )
+
+
+def _out_of_budget(exc: BaseException, deadline: Optional[Deadline | SharedDeadline], stopped: Dict[str, bool]) -> bool:
+    """
+    上游尝试失败是不是“预算用完”造成的：
+    - 重试因为剩余预算不够而停下
+    - 单次尝试的超时 / 准入排队时间被剩余预算截短，等到预算见底才失败
+    """
+    if deadline is None:
+        return False
+    if stopped.get("budget"):
+        return True
+    budget_bound = isinstance(exc, (httpx.TimeoutException, AdmissionTimeout))
+    return budget_bound and deadline.remaining() < settings.LLM_MIN_ATTEMPT_SEC
+
+
+async def _post_chat_completion(messages: list[dict], temperature: float, user_id: str | None,
+                                deadline: Optional[Deadline | SharedDeadline] = None) -> str:
+    """
+    真正的上游请求，带重试：
+    - 只重试网络错误和可重试状态码（429/5xx 等），4xx 直接抛出
+    - 退避时间遵守 Retry-After
+    - 剩余预算不够再做一次尝试时停止，抛出 DeadlineExceeded（from 最后一次的异常）
+    注意：名额是“每次尝试”申请的，退避等待期间不占并发名额，重试也要受限速约束。
+    """
     payload = {
         "model": settings.LLM_MODEL,
         "messages": messages,
-        "temperature": 0.2, # 控制输出的“随机”程度，0 到 1 之间
+        "temperature": temperature,
+    }
+    # 复用 app 级共享 client（连接池），不再每次新建连接
+    client = get_http_client()
+    stopped: Dict[str, bool] = {}
+
+    try:
+        async for attempt in _llm_retrying(deadline, stopped):
+            with attempt:
+                if deadline is not None:
+                    deadline.check("llm attempt")
+                admission = remaining_or(deadline, settings.LLM_ADMISSION_TIMEOUT_SEC)
+                async with LLM_LIMITER.slot(user_id, timeout=admission):
+                    resp = await client.post(
+                        f"{settings.LLM_BASE_URL}/chat/completions",
+                        json=payload,
+                        timeout=llm_timeout("chat", budget=deadline.remaining() if deadline is not None else None),
+                    )
+                resp.raise_for_status()
+                data = resp.json()
+                return data["choices"][0]["message"]["content"]
+    except (httpx.HTTPError, AdmissionTimeout) as e:
+        if _out_of_budget(e, deadline, stopped):
+            raise DeadlineExceeded(f"deadline exceeded: llm call ({e!r})") from e
+        raise
+
+
+async def _open_stream(payload: dict, user_id: str | None, deadline: Optional[Deadline]) -> httpx.Response:
+    """
+    打开一个流式响应（重试策略与非流式一致，只在“拿到首字节之前”重试）。
+    成功返回时仍然占着准入名额：由调用方在流结束后 aclose + release。
+    """
+    client = get_http_client()
+    stopped: Dict[str, bool] = {}
+    try:
+        async for attempt in _llm_retrying(deadline, stopped):
+            with attempt:
+                if deadline is not None:
+                    deadline.check("llm stream attempt")
+                admission = remaining_or(deadline, settings.LLM_ADMISSION_TIMEOUT_SEC)
+                await LLM_LIMITER.acquire(user_id, timeout=admission)
+                try:
+                    req = client.build_request(
+                        "POST",
+                        f"{settings.LLM_BASE_URL}/chat/completions",
+                        json=payload,
+                        timeout=llm_timeout("stream", budget=deadline.remaining() if deadline is not None else None),
+                    )
+                    resp = await client.send(req, stream=True)
+                    if resp.is_error:
+                        await resp.aread()
+                        await resp.aclose()
+                        resp.raise_for_status()
+                except BaseException:
+                    LLM_LIMITER.release()
+                    raise
+                return resp
+    except (httpx.HTTPError, AdmissionTimeout) as e:
+        if _out_of_budget(e, deadline, stopped):
+            raise DeadlineExceeded(f"deadline exceeded: llm stream ({e!r})") from e
+        raise
+
+
+async def stream_llm(messages: list[dict], temperature: float = 0.2, use_cache: bool = True,
+                     user_id: str | None = None, deadline: Optional[Deadline] = None) -> AsyncGenerator[str, None]:
+    """
+    流式版 call_llm：逐段 yield 模型输出的 delta。
+    - 与 call_llm 共用响应缓存：命中则一次性 yield 完整文本；完整流结束后写缓存
+    - 与 call_llm 共用准入层和重试策略（流开始之后不再重试）
+    - 流式请求不做 single-flight（每个调用方都要自己的增量输出）
+    """
+    if deadline is not None:
+        deadline.check("stream_llm")
+
+    key = llm_request_key(settings.LLM_MODEL, temperature, messages)
+    cacheable = (
+        use_cache
+        and settings.LLM_CACHE_ENABLED
+        and temperature <= settings.LLM_CACHE_MAX_TEMPERATURE
+    )
+    if cacheable:
+        cached = await LLM_CACHE.aget(key)
+        if cached is not None:
+            log.info(f"llm_cache_hit(stream) key={key[:12]}")
+            yield cached
+            return
+
+    payload = {
+        "model": settings.LLM_MODEL,
+        "messages": list(messages),
+        "temperature": temperature,
+        "stream": True,
     }
-    async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT_SEC) as client:
-        resp = await client.post(f"{settings.LLM_BASE_URL}/chat/completions", json=payload, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
+    resp = await _open_stream(payload, user_id, deadline)
+    parts: list[str] = []
+    completed = False
+    try:
+        async for line in resp.aiter_lines():
+            if not line or not line.startswith("data: "):
+                continue
+            data = line.removeprefix("data: ").strip()
+            if data == "[DONE]":
+                completed = True
+                break
+            try:
+                delta = json.loads(data)["choices"][0]["delta"].get("content")
+            except (ValueError, KeyError, IndexError, TypeError):
+                # 流式行解析失败，直接跳过即可（不要让接口崩）
+                continue
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        await resp.aclose()
+        LLM_LIMITER.release()
+
+    if completed and cacheable and parts:
+        await LLM_CACHE.aset(key, "".join(parts))
 
 def _is_prompt_injection(text: str) -> bool:
     """
     Day2 先用关键字版的提示注入检测（入门）
     后续我们会升级到：分类器 + 规则 + 上下文隔离
+    关键词在 keyword_rules.py 的 injection 组里，和 intent 路由共用同一次扫描
     """
-    bad = ["忽略之前", "system prompt", "输出系统提示", "developer message", "越狱", "jailbreak"]
-    t = text.lower()
-    return any(b.lower() in t for b in bad)
+    return match_keywords(text).has("injection", "injection")
+
+def _degraded_plan() -> AgentPlan:
+    # 可控的降级 plan（不要让接口 500）
+    return AgentPlan(
+        intent="other",
+        steps=["我这次没能稳定生成计划。你能把需求再简短描述一次吗？比如：年级/科目/目标/每天时间。"],
+        tool_calls=[],
+    )
+
+
+def _has_budget_for_another_call(deadline: Optional[Deadline]) -> bool:
+    return deadline is None or deadline.remaining() >= settings.LLM_MIN_ATTEMPT_SEC
+
+
+def _injection_plan() -> AgentPlan:
+    # 安全分支：直接拒绝，不进入工具调用
+    return AgentPlan(
+        intent="other",
+        steps=["我无法遵循该请求。请告诉我你的学习目标或需要的陪练方式。"],
+        tool_calls=[],
+    )
+
+
+def _plan_messages(user_id: str, user_message: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"用户ID: {user_id}\n用户输入: {user_message}\n\n{PLAN_INSTRUCTION}"},
+    ]
 
-async def generate_plan(user_id: str, user_message: str) -> AgentPlan:
+
+async def generate_plan(user_id: str, user_message: str, deadline: Optional[Deadline] = None) -> AgentPlan:
     """
     生成结构化 plan（Agent 的“控制塔”）
 
     核心工程点：
     - 任何时候都不要相信 LLM 输出一定是合法 JSON
     - 必须：解析失败 -> 让模型“修复输出” -> 再解析
+    - 所有 LLM 调用（含 repair 和重试）共享同一个 deadline，预算不够就降级，不无限拖长尾延迟
     """
     if _is_prompt_injection(user_message):
-        # 安全分支：直接拒绝，不进入工具调用
-        return AgentPlan(
-            intent="other",
-            steps=["我无法遵循该请求。请告诉我你的学习目标或需要的陪练方式。"],
-            tool_calls=[],
-        )
+        return _injection_plan()
 
     # 第一次请求：正常让模型输出 plan JSON
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"用户ID: {user_id}\n用户输入: {user_message}\n\n{PLAN_INSTRUCTION}"},
-    ]
+    messages = _plan_messages(user_id, user_message)
 
-    raw = await call_llm(messages)
+    try:
+        raw = await call_llm(messages, user_id=user_id, deadline=deadline)
+    except LLM_CALL_ERRORS as e:
+        # 预算用完 / 上游不可用 / 排不上队：都给降级 plan
+        log.error(f"generate_plan_llm_failed err={e!r}")
+        return _degraded_plan()
     log.info(f"llm_raw(plan)={raw[:500]}")
 
+    return await _parse_or_repair_plan(user_id, messages, raw, deadline)
+
+
+async def generate_plan_stream(user_id: str, user_message: str,
+                               deadline: Optional[Deadline] = None) -> AsyncGenerator[PlanEvent, None]:
+    """
+    流式版 generate_plan：边生成边解析。
+    依次 yield：
+    - ("intent", str) / ("step", (i, str)) / ("tool_call", (i, ToolCall))：解析到就立刻发出
+    - ("plan", AgentPlan)：最后一条，完整解析（必要时本地/LLM 修复）后的最终 plan
+    注意：最终 plan 以完整解析为准；已经发出的 tool_call 可能和最终 plan 对不上（被修复 / 降级），
+    执行结果以 ToolDispatcher.finish(最终 plan) 为准。
+    """
+    if _is_prompt_injection(user_message):
+        yield "plan", _injection_plan()
+        return
+
+    messages = _plan_messages(user_id, user_message)
+    parser = PlanStreamParser()
+    parts: list[str] = []
+    try:
+        async for delta in stream_llm(messages, user_id=user_id, deadline=deadline):
+            parts.append(delta)
+            for event in parser.feed(delta):
+                yield event
+    except LLM_CALL_ERRORS as e:
+        # 流到一半断了也一样：给降级 plan，SSE 正常收尾
+        log.error(f"generate_plan_llm_failed(stream) err={e!r}")
+        yield "plan", _degraded_plan()
+        return
+
+    raw = "".join(parts)
+    log.info(f"llm_raw(plan,stream)={raw[:500]}")
+    yield "plan", await _parse_or_repair_plan(user_id, messages, raw, deadline)
+
+
+async def _parse_or_repair_plan(user_id: str, messages: list[dict], raw: str,
+                                deadline: Optional[Deadline]) -> AgentPlan:
+    """
+    把模型原始输出解析成 AgentPlan，失败时让模型修复（流式/非流式共用）。
+    """
     # 解析 + 修复最多 2 次：总共最多 3 次尝试
+    # 每次先走本地修复（配平/语法修复/补齐截断 + schema 纠正），本地修不好才让 LLM 修
+    # 统计只记最终结果一次：第一次就解析成功记本地路径，LLM 修复后成功记 llm_repair，都失败记 failed
     last_err = None
     for attempt in range(3):
         try:
-            obj = extract_json_object(raw)  # 更鲁棒的提取
-            return AgentPlan.model_validate(obj)  # Pydantic 校验结构
+            plan, path = parse_model_locally(raw, AgentPlan)
+            record_repair_outcome(AgentPlan, path if attempt == 0 else "llm_repair")
+            return plan
         except Exception as e:
             last_err = e
-            # 让模型“修复输出”：
-            # - 把错误原因告诉模型
-            # - 明确要求：只输出 JSON，不要解释
-            repair_msg = (
-                "你刚才输出的内容无法被解析为合法 JSON。\n"
-                f"错误信息：{repr(e)}\n\n"
-                "请你只输出一个合法 JSON 对象（不要markdown，不要解释，不要额外文字），"
-                "字段必须包含 intent/steps/tool_calls。"
-            )
-            messages.append({"role": "assistant", "content": raw})
-            messages.append({"role": "user", "content": repair_msg})
-
-            raw = await call_llm(messages)
-            log.info(f"llm_raw(repair#{attempt+1})={raw[:500]}")
-
-    # 三次都失败：给一个可控的降级 plan（不要让接口 500）
+
+        # 最后一次解析失败 / 剩余预算不够再打一次 LLM：不再修复
+        if attempt == 2 or not _has_budget_for_another_call(deadline):
+            break
+
+        # 让模型“修复输出”：
+        # - 把错误原因告诉模型
+        # - 明确要求：只输出 JSON，不要解释
+        repair_msg = (
+            "你刚才输出的内容无法被解析为合法 JSON。\n"
+            f"错误信息：{repr(last_err)}\n\n"
+            "请你只输出一个合法 JSON 对象（不要markdown，不要解释，不要额外文字），"
+            "字段必须包含 intent/steps/tool_calls。"
+        )
+        messages.append({"role": "assistant", "content": raw})
+        messages.append({"role": "user", "content": repair_msg})
+
+        try:
+            raw = await call_llm(messages, user_id=user_id, deadline=deadline)
+        except LLM_CALL_ERRORS as e:
+            last_err = e
+            break
+        log.info(f"llm_raw(repair#{attempt+1})={raw[:500]}")
+
+    # 都失败：给一个可控的降级 plan（不要让接口 500）
+    record_repair_outcome(AgentPlan, "failed")
     log.error(f"generate_plan_failed err={repr(last_err)}")
-    return AgentPlan(
-        intent="other",
-        steps=["我这次没能稳定生成计划。你能把需求再简短描述一次吗？比如：年级/科目/目标/每天时间。"],
-        tool_calls=[],
-    )
+    return _degraded_plan()
+
+
+def _run_tool(user_id: str, tc: ToolCall) -> Dict[str, Any]:
+    """
+    执行单个工具调用：白名单 + 强制注入 user_id。
+    """
+    func = TOOL_REGISTRY.get(tc.name)
+    if not func:
+        return {"ok": False, "error": "tool_not_found"}
+
+    # 安全：强制注入 user_id，防止模型传其他人的 user_id
+    args = dict(tc.arguments or {})
+    args["user_id"] = user_id
+
+    try:
+        return func(**args)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
 
 async def run_tools(user_id: str, plan: AgentPlan) -> Dict[str, Any]:
     """
@@ -103,17 +490,66 @@ async def run_tools(user_id: str, plan: AgentPlan) -> Dict[str, Any]:
     """
     results: Dict[str, Any] = {}
     for i, tc in enumerate(plan.tool_calls[: settings.MAX_TOOL_STEPS]):
-        func = TOOL_REGISTRY.get(tc.name)
-        if not func:
-            results[f"{i}:{tc.name}"] = {"ok": False, "error": "tool_not_found"}
-            continue
+        results[f"{i}:{tc.name}"] = await run_blocking(_run_tool, user_id, tc, executor=TOOL_EXECUTOR)
+    return results
 
-        # 安全：强制注入 user_id，防止模型传其他人的 user_id
-        args = dict(tc.arguments or {})
-        args["user_id"] = user_id
 
-        try:
-            results[f"{i}:{tc.name}"] = func(**args)
-        except Exception as e:
-            results[f"{i}:{tc.name}"] = {"ok": False, "error": str(e)}
-    return results
+class ToolDispatcher:
+    """
+    配合 generate_plan_stream 使用：tool_call 一解析完整就立刻开始执行，不等整个 plan。
+    - 只提前执行只读工具（READ_ONLY_TOOLS），而且它前面的调用也都得是只读的：
+      前面有副作用的调用（比如 create_todo）要先执行，提前跑会读到旧数据，和 run_tools 的顺序语义不一致
+    - 仍然遵守 MAX_TOOL_STEPS、白名单和 user_id 注入
+    - finish(plan) 以最终 plan 为准：同一下标 name + arguments 都一致、且最终 plan 里它前面全是只读调用的
+      提前结果才保留；其它提前调用丢掉，剩下的按下标顺序逐个执行（和 run_tools 一样）
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._tasks: Dict[int, "asyncio.Task[Dict[str, Any]]"] = {}
+        self._calls: Dict[int, ToolCall] = {}
+        self._seen: Dict[int, ToolCall] = {}  # 流式解析出来的所有调用（包括没提前执行的）
+        self.discarded: List[str] = []  # 提前执行了、但和最终 plan 对不上的调用（"下标:工具名"）
+
+    @staticmethod
+    def _read_only_prefix(calls: List[Optional[ToolCall]]) -> bool:
+        return all(tc is not None and tc.name in READ_ONLY_TOOLS for tc in calls)
+
+    def dispatch(self, index: int, tc: ToolCall) -> None:
+        self._seen[index] = tc
+        if index >= settings.MAX_TOOL_STEPS or index in self._tasks:
+            return
+        if not self._read_only_prefix([self._seen.get(i) for i in range(index + 1)]):
+            return
+        log.info(f"tool_dispatch_early index={index} name={tc.name}")
+        self._calls[index] = tc
+        self._tasks[index] = asyncio.create_task(self._run(tc))
+
+    async def _run(self, tc: ToolCall) -> Dict[str, Any]:
+        return await run_blocking(_run_tool, self.user_id, tc, executor=TOOL_EXECUTOR)
+
+    @staticmethod
+    def _same_call(a: ToolCall, b: ToolCall) -> bool:
+        return a.name == b.name and (a.arguments or {}) == (b.arguments or {})
+
+    async def finish(self, plan: AgentPlan) -> Optional[Dict[str, Any]]:
+        final = plan.tool_calls[: settings.MAX_TOOL_STEPS]
+        for i in list(self._tasks):
+            if i < len(final) and self._same_call(self._calls[i], final[i]) and self._read_only_prefix(final[:i]):
+                continue
+            # 对不上最终 plan：不并进结果（只读工具，没有副作用）
+            self._tasks.pop(i).cancel()
+            stale = self._calls.pop(i)
+            self.discarded.append(f"{i}:{stale.name}")
+            log.warning(f"tool_dispatch_discarded index={i} name={stale.name} args={stale.arguments}")
+        if not final:
+            return None
+        results: Dict[str, Any] = {}
+        for i, tc in enumerate(final):
+            task = self._tasks.pop(i, None)
+            results[f"{i}:{tc.name}"] = await task if task is not None else await self._run(tc)
+        return results
+
+    def cancel(self) -> None:
+        for t in self._tasks.values():
+            t.cancel()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：deadline.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 单次请求的时间预算（deadline），沿调用链传递，所有 LLM 调用/重试共享同一个预算
+"""
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+    """请求的时间预算已经用完（或不够再做一次尝试）"""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """
+    用 monotonic 时钟记录“最晚什么时候必须结束”。
+    - 入口（API handler）创建一次：Deadline.after(settings.REQUEST_DEADLINE_SEC)
+    - 下游只读 remaining()，不自己重新计时
+    """
+    expires_at: float
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(expires_at=time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def check(self, what: str = "") -> None:
+        if self.expired:
+            raise DeadlineExceeded(f"deadline exceeded{': ' + what if what else ''}")
+
+
+class SharedDeadline:
+    """
+    几个请求合并成一次上游调用（single-flight）时，共享调用用的预算：跟着等待方里最晚的 deadline 走，
+    有一方不限时（None）就不限。接口和 Deadline 一样（remaining / expired / check），
+    这样共享调用不会因为发起它的那个请求预算短就提前放弃，把失败分给预算还充足的其它等待方；
+    每个等待方自己的预算由它等待共享结果时的超时来保证。
+    """
+
+    def __init__(self, deadline: Optional[Deadline]):
+        self.expires_at: Optional[float] = None if deadline is None else deadline.expires_at
+
+    def join(self, deadline: Optional[Deadline]) -> None:
+        if self.expires_at is None:
+            return
+        self.expires_at = None if deadline is None else max(self.expires_at, deadline.expires_at)
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def check(self, what: str = "") -> None:
+        if self.expired:
+            raise DeadlineExceeded(f"deadline exceeded{': ' + what if what else ''}")
+
+
+def remaining_or(deadline: Optional[Deadline], default: float) -> float:
+    """
+    没有 deadline 时用默认值；有 deadline 时取两者较小值。
+    """
+    if deadline is None:
+        return default
+    return min(default, deadline.remaining())
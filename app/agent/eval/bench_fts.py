@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：bench_fts.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 对比不同 FTS 分词模式：索引大小 / 入库耗时 / 查询延迟 / 命中率（能过拒答阈值的比例）
+
+用法：python app/agent/eval/bench_fts.py [--kb-dir data/kb] [--queries queries.txt]
+kb-dir 下没有文档时，用内置的小语料合成一份（只用来看相对差异）。
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag.answer import is_answerable
+from app.agent.rag.fts import FTS_MODES
+from app.agent.rag.ingest import reindex_kb
+from app.agent.rag.retriever import retrieve
+from app.infra.db import close_db, get_db
+from app.infra.settings import settings
+
+QUERIES = [
+    "STAR 方法怎么回答行为面试？请给我可执行建议",
+    "自我介绍应该包含哪些内容",
+    "B1 语法常见错误",
+    "口语流利度怎么提高",
+    "面试时如何介绍项目经历",
+    "时态用错了怎么办",
+    "动态规划题目的解题思路",
+    "how to structure a self introduction",
+]
+
+SAMPLE_SENTENCES = [
+    "行为面试推荐使用 STAR 方法：先讲情境，再讲任务，然后是行动，最后给出结果。",
+    "自我介绍控制在 30 到 60 秒，包含当前身份、擅长什么、最近一个项目亮点。",
+    "B1 学习者常见的语法错误包括冠词遗漏、时态混用和主谓不一致。",
+    "提高口语流利度：用短句完整表达，先保证说完整，再追求复杂句式。",
+    "介绍项目经历时突出你的角色、遇到的难点以及量化的结果。",
+    "时态错误可以通过复述练习纠正：先写下句子，再大声朗读并录音回听。",
+    "动态规划的解题思路：定义状态、写出转移方程、确定初始条件和计算顺序。",
+    "Use short complete sentences when speaking; fluency comes before complexity.",
+    "A good self introduction covers who you are, what you are good at, and a recent highlight.",
+    "每天安排 20 分钟跟读练习，重点关注连读和重音。",
+]
+
+
+def _synthetic_kb(root: Path, docs: int = 200, sentences_per_doc: int = 20) -> Path:
+    rnd = random.Random(0)
+    root.mkdir(parents=True, exist_ok=True)
+    for i in range(docs):
+        # 每篇只围绕两三个主题，否则所有 chunk 都包含所有词，bm25 的 idf 区分不出来
+        topics = rnd.sample(SAMPLE_SENTENCES, 3)
+        body = "\n".join(rnd.choice(topics) for _ in range(sentences_per_doc))
+        (root / f"doc_{i:03d}.md").write_text(f"# 文档 {i}\n\n{body}\n", encoding="utf-8")
+    return root
+
+
+def _index_bytes() -> int:
+    with get_db().connection() as conn:
+        row = conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'kb_chunk_fts%'"
+        ).fetchone()
+    return int(row[0] or 0)
+
+
+def bench_mode(mode: str, kb_dir: Path, queries, rounds: int, workdir: Path) -> dict:
+    settings.DB_PATH = str(workdir / f"bench_{mode}.db")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # reindex 的进度输出太多
+        reindex_kb(fts_mode=mode, kb_dir=kb_dir)
+    ingest_sec = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for q in queries:
+        chunks = retrieve(q, k=4)
+        # 和 ask_with_rag 用同一个拒答判断
+        if is_answerable(chunks):
+            hits += 1
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            retrieve(q, k=4)
+            latencies.append((time.perf_counter() - t0) * 1000)
+    latencies.sort()
+    result = {
+        "mode": mode,
+        "index_kb": _index_bytes() / 1024,
+        "ingest_sec": ingest_sec,
+        "p50_ms": median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "answerable": f"{hits}/{len(queries)}",
+    }
+    close_db()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--kb-dir", default="data/kb")
+    parser.add_argument("--queries", default=None, help="每行一个查询")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    queries = QUERIES
+    if args.queries:
+        queries = [l.strip() for l in Path(args.queries).read_text(encoding="utf-8").splitlines() if l.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        kb_dir = Path(args.kb_dir)
+        if not any(p.suffix.lower() in {".md", ".txt"} for p in kb_dir.glob("**/*")):
+            print(f"{kb_dir} has no documents, using a synthetic corpus")
+            kb_dir = _synthetic_kb(workdir / "kb")
+
+        print(f"{'mode':>10} {'index_kb':>9} {'ingest_s':>9} {'p50_ms':>7} {'p95_ms':>7} {'answerable':>10}")
+        for mode in FTS_MODES:
+            r = bench_mode(mode, kb_dir, queries, args.rounds, workdir)
+            print(f"{r['mode']:>10} {r['index_kb']:>9.0f} {r['ingest_sec']:>9.2f} "
+                  f"{r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f} {r['answerable']:>10}")
+
+
+if __name__ == "__main__":
+    main()
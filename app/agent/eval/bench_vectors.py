@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：bench_vectors.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 稠密检索的查询延迟：合成 N 个 chunk 的向量文件（默认 10 万），mmap 打开后测 search 的 p50/p95
+
+用法：python app/agent/eval/bench_vectors.py [--chunks 100000] [--dim 128]
+只测向量这一路（不含 SQLite），看的是矩阵扫描 + top-n 的开销随规模怎么变。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+sys.path.insert(0, project_root)
+
+from app.agent.eval.bench_fts import QUERIES, SAMPLE_SENTENCES
+from app.agent.rag.vectors import VectorIndex, _hashed_tf, write_vector_file
+from app.infra.settings import settings
+
+
+def _synthetic_file(path: Path, chunks: int, dim: int) -> None:
+    """
+    用内置样例句子的向量随机组合成 chunk（直接写矩阵，跳过逐条分词，10 万条也只要几秒）。
+    """
+    rnd = random.Random(0)
+    base = np.zeros((len(SAMPLE_SENTENCES), dim), dtype=np.float32)
+    for i, s in enumerate(SAMPLE_SENTENCES):
+        for bucket, w in _hashed_tf(s, dim).items():
+            base[i, bucket] = w
+    mix = np.zeros((chunks, len(SAMPLE_SENTENCES)), dtype=np.float32)
+    for row in range(chunks):
+        for j in rnd.sample(range(len(SAMPLE_SENTENCES)), 3):
+            mix[row, j] = rnd.random()
+    matrix = mix @ base
+    matrix += np.random.default_rng(0).normal(0, 0.05, matrix.shape).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    write_vector_file(path, np.arange(1, chunks + 1, dtype=np.int64), np.ones(dim, dtype=np.float32), matrix)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=settings.RAG_VECTOR_DIM)
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.kbvec"
+        start = time.perf_counter()
+        _synthetic_file(path, args.chunks, args.dim)
+        print(f"built {args.chunks} x {args.dim} ({path.stat().st_size / 1024 / 1024:.0f} MB) "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        index = VectorIndex(path)
+        print(f"open (mmap) {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        index.search(QUERIES[0], args.top_n)  # 第一次会把页读进页缓存
+        latencies = []
+        for _ in range(args.rounds):
+            for q in QUERIES:
+                t0 = time.perf_counter()
+                index.search(q, args.top_n)
+                latencies.append((time.perf_counter() - t0) * 1000)
+        latencies.sort()
+        print(f"search p50={median(latencies):.2f} ms p95={latencies[int(len(latencies) * 0.95) - 1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
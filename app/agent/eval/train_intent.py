@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：train_intent.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 离线训练本地意图模型，并输出准确率 / 覆盖率 / 延迟报告
+
+用法：
+  python app/agent/eval/train_intent.py --log logs/app.log --out data/intent_model.bin
+  python app/agent/eval/train_intent.py --data extra_cases.jsonl   # {"text","intent","domain"} 每行一条
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from statistics import median
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+sys.path.insert(0, project_root)
+
+from app.agent.intent_model import IntentModel, load_samples_from_log
+from app.infra.settings import settings
+
+THRESHOLDS = [0.5, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+
+def load_samples(log_paths, data_paths):
+    samples = []
+    for p in log_paths:
+        with open(p, encoding="utf-8") as f:
+            samples += load_samples_from_log(f)
+    for p in data_paths:
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    samples.append((r["text"], {"intent": r["intent"], "domain": r["domain"]}))
+    # 同一句话以最后一次的决策为准
+    return list({text: (text, y) for text, y in samples}.values())
+
+
+def report(model: IntentModel, holdout) -> None:
+    latencies = []
+    rows = []
+    for text, y in holdout:
+        start = time.perf_counter()
+        pred = model.predict(text)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        rows.append((pred, y))
+
+    n = len(rows)
+    for head in ("intent", "domain"):
+        acc = sum(pred[head][0] == y[head] for pred, y in rows) / n
+        print(f"{head:>7} accuracy={acc:.3f}")
+
+    # 线上只在 domain/intent 都达到阈值时才跳过 LLM：覆盖率 = 省掉的 LLM 调用比例
+    print(f"\n{'threshold':>9} {'coverage':>9} {'accuracy':>9}")
+    for th in THRESHOLDS:
+        accepted = [(p, y) for p, y in rows if p["domain"][1] >= th and p["intent"][1] >= th]
+        cov = len(accepted) / n
+        acc = sum(p["domain"][0] == y["domain"] and p["intent"][0] == y["intent"] for p, y in accepted)
+        acc = acc / len(accepted) if accepted else 0.0
+        mark = "  <- INTENT_MODEL_MIN_CONFIDENCE" if th == settings.INTENT_MODEL_MIN_CONFIDENCE else ""
+        print(f"{th:>9.2f} {cov:>9.3f} {acc:>9.3f}{mark}")
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(f"\npredict latency p50={median(latencies):.1f}us p95={p95:.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", action="append", default=[], help="线上日志（含 intent(llm)= 行）")
+    parser.add_argument("--data", action="append", default=[], help="标注好的 jsonl")
+    parser.add_argument("--out", default=settings.INTENT_MODEL_PATH)
+    parser.add_argument("--dim", type=int, default=1 << 15, help="特征哈希桶数")
+    parser.add_argument("--alpha", type=float, default=0.1, help="拉普拉斯平滑")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    samples = load_samples(args.log, args.data)
+    if len(samples) < 10:
+        sys.exit(f"too few samples: {len(samples)}")
+    print(f"samples={len(samples)}")
+
+    rnd = random.Random(args.seed)
+    rnd.shuffle(samples)
+    cut = max(1, int(len(samples) * args.holdout))
+    holdout, train = samples[:cut], samples[cut:]
+
+    start = time.perf_counter()
+    model = IntentModel.train(train, dim=args.dim, alpha=args.alpha)
+    print(f"train={len(train)} holdout={len(holdout)} train_sec={time.perf_counter() - start:.2f}\n")
+    report(model, holdout)
+
+    # 报告用留出集，最终上线的模型用全部数据
+    final = IntentModel.train(samples, dim=args.dim, alpha=args.alpha)
+    final.save(args.out)
+    start = time.perf_counter()
+    IntentModel.load(args.out)
+    size_kb = os.path.getsize(args.out) / 1024
+    print(f"\nsaved {args.out} size={size_kb:.0f}KB load_ms={(time.perf_counter() - start) * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()
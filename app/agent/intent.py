@@ -1,8 +1,17 @@
+import json
 import logging
-from app.agent.core import call_llm
-from app.agent.json_utils import extract_json_object
+from typing import Optional
+
+from pydantic import ValidationError
+
+from app.agent.core import LLM_CALL_ERRORS, call_llm, forget_llm_response
+from app.agent.deadline import Deadline
+from app.agent.intent_model import get_intent_model
+from app.agent.json_utils import parse_model_with_repair
+from app.agent.keyword_rules import match_keywords
 from app.agent.schemas import IntentResult
 from app.agent.prompts import SYSTEM_PROMPT
+from app.infra.settings import settings
 
 log = logging.getLogger("intent")
 
@@ -21,59 +30,105 @@ def classify_intent_rule_based(user_message: str) -> IntentResult:
     - 面试时你能解释“为什么这么判”
     """
 
-    msg = user_message.lower()
+    # 一次扫描拿到所有 domain / intent 命中（规则表见 keyword_rules.py）
+    hits = match_keywords(user_message)
 
     # ---------- domain 规则：口语优先 ----------
-    has_speaking = any(k in msg for k in ["口语", "发音", "对话", "听说", "spoken", "speaking"])
-    has_interview = any(k in msg for k in ["面试", "自我介绍", "behavior", "interview", "简历"])
-    has_problem = any(k in msg for k in ["解题", "题目", "推导", "证明", "算法题", "代码题", "leetcode"])
-
     # 优先级：speaking > problem_solving > interview
-    if has_speaking:
+    if hits.has("domain", "speaking"):
         domain = "speaking"
-    elif has_problem:
+    elif hits.has("domain", "problem_solving"):
         domain = "problem_solving"
-    elif has_interview:
+    elif hits.has("domain", "interview"):
         domain = "interview"
     else:
         domain = "unknown"
 
     # ---------- intent 规则 ----------
-    has_plan = any(k in msg for k in ["计划", "安排", "日程", "每日任务", "一周", "规划"])
-    has_practice = any(k in msg for k in ["陪练", "练习", "模拟", "角色扮演", "对练"])
-    has_tutor = any(k in msg for k in ["讲解", "辅导", "为什么", "怎么理解", "帮我解释"])
-
     # intent 优先级：plan > practice > tutor > other
-    if has_plan:
+    if hits.has("intent", "plan"):
         intent = "plan"
-    elif has_practice:
+    elif hits.has("intent", "practice"):
         intent = "practice"
-    elif has_tutor:
+    elif hits.has("intent", "tutor"):
         intent = "tutor"
     else:
         intent = "other"
 
     return IntentResult(intent=intent, domain=domain)
 
-async def classify_intent(user_message: str) -> IntentResult:
+def classify_intent_model(user_message: str, rule_result: IntentResult) -> Optional[IntentResult]:
     """
-    最终对外的 intent 分类函数：
-    1) 先规则分类
-    2) 如果规则得出 unknown，再请求 LLM（兜底）
+    本地模型分类（中间层）：
+    - 没有模型文件 / 置信度低于阈值 -> None，交给 LLM
+    - 规则已经命中的 intent 优先（规则更可控），模型只补规则判不出来的部分
+    """
+    model = get_intent_model()
+    if model is None:
+        return None
+    pred = model.predict(user_message)
+    threshold = settings.INTENT_MODEL_MIN_CONFIDENCE
+    domain, domain_p = pred["domain"]
+    if domain_p < threshold:
+        return None
+    if rule_result.intent != "other":
+        intent = rule_result.intent
+    else:
+        intent, intent_p = pred["intent"]
+        if intent_p < threshold:
+            return None
+    result = IntentResult(intent=intent, domain=domain)
+    log.info(f"intent(model)={result.model_dump()} p={domain_p:.3f}")
+    return result
+
+def classify_intent_local(user_message: str) -> Optional[IntentResult]:
+    """
+    只用本地手段（规则 + 本地模型）分类，不调 LLM。
+    判不出来返回 None：调用方据此决定要不要走 LLM（以及要不要提前投机生成 plan）。
     """
     rule_result = classify_intent_rule_based(user_message)
     if rule_result.domain != "unknown":
         log.info(f"intent(rule)={rule_result.model_dump()}")
         return rule_result
+    return classify_intent_model(user_message, rule_result)
 
-    # 兜底：规则无法判断时才用 LLM
+async def classify_intent_llm(user_message: str, user_id: str | None = None,
+                              deadline: Optional[Deadline] = None) -> IntentResult:
+    """
+    LLM 兜底分类；时间预算不够 / 上游调用失败 / 输出解析不了时直接用规则结果（unknown），不让分类拖垮整个请求。
+    """
+    rule_result = classify_intent_rule_based(user_message)
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": f"用户输入：{user_message}\n\n{INTENT_PROMPT}"},
     ]
-    raw = await call_llm(messages)
+    try:
+        raw = await call_llm(messages, user_id=user_id, deadline=deadline)
+    except LLM_CALL_ERRORS as e:
+        log.warning(f"intent_llm_failed err={e!r} fallback={rule_result.model_dump()}")
+        return rule_result
     log.info(f"llm_raw(intent)={raw[:200]}")
-    obj = extract_json_object(raw)
-    llm_result = IntentResult.model_validate(obj)
-    log.info(f"intent(llm)={llm_result.model_dump()}")
+    try:
+        llm_result = parse_model_with_repair(raw, IntentResult)
+    except (ValueError, ValidationError) as e:
+        # 坏输出已经进了 LLM 缓存：删掉，下次同样的输入重新问
+        log.warning(f"intent_llm_unparseable err={e!r} fallback={rule_result.model_dump()}")
+        await forget_llm_response(messages)
+        return rule_result
+    # 带上原文：这些日志就是本地模型的训练数据（app/agent/eval/train_intent.py）
+    log.info(f"intent(llm)={json.dumps({'text': user_message, **llm_result.model_dump()}, ensure_ascii=False)}")
     return llm_result
+
+async def classify_intent(user_message: str, user_id: str | None = None,
+                          deadline: Optional[Deadline] = None) -> IntentResult:
+    """
+    最终对外的 intent 分类函数：
+    1) 先规则分类
+    2) 如果规则得出 unknown，先问本地模型（置信度够就直接用）
+    3) 模型也拿不准，再请求 LLM（兜底）
+    4) 时间预算不够时直接用规则结果（unknown），不让分类拖垮整个请求
+    """
+    local_result = classify_intent_local(user_message)
+    if local_result is not None:
+        return local_result
+    return await classify_intent_llm(user_message, user_id=user_id, deadline=deadline)
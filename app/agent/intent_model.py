@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：intent_model.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 本地意图分类模型（字符 n-gram + 特征哈希 + 朴素贝叶斯），规则和 LLM 之间的中间层
+"""
+import json
+import logging
+import math
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.infra.settings import settings
+
+log = logging.getLogger("intent_model")
+
+# 文件格式：MAGIC | version(u16) | header_len(u32) | header(JSON) | 每个 head 一段 float32 权重
+# 权重按 feature 主序排列：weights[f * n_labels + label]，打分时同一个特征的各 label 连续读取
+MAGIC = b"EAIM"
+VERSION = 1
+_PREFIX = struct.Struct("<4sHI")
+
+# 训练样本：(text, {"intent": ..., "domain": ...})
+Sample = Tuple[str, Dict[str, str]]
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def featurize(text: str, dim: int, ngrams: Sequence[int] = (1, 2, 3)) -> List[int]:
+    """
+    字符 n-gram（中文不用分词）哈希到 [0, dim)，只保留出现与否。
+    用 crc32 而不是 hash()：后者每个进程随机化，训练和线上会对不上。
+    """
+    t = " " + _SPACE_RE.sub(" ", (text or "").lower()).strip() + " "
+    feats = set()
+    for n in ngrams:
+        for i in range(len(t) - n + 1):
+            feats.add(zlib.crc32(t[i : i + n].encode("utf-8")) % dim)
+    return sorted(feats)
+
+
+@dataclass
+class _Head:
+    labels: List[str]
+    priors: List[float]  # log P(label)
+    weights: array  # float32，log P(feature | label)
+
+
+class IntentModel:
+    """
+    两个 head（intent / domain）共享同一套特征，各自一个多项式朴素贝叶斯。
+    输出的概率是 softmax 后的后验，用来和阈值比较决定要不要再问 LLM。
+    """
+
+    def __init__(self, dim: int, ngrams: Sequence[int], heads: Dict[str, _Head], meta: Optional[dict] = None):
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+        self.heads = heads
+        self.meta = meta or {}
+
+    # ---------- 训练 ----------
+    @classmethod
+    def train(cls, samples: Iterable[Sample], dim: int = 1 << 15, ngrams: Sequence[int] = (1, 2, 3),
+              alpha: float = 0.1) -> "IntentModel":
+        samples = list(samples)
+        feats = [featurize(text, dim, ngrams) for text, _ in samples]
+        heads: Dict[str, _Head] = {}
+        for head in ("intent", "domain"):
+            docs = Counter(y[head] for _, y in samples)
+            labels = sorted(docs)
+            k = len(labels)
+            counts = [[0] * dim for _ in labels]
+            totals = [0] * k
+            for f, (_, y) in zip(feats, samples):
+                li = labels.index(y[head])
+                row = counts[li]
+                for idx in f:
+                    row[idx] += 1
+                totals[li] += len(f)
+            weights = array("f", bytes(4 * dim * k))
+            for li in range(k):
+                denom = math.log(totals[li] + alpha * dim)
+                row = counts[li]
+                for idx in range(dim):
+                    weights[idx * k + li] = math.log(row[idx] + alpha) - denom
+            priors = [math.log(docs[label] / len(samples)) for label in labels]
+            heads[head] = _Head(labels, priors, weights)
+        meta = {"n_samples": len(samples), "alpha": alpha, "trained_at": int(time.time())}
+        return cls(dim, ngrams, heads, meta)
+
+    # ---------- 推理 ----------
+    def predict(self, text: str) -> Dict[str, Tuple[str, float]]:
+        """
+        返回 {head: (label, prob)}
+        """
+        feats = featurize(text, self.dim, self.ngrams)
+        out: Dict[str, Tuple[str, float]] = {}
+        for name, head in self.heads.items():
+            k = len(head.labels)
+            w = head.weights
+            scores = list(head.priors)
+            for idx in feats:
+                base = idx * k
+                for li in range(k):
+                    scores[li] += w[base + li]
+            top = max(scores)
+            exps = [math.exp(s - top) for s in scores]
+            best = scores.index(top)
+            out[name] = (head.labels[best], exps[best] / sum(exps))
+        return out
+
+    # ---------- 存取 ----------
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = {
+            "dim": self.dim,
+            "ngrams": list(self.ngrams),
+            "heads": {name: {"labels": h.labels, "priors": h.priors} for name, h in self.heads.items()},
+            "meta": self.meta,
+        }
+        raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, VERSION, len(raw)))
+            f.write(raw)
+            for h in self.heads.values():
+                w = h.weights
+                if sys.byteorder != "little":
+                    w = array("f", w)
+                    w.byteswap()
+                f.write(w.tobytes())
+        tmp.replace(path)  # 原子替换，线上进程不会读到写了一半的文件
+
+    @classmethod
+    def load(cls, path: str | Path) -> "IntentModel":
+        data = Path(path).read_bytes()
+        magic, version, header_len = _PREFIX.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not an intent model file: {path}")
+        offset = _PREFIX.size
+        header = json.loads(data[offset : offset + header_len])
+        offset += header_len
+        dim = header["dim"]
+        heads: Dict[str, _Head] = {}
+        for name, h in header["heads"].items():
+            size = 4 * dim * len(h["labels"])
+            weights = array("f")
+            weights.frombytes(data[offset : offset + size])
+            if sys.byteorder != "little":
+                weights.byteswap()
+            offset += size
+            heads[name] = _Head(h["labels"], h["priors"], weights)
+        return cls(dim, header["ngrams"], heads, header.get("meta"))
+
+
+def load_samples_from_log(lines: Iterable[str]) -> List[Sample]:
+    """
+    从线上日志里捞 intent(llm) 的决策当训练数据。
+    日志行是 JsonFormatter 输出的 JSON（msg 字段），也兼容直接的文本行。
+    """
+    prefix = "intent(llm)="
+    samples: List[Sample] = []
+    for line in lines:
+        line = line.strip()
+        if prefix not in line:
+            continue
+        try:
+            msg = json.loads(line).get("msg", "") if line.startswith("{") else line
+            record = json.loads(msg[msg.index(prefix) + len(prefix):])
+        except (ValueError, AttributeError):
+            continue
+        if isinstance(record, dict) and record.get("text") and record.get("intent") and record.get("domain"):
+            samples.append((record["text"], {"intent": record["intent"], "domain": record["domain"]}))
+    return samples
+
+
+_model: Optional[IntentModel] = None
+_model_loaded = False
+
+
+def load_intent_model() -> Optional[IntentModel]:
+    """
+    启动时加载（文件不存在就返回 None，中间层直接跳过）。
+    """
+    global _model, _model_loaded
+    path = Path(settings.INTENT_MODEL_PATH)
+    _model_loaded = True
+    if not path.exists():
+        log.info(f"intent_model_missing path={path}")
+        _model = None
+        return None
+    start = time.perf_counter()
+    try:
+        _model = IntentModel.load(path)
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        log.error(f"intent_model_load_failed path={path} err={e!r}")
+        _model = None
+        return None
+    log.info(
+        f"intent_model_loaded path={path} samples={_model.meta.get('n_samples')} "
+        f"ms={(time.perf_counter() - start) * 1000:.1f}"
+    )
+    return _model
+
+
+def get_intent_model() -> Optional[IntentModel]:
+    if not _model_loaded:
+        return load_intent_model()
+    return _model
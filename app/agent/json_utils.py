@@ -7,7 +7,21 @@
 @note: 
 """
 import json
-from typing import Any, Dict
+import logging
+import re
+import typing
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+log = logging.getLogger("json_utils")
+
+M = TypeVar("M", bound=BaseModel)
+
+# 每种 schema 每次解析的最终结果（每次只记一条）：strict / balanced / syntax_fix / truncated / llm_repair / failed
+JSON_REPAIR_STATS: Dict[str, Counter] = defaultdict(Counter)
+
 
 def extract_json_object(text: str) -> Dict[str, Any]:
     """
@@ -18,14 +32,7 @@ def extract_json_object(text: str) -> Dict[str, Any]:
     - 有时会在 JSON 前后加解释文字
     - 我们要尽量从中切出一个合法 JSON，再交给 json.loads
     """
-    t = text.strip()
-
-    # 1) 去掉常见的代码块围栏
-    if t.startswith("```"):
-        # 兼容 ```json 或 ```
-        t = t.removeprefix("```json").removeprefix("```").strip()
-    if t.endswith("```"):
-        t = t.removesuffix("```").strip()
+    t = _strip_fence(text)
 
     # 2) 定位 JSON 对象的起止：从第一个 { 到最后一个 }
     start = t.find("{")
@@ -38,3 +45,287 @@ def extract_json_object(text: str) -> Dict[str, Any]:
     # 3) 解析 JSON
     return json.loads(candidate)
 
+
+def _strip_fence(text: str) -> str:
+    t = (text or "").strip()
+
+    # 1) 去掉常见的代码块围栏
+    if t.startswith("```"):
+        # 兼容 ```json 或 ```
+        t = t.removeprefix("```json").removeprefix("```").strip()
+    if t.endswith("```"):
+        t = t.removesuffix("```").strip()
+    return t
+
+
+def _first_balanced_object(text: str) -> Optional[str]:
+    """
+    找第一个括号配平的 {...}（会跳过字符串里的括号）。
+    比“第一个 { 到最后一个 }”更稳：JSON 后面的解释文字里再出现 } 也不受影响。
+    没配平（被截断）时返回 None。
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    depth = 0
+    quote = ""
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = ""
+            continue
+        if ch in "\"'":
+            quote = ch
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start : i + 1]
+    return None
+
+
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _fix_syntax(text: str) -> str:
+    """
+    单遍修复常见语法问题（字符串内部的内容不动）：
+    - 单引号字符串 -> 双引号
+    - Python 字面量 True/False/None -> true/false/null
+    - 没加引号的 key -> 加引号
+    - 结尾多余的逗号：{"a": 1,} / [1, 2,]
+    """
+    out: List[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == '"':
+            # 原样拷贝双引号字符串
+            j = i + 1
+            while j < n:
+                if text[j] == "\\":
+                    j += 2
+                    continue
+                if text[j] == '"':
+                    break
+                j += 1
+            out.append(text[i : j + 1])
+            i = j + 1
+        elif ch == "'":
+            # 单引号字符串：转成双引号，内部的 " 需要转义，\' 还原为 '
+            j = i + 1
+            buf: List[str] = []
+            while j < n and text[j] != "'":
+                if text[j] == "\\" and j + 1 < n:
+                    buf.append("'" if text[j + 1] == "'" else text[j : j + 2])
+                    j += 2
+                    continue
+                buf.append('\\"' if text[j] == '"' else text[j])
+                j += 1
+            out.append('"' + "".join(buf) + '"')
+            i = j + 1
+        elif ch.isalpha() or ch == "_":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            k = j
+            while k < n and text[k] in " \t\r\n":
+                k += 1
+            if k < n and text[k] == ":":
+                out.append(f'"{word}"')
+            else:
+                out.append(_LITERALS.get(word, word))
+            i = j
+        elif ch in "}]":
+            # 去掉结尾多余的逗号
+            while out and out[-1].strip() in ("", ","):
+                if out[-1].strip() == ",":
+                    out.pop()
+                    break
+                out.pop()
+            out.append(ch)
+            i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def _close_truncated(text: str) -> Optional[str]:
+    """
+    修复被截断的 JSON：补上未闭合的字符串/括号，丢掉最后不完整的 key 或逗号。
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    t = text[start:]
+    stack: List[str] = []
+    in_str = False
+    escaped = False
+    for ch in t:
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if not stack and not in_str:
+        return None  # 不是截断问题
+
+    if in_str:
+        if escaped:
+            t = t[:-1]
+        t += '"'
+    t = t.rstrip()
+    # 末尾是 `"key":` 或 `"key"`（对象里还没写值）或逗号：去掉这些不完整的尾巴
+    t = re.sub(r',?\s*"[^"]*"\s*:\s*$', "", t)
+    if stack and stack[-1] == "}":
+        t = re.sub(r',\s*"[^"]*"\s*$', "", t)
+    t = t.rstrip().rstrip(",").rstrip()
+    return t + "".join(reversed(stack))
+
+
+def _strategies(text: str) -> List[Tuple[str, Callable[[], Optional[str]]]]:
+    t = _strip_fence(text)
+
+    def strict() -> Optional[str]:
+        start, end = t.find("{"), t.rfind("}")
+        return t[start : end + 1] if start != -1 and end > start else None
+
+    def balanced() -> Optional[str]:
+        return _first_balanced_object(t)
+
+    def syntax_fix() -> Optional[str]:
+        cand = _first_balanced_object(t) or strict()
+        return _fix_syntax(cand) if cand else None
+
+    def truncated() -> Optional[str]:
+        start = t.find("{")
+        if start == -1:
+            return None
+        return _close_truncated(_fix_syntax(t[start:]))
+
+    return [("strict", strict), ("balanced", balanced), ("syntax_fix", syntax_fix), ("truncated", truncated)]
+
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _coerce_value(value: Any, annotation: Any) -> Any:
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+
+    if origin is typing.Union:
+        non_none = [a for a in args if a is not type(None)]
+        if value is None or len(non_none) != 1:
+            return value
+        return _coerce_value(value, non_none[0])
+
+    if annotation is int and isinstance(value, (str, float)) and not isinstance(value, bool):
+        # "8" / "8/10" / 7.5 -> 8
+        m = _NUMBER_RE.search(str(value))
+        return int(round(float(m.group()))) if m else value
+
+    if origin in (list, List):
+        item_type = args[0] if args else Any
+        if isinstance(value, str):
+            value = [value]
+        if isinstance(value, list) and item_type is str:
+            return [v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) for v in value if v is not None]
+        return value
+
+    if origin is typing.Literal and isinstance(value, str):
+        v = value.strip().lower()
+        return v if v in args else value
+
+    if annotation is str and isinstance(value, list):
+        return "\n".join(str(v) for v in value)
+
+    return value
+
+
+def coerce_to_schema(obj: Dict[str, Any], schema: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    按 schema 做宽松纠正：丢掉未知字段、字符串数字转 int、单个字符串包成列表、枚举值大小写归一等。
+    只做“意图明确”的修正，真正的校验仍交给 Pydantic。
+    """
+    fields = schema.model_fields
+    out: Dict[str, Any] = {}
+    for name, value in obj.items():
+        field = fields.get(name)
+        if field is None:
+            continue
+        out[name] = _coerce_value(value, field.annotation)
+    return out
+
+
+def parse_model_locally(text: str, schema: Type[M]) -> Tuple[M, str]:
+    """
+    本地多策略解析 + schema 纠正，成功返回 (结果, 命中的路径)，不花 LLM 调用，也不记统计：
+    1) strict：第一个 { 到最后一个 }
+    2) balanced：第一个括号配平的对象（忽略后面的解释文字）
+    3) syntax_fix：修复单引号/尾逗号/Python 字面量/裸 key
+    4) truncated：补齐被截断的字符串和括号
+    每个候选都先 json.loads，再 coerce_to_schema，最后 Pydantic 校验。
+    全部失败抛出最后一个错误，由调用方决定是否让 LLM 修复。
+    """
+    last_err: Exception = ValueError("No JSON object boundaries found in LLM output.")
+    tried = set()
+    for name, build in _strategies(text):
+        candidate = build()
+        if not candidate or candidate in tried:
+            continue
+        tried.add(candidate)
+        try:
+            obj = json.loads(candidate, strict=False)
+            if not isinstance(obj, dict):
+                raise ValueError("JSON root is not an object")
+            result = schema.model_validate(coerce_to_schema(obj, schema))
+        except (ValueError, ValidationError) as e:
+            last_err = e
+            continue
+        if name != "strict":
+            log.info(f"json_local_repair ok schema={schema.__name__} path={name}")
+        return result, name
+    raise last_err
+
+
+def parse_model_with_repair(text: str, schema: Type[M]) -> M:
+    """
+    parse_model_locally + 记一次结果（命中的路径 / failed）。
+    自己还会让 LLM 修复的调用方（_parse_or_repair_plan）用 parse_model_locally，整个流程结束再记一次。
+    """
+    try:
+        result, path = parse_model_locally(text, schema)
+    except (ValueError, ValidationError):
+        record_repair_outcome(schema, "failed")
+        raise
+    record_repair_outcome(schema, path)
+    return result
+
+
+def record_repair_outcome(schema: Type[BaseModel], path: str) -> None:
+    """
+    记录一次解析的最终结果：每次解析只记一条（本地路径 / llm_repair / failed）。
+    """
+    JSON_REPAIR_STATS[schema.__name__][path] += 1
+
+
+def json_repair_stats() -> Dict[str, Dict[str, int]]:
+    return {k: dict(v) for k, v in JSON_REPAIR_STATS.items()}
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：keyword_rules.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 关键词规则表 + 编译好的多模式匹配器（intent/domain 路由 + 提示注入检测，一次扫描全部命中）
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from app.infra.settings import settings
+
+log = logging.getLogger("keyword_rules")
+
+# 声明式规则表：group -> label -> 关键词
+# - domain/intent 的优先级由 intent.py 决定，这里只负责“命中了什么”
+# - 需要加词时优先改 data/keyword_rules.json（热加载，不用重启）
+DEFAULT_RULES: Dict[str, Dict[str, List[str]]] = {
+    "domain": {
+        "speaking": ["口语", "发音", "对话", "听说", "spoken", "speaking"],
+        "interview": ["面试", "自我介绍", "behavior", "interview", "简历"],
+        "problem_solving": ["解题", "题目", "推导", "证明", "算法题", "代码题", "leetcode"],
+    },
+    "intent": {
+        "plan": ["计划", "安排", "日程", "每日任务", "一周", "规划"],
+        "practice": ["陪练", "练习", "模拟", "角色扮演", "对练"],
+        "tutor": ["讲解", "辅导", "为什么", "怎么理解", "帮我解释"],
+    },
+    "injection": {
+        "injection": ["忽略之前", "system prompt", "输出系统提示", "developer message", "越狱", "jailbreak"],
+    },
+}
+
+Tag = Tuple[str, str]  # (group, label)
+
+
+@dataclass(frozen=True)
+class KeywordHits:
+    """一次扫描的全部命中：{(group, label), ...}"""
+    tags: FrozenSet[Tag] = frozenset()
+
+    def labels(self, group: str) -> FrozenSet[str]:
+        return frozenset(label for g, label in self.tags if g == group)
+
+    def has(self, group: str, label: str) -> bool:
+        return (group, label) in self.tags
+
+
+NO_HITS = KeywordHits()
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """
+    把关键词按公共前缀合并成一个 trie 形状的正则（re 逐字符分支，不用逐个关键词尝试）。
+    可选的后缀是贪婪的：同一个起点总是匹配最长的关键词。
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        alts = [re.escape(ch) + build(sub) for ch, sub in sorted(node.items()) if ch != ""]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            return f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+
+def _straddlers(words: List[str]) -> Dict[str, List[Tuple[str, int]]]:
+    """
+    “跨边界重叠”的关键词对：A 的后缀 == B 的前缀（且互不包含），例如 讲解 / 解题。
+    返回 A -> [(B, B 在 A 里的起始偏移)]，命中 A 之后只需在这几个位置 startswith 检查一下 B。
+    """
+    out: Dict[str, List[Tuple[str, int]]] = {}
+    for a in words:
+        for b in words:
+            if a == b or a in b or b in a:
+                continue
+            for n in range(1, min(len(a), len(b))):
+                if a[-n:] == b[:n]:
+                    out.setdefault(a, []).append((b, len(a) - n))
+    return out
+
+
+class KeywordMatcher:
+    """
+    多模式关键词匹配器：构建一次，之后每条消息只扫描一遍（在 re 的 C 实现里完成）。
+
+    正确性（非重叠扫描也不漏词）：
+    - trie 正则在每个起点匹配最长关键词；每个关键词的 tag 预先并上“被它包含的关键词”的 tag，
+      所以被长词覆盖的短词不会漏
+    - 起点落在某个命中内部、又伸出去的词（讲解题 里的 解题），构建时预先算好，
+      命中后只在固定偏移做 startswith 检查
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, List[str]]], version: str = "default", memo_size: int = 256):
+        self.rules = rules
+        self.version = version
+        tags: Dict[str, Set[Tag]] = {}
+        for group, labels in rules.items():
+            for label, words in labels.items():
+                for w in words:
+                    w = w.strip().lower()
+                    if w:
+                        tags.setdefault(w, set()).add((group, label))
+
+        words = sorted(tags)
+        # 包含关系闭包：长词命中时，它包含的短词也算命中
+        self._tags: Dict[str, FrozenSet[Tag]] = {
+            w: frozenset().union(*(tags[o] for o in words if o in w)) for w in words
+        }
+        self._straddle = _straddlers(words)
+        self._pattern = re.compile(_trie_pattern(words) if words else "(?!)")
+        self._memo: "OrderedDict[str, KeywordHits]" = OrderedDict()
+        self._memo_size = memo_size
+        self._memo_lock = threading.Lock()
+
+    def match(self, text: str) -> KeywordHits:
+        """
+        一次扫描返回所有 group 的命中。
+        同一条消息在一次请求里会被路由和注入检测各查一次，这里做个小 LRU 避免重复扫描。
+        """
+        t = (text or "").lower()
+        with self._memo_lock:
+            cached = self._memo.get(t)
+            if cached is not None:
+                self._memo.move_to_end(t)
+                return cached
+
+        found: Set[Tag] = set()
+        for m in self._pattern.finditer(t):
+            word = m.group()
+            found |= self._tags[word]
+            for other, offset in self._straddle.get(word, ()):
+                if t.startswith(other, m.start() + offset):
+                    found |= self._tags[other]
+        hits = KeywordHits(frozenset(found)) if found else NO_HITS
+
+        with self._memo_lock:
+            self._memo[t] = hits
+            if len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+        return hits
+
+
+def _merge_rules(base: Dict[str, Dict[str, List[str]]],
+                 extra: Dict[str, Dict[str, List[str]]]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    规则文件是“追加”语义：在默认规则基础上扩充关键词（也可以新增 label）。
+    """
+    merged = {g: {l: list(ws) for l, ws in labels.items()} for g, labels in base.items()}
+    for group, labels in (extra or {}).items():
+        for label, words in (labels or {}).items():
+            bucket = merged.setdefault(group, {}).setdefault(label, [])
+            bucket.extend(w for w in words if w not in bucket)
+    return merged
+
+
+_matcher: Optional[KeywordMatcher] = None
+_matcher_mtime: Optional[float] = None
+_last_check = 0.0
+_lock = threading.Lock()
+
+
+def _rules_path() -> Path:
+    return Path(settings.KEYWORD_RULES_PATH)
+
+
+def _load(path: Path) -> KeywordMatcher:
+    rules = DEFAULT_RULES
+    version = "default"
+    if path.exists():
+        try:
+            extra = json.loads(path.read_text(encoding="utf-8"))
+            rules = _merge_rules(DEFAULT_RULES, extra)
+            version = f"{path.name}@{int(path.stat().st_mtime)}"
+        except (OSError, ValueError) as e:
+            # 规则文件写坏了：继续用默认规则，不影响服务
+            log.error(f"keyword_rules_load_failed path={path} err={e!r}")
+    matcher = KeywordMatcher(rules, version=version)
+    log.info(f"keyword_rules_loaded version={version} keywords={len(matcher._tags)}")
+    return matcher
+
+
+def reload_keyword_rules() -> KeywordMatcher:
+    """
+    强制重新加载规则文件（编辑完规则后也可以等自动检测）。
+    """
+    global _matcher, _matcher_mtime, _last_check
+    path = _rules_path()
+    with _lock:
+        _matcher = _load(path)
+        _matcher_mtime = path.stat().st_mtime if path.exists() else None
+        _last_check = time.monotonic()
+        return _matcher
+
+
+def get_keyword_matcher() -> KeywordMatcher:
+    """
+    获取当前匹配器。每隔 KEYWORD_RULES_CHECK_SEC 秒检查一次规则文件 mtime，
+    变了就重建（热加载），平时只是一次内存读取。
+    """
+    global _last_check
+    if _matcher is None:
+        return reload_keyword_rules()
+    now = time.monotonic()
+    if now - _last_check < settings.KEYWORD_RULES_CHECK_SEC:
+        return _matcher
+    _last_check = now
+    path = _rules_path()
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _matcher_mtime:
+        return reload_keyword_rules()
+    return _matcher
+
+
+def match_keywords(text: str) -> KeywordHits:
+    return get_keyword_matcher().match(text)
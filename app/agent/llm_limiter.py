@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：llm_limiter.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: LLM 准入层：全局并发上限 + 令牌桶限速 + 按 user_id 公平排队
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+log = logging.getLogger("llm_limiter")
+
+ANONYMOUS_USER = "-"
+
+
+class AdmissionTimeout(Exception):
+    """排队超过最大等待时间，没拿到 LLM 调用名额"""
+
+
+class TokenBucket:
+    """
+    令牌桶：rate 个/秒匀速补充，最多攒 capacity 个（允许短时突发）。
+    rate <= 0 表示不限速。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_take(self) -> float:
+        """
+        尝试拿一个令牌：拿到返回 0；拿不到返回还需等待的秒数（不扣令牌）。
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+
+class FairLimiter:
+    """
+    准入控制：
+    - 同时在途的 LLM 请求不超过 max_concurrency
+    - 发出速率受令牌桶约束（避免触发供应商 429，再被重试放大）
+    - 排队按 user_id 轮转（round-robin）：每个用户一条 FIFO 队列，
+      放行时轮流从各用户队首取，话多的用户不会饿死其他人
+
+    单线程 asyncio 内使用，不需要加锁。
+    """
+
+    def __init__(self, max_concurrency: int, rate_per_sec: float = 0.0, burst: float = 1.0,
+                 sample_size: int = 1000):
+        self.max_concurrency = max(1, max_concurrency)
+        self.bucket = TokenBucket(rate_per_sec, burst)
+        self._active = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._waiting = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        # 指标
+        self.admitted = 0
+        self.timeouts = 0
+        self.max_queue_depth = 0
+        self._wait_samples: Deque[float] = deque(maxlen=sample_size)
+        self._wait_total = 0.0
+
+    async def acquire(self, user_id: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        user = user_id or ANONYMOUS_USER
+        start = time.monotonic()
+
+        # 快路径：没人排队、有空位、有令牌 -> 直接放行
+        if not self._waiting and self._active < self.max_concurrency and self.bucket.try_take() == 0.0:
+            self._active += 1
+            self._record_wait(0.0)
+            return
+
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(fut)
+        self._waiting += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # 名额刚好在超时/取消的同一刻发下来了：还回去
+                self.release()
+            else:
+                fut.cancel()
+                self._remove(user, fut)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                log.warning(f"llm_admission_timeout user={user} waited={time.monotonic() - start:.2f}s")
+                raise AdmissionTimeout(f"LLM admission queue wait exceeded {timeout}s") from None
+            raise
+
+        self._record_wait(time.monotonic() - start)
+
+    def release(self) -> None:
+        self._active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        await self.acquire(user_id, timeout=timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _remove(self, user: str, fut: asyncio.Future) -> None:
+        q = self._queues.get(user)
+        if q is None:
+            return
+        try:
+            q.remove(fut)
+            self._waiting -= 1
+        except ValueError:
+            return
+        if not q:
+            del self._queues[user]
+
+    def _dispatch(self) -> None:
+        """
+        有空位时按用户轮转放行；令牌不够就定个时器，等令牌补上再放行。
+        """
+        while self._waiting and self._active < self.max_concurrency:
+            wait = self.bucket.try_take()
+            if wait > 0:
+                if self._wakeup is None:
+                    loop = asyncio.get_running_loop()
+                    self._wakeup = loop.call_later(wait, self._on_wakeup)
+                return
+
+            user, q = next(iter(self._queues.items()))
+            fut = q.popleft()
+            self._waiting -= 1
+            # 轮转：这个用户放到队尾，下一次先轮到别人
+            del self._queues[user]
+            if q:
+                self._queues[user] = q
+
+            self._active += 1
+            fut.set_result(None)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _record_wait(self, seconds: float) -> None:
+        self.admitted += 1
+        self._wait_total += seconds
+        self._wait_samples.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self._wait_samples)
+
+        def _pct(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self._waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "waiting_users": len(self._queues),
+            "admitted": self.admitted,
+            "timeouts": self.timeouts,
+            "wait_ms_avg": round(self._wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "wait_ms_p50": _pct(0.50),
+            "wait_ms_p95": _pct(0.95),
+            "wait_ms_max": round(samples[-1] * 1000, 2) if samples else 0.0,
+        }
@@ -9,28 +9,31 @@
 import sqlite3
 from pathlib import Path
 
-# 数据库文件位置（也可以放到 settings 里做成可配置）
-DB_PATH = Path("data/edu_agent.db")
+from app.infra.db import connect, get_db
+from app.infra.settings import settings
+
+# 数据库文件位置（settings.DB_PATH，memory / rag 共用）
+DB_PATH = Path(settings.DB_PATH)
 
 def get_conn() -> sqlite3.Connection:
     """
-    获取 SQLite 连接。
+    获取一个独立的 SQLite 连接（调用方负责 close）。
+    只给离线脚本用（eval 等）；服务内请用连接池：get_db().connection() / get_db().write()
     - check_same_thread=False：允许在异步应用中跨线程使用（简化开发）
     - row_factory：让查询结果可以按 dict-like 方式取字段
     """
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH.as_posix(), check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return connect(DB_PATH)
 
 def init_db() -> None:
     """
     初始化数据库表结构。
     这一步通常在服务启动时执行一次。
     """
-    conn = get_conn()
-    cur = conn.cursor()
+    with get_db().write() as conn:
+        _create_tables(conn.cursor())
 
+def _create_tables(cur: sqlite3.Cursor) -> None:
     # 用户画像表：存 speaking 的长期信息（可逐步更新）
     cur.execute("""
     CREATE TABLE IF NOT EXISTS speaking_profile (
@@ -61,6 +64,3 @@ def init_db() -> None:
         created_at INTEGER
     )
     """)
-
-    conn.commit()
-    conn.close()
@@ -10,7 +10,8 @@ import json
 import time
 from typing import Optional, Dict, Any, List
 
-from app.agent.memory.db import get_conn
+from app.infra.db import get_db
+from app.infra.executor import run_blocking
 
 def upsert_profile(user_id: str, level: Optional[str], goal: Optional[str],
                    daily_minutes: Optional[int], preferred_style: Optional[str] = None) -> None:
@@ -20,11 +21,10 @@ def upsert_profile(user_id: str, level: Optional[str], goal: Optional[str],
     - SQLite 不支持真正的 UPSERT 旧语法，我们用 INSERT ... ON CONFLICT 来做
     - updated_at 用 unix timestamp（秒）
     """
-    conn = get_conn()
-    cur = conn.cursor()
     now = int(time.time())
 
-    cur.execute("""
+    with get_db().write() as conn:
+        conn.execute("""
     INSERT INTO speaking_profile (user_id, level, goal, daily_minutes, preferred_style, updated_at)
     VALUES (?, ?, ?, ?, ?, ?)
     ON CONFLICT(user_id) DO UPDATE SET
@@ -35,18 +35,12 @@ def upsert_profile(user_id: str, level: Optional[str], goal: Optional[str],
       updated_at = excluded.updated_at
     """, (user_id, level, goal, daily_minutes, preferred_style, now))
 
-    conn.commit()
-    conn.close()
-
 def get_profile(user_id: str) -> Optional[Dict[str, Any]]:
     """
     读取用户画像。不存在返回 None。
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM speaking_profile WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_db().connection() as conn:
+        row = conn.execute("SELECT * FROM speaking_profile WHERE user_id = ?", (user_id,)).fetchone()
     return dict(row) if row else None
 
 def insert_attempt(user_id: str, question: str, answer: str, feedback: Dict[str, Any]) -> None:
@@ -54,11 +48,10 @@ def insert_attempt(user_id: str, question: str, answer: str, feedback: Dict[str,
     写入一次练习记录（attempt）。
     feedback 是结构化结果（SpeakingFeedback.model_dump()）
     """
-    conn = get_conn()
-    cur = conn.cursor()
     now = int(time.time())
 
-    cur.execute("""
+    with get_db().write() as conn:
+        conn.execute("""
     INSERT INTO speaking_attempt (
         user_id, question, answer,
         overall_score, fluency_score, grammar_score, vocabulary_score, structure_score,
@@ -78,24 +71,18 @@ def insert_attempt(user_id: str, question: str, answer: str, feedback: Dict[str,
         now
     ))
 
-    conn.commit()
-    conn.close()
-
 def get_recent_attempts(user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
     """
     获取最近 N 次练习记录。
     后续我们会用它做“个性化提示/出题”。
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
+    with get_db().connection() as conn:
+        rows = conn.execute("""
     SELECT * FROM speaking_attempt
     WHERE user_id = ?
     ORDER BY id DESC
     LIMIT ?
-    """, (user_id, limit))
-    rows = cur.fetchall()
-    conn.close()
+    """, (user_id, limit)).fetchall()
     return [dict(r) for r in rows]
 
 def get_avg_scores(user_id: str, last_n: int = 20) -> Dict[str, float]:
@@ -103,9 +90,8 @@ def get_avg_scores(user_id: str, last_n: int = 20) -> Dict[str, float]:
     统计最近 N 次的平均分，用于判断薄弱项。
     SQL 聚合能让你展示“工程化能力”，面试很加分。
     """
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
+    with get_db().connection() as conn:
+        row = conn.execute("""
     SELECT
       AVG(overall_score) AS overall,
       AVG(fluency_score) AS fluency,
@@ -118,9 +104,7 @@ def get_avg_scores(user_id: str, last_n: int = 20) -> Dict[str, float]:
       ORDER BY id DESC
       LIMIT ?
     )
-    """, (user_id, last_n))
-    row = cur.fetchone()
-    conn.close()
+    """, (user_id, last_n)).fetchone()
 
     # SQLite AVG 可能返回 None（没有记录）
     def _v(x): return float(x) if x is not None else 0.0
@@ -131,3 +115,21 @@ def get_avg_scores(user_id: str, last_n: int = 20) -> Dict[str, float]:
         "vocabulary": _v(row["vocabulary"]),
         "structure": _v(row["structure"]),
     }
+
+# ---------- async 版本：在 DB 线程池里执行，async 调用方用这些，不阻塞 event loop ----------
+
+async def aupsert_profile(user_id: str, level: Optional[str], goal: Optional[str],
+                          daily_minutes: Optional[int], preferred_style: Optional[str] = None) -> None:
+    await run_blocking(upsert_profile, user_id, level, goal, daily_minutes, preferred_style)
+
+async def aget_profile(user_id: str) -> Optional[Dict[str, Any]]:
+    return await run_blocking(get_profile, user_id)
+
+async def ainsert_attempt(user_id: str, question: str, answer: str, feedback: Dict[str, Any]) -> None:
+    await run_blocking(insert_attempt, user_id, question, answer, feedback)
+
+async def aget_recent_attempts(user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+    return await run_blocking(get_recent_attempts, user_id, limit)
+
+async def aget_avg_scores(user_id: str, last_n: int = 20) -> Dict[str, float]:
+    return await run_blocking(get_avg_scores, user_id, last_n)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：plan_stream.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: AgentPlan 的增量 JSON 解析：模型边输出，边把已经完整的 step / tool_call 吐出来
+"""
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.agent.schemas import ToolCall
+
+log = logging.getLogger("plan_stream")
+
+# 事件：("intent", str) / ("step", (index, str)) / ("tool_call", (index, ToolCall))
+PlanEvent = Tuple[str, Any]
+
+
+class PlanStreamParser:
+    """
+    只认 AgentPlan 顶层的三个字段：
+    - intent：字符串值读完即发出
+    - steps：数组里每个字符串读完即发出
+    - tool_calls：数组里每个对象括号配平即发出（并做 ToolCall 校验）
+
+    实现是一个逐字符的小状态机（记录深度、是否在字符串里、当前顶层 key），
+    每次 feed 只扫描新增的字符，整体 O(n)。
+    解析不了的格式（单引号、被截断等）这里不处理，交给最终的完整解析/修复。
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._started = False  # 是否已经遇到第一个 {
+        self._done = False  # 顶层对象已结束，后面的文字全部忽略
+        self._depth = 0
+        self._in_str = False
+        self._escaped = False
+        self._str_start = -1
+        self._expect_key = False  # 顶层对象里：下一个字符串是不是 key
+        self._key: Optional[str] = None  # 当前顶层 key
+        self._elem_start = -1  # tool_calls 里当前对象的起点
+        self._elem_index = -1  # tool_calls 里当前对象的下标（与最终 plan.tool_calls 下标一致）
+        self.steps: List[str] = []
+        self.tool_calls: List[ToolCall] = []
+        self.intent: Optional[str] = None
+
+    def feed(self, delta: str) -> List[PlanEvent]:
+        events: List[PlanEvent] = []
+        self._text += delta
+        text = self._text
+
+        for i in range(self._pos, len(text)):
+            if self._done:
+                break
+            ch = text[i]
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if self._in_str:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_str = False
+                    self._on_string(text, self._str_start, i, events)
+                continue
+
+            if ch == '"':
+                self._in_str = True
+                self._str_start = i
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "{" and self._depth == 3 and self._key == "tool_calls":
+                    self._elem_start = i
+                    self._elem_index += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._depth == 2 and self._key == "tool_calls" and self._elem_start >= 0:
+                    self._on_tool_call(text[self._elem_start : i + 1], events)
+                    self._elem_start = -1
+                if self._depth == 0:
+                    self._done = True
+            elif self._depth == 1:
+                if ch == ",":
+                    self._expect_key = True
+                elif ch == ":":
+                    self._expect_key = False
+
+        self._pos = len(text)
+        return events
+
+    def _on_string(self, text: str, start: int, end: int, events: List[PlanEvent]) -> None:
+        if self._depth == 1:
+            value = self._loads(text[start : end + 1])
+            if self._expect_key:
+                self._key = value
+            elif self._key == "intent" and isinstance(value, str):
+                self.intent = value
+                events.append(("intent", value))
+        elif self._depth == 2 and self._key == "steps":
+            value = self._loads(text[start : end + 1])
+            if isinstance(value, str):
+                self.steps.append(value)
+                events.append(("step", (len(self.steps) - 1, value)))
+
+    def _on_tool_call(self, raw: str, events: List[PlanEvent]) -> None:
+        try:
+            tc = ToolCall.model_validate(json.loads(raw))
+        except (ValueError, ValidationError) as e:
+            log.info(f"plan_stream_skip_tool_call err={e!r}")
+            return
+        self.tool_calls.append(tc)
+        events.append(("tool_call", (self._elem_index, tc)))
+
+    @staticmethod
+    def _loads(raw: str) -> Any:
+        try:
+            return json.loads(raw, strict=False)
+        except ValueError:
+            return None
@@ -10,6 +10,12 @@
 """
 分块:
 python -m app.agent.rag.ingest 
+# 指定中文分词模式（unicode61 / trigram / bigram，默认 settings.RAG_FTS_MODE）
+python -m app.agent.rag.ingest --fts-mode bigram
+# 默认增量（按文件 hash），--full 全量重建（影子表，建完换上线）
+python -m app.agent.rag.ingest --full
+# 老库迁移到外部内容 FTS 表 + optimize + VACUUM
+python -m app.agent.rag.ingest --migrate-fts
 
 # 查询
 sqlite3 data/edu_agent.db "select id, length(improved_version) as len_improved from speaking_attempt order by id desc limit 5;"
@@ -8,20 +8,26 @@
 """
 import logging
 import re
-from typing import Tuple, List
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 
-from app.agent.core import call_llm
+from app.agent.core import LLM_CALL_ERRORS, call_llm, stream_llm
+from app.agent.deadline import Deadline
+from app.agent.rag.cache import RAG_CACHE
+from app.agent.rag.packer import PackedContext, pack_context
 from app.agent.rag.prompts import RAG_SYSTEM
-from app.agent.rag.retriever import retrieve, RetrievedChunk
+from app.agent.rag.retriever import aretrieve, RetrievedChunk
+from app.infra.settings import settings
 
 logger = logging.getLogger("rag")
 
-_RAG_CACHE = {}  # key: (query, k) -> (text, chunks_meta)
+_CITE_RE = re.compile(r"\[(C\d+)\]")
 
 
 def _extract_used_cite_keys(text: str) -> set[str]:
     # 从回答中提取所有引用的 cite_key，如 ["C1", "C2"]
-    return set(re.findall(r"\[(C\d+)\]", text or ""))
+    return set(_CITE_RE.findall(text or ""))
 
 
 def _has_valid_citations(text: str, chunks: List[RetrievedChunk]) -> bool:
@@ -37,39 +43,95 @@ def _has_valid_citations(text: str, chunks: List[RetrievedChunk]) -> bool:
     return used.issubset(cite_keys)
 
 
-def _build_context(chunks: List[RetrievedChunk]) -> str:
+def _build_context(chunks: List[RetrievedChunk], query: str = "") -> PackedContext:
     """
     把检索到的 chunk 拼成带编号的上下文，供模型引用。
+    - 同一文档相邻的 chunk 合并成一段（重叠部分只出现一次），一段一个编号
+    - 传了 query 且开启 RAG_SNIPPET_ENABLED 时，每段只保留和问题相关的句子
+    - 按相关度装入，总量不超过 RAG_CONTEXT_MAX_TOKENS
+    返回的 PackedContext.chunks 是进了 prompt 的原始 chunk（cite_key 换成所在段的编号）。
     """
-    parts = []
-    for c in chunks:
-        parts.append(f"[{c.cite_key}] ({c.title}#{c.chunk_index})\n{c.content}\n")
-    return "\n".join(parts)
+    snippet_chars = settings.RAG_SNIPPET_MAX_CHARS if settings.RAG_SNIPPET_ENABLED else 0
+    packed = pack_context(chunks, query, settings.RAG_CONTEXT_MAX_TOKENS, snippet_chars)
+    logger.info(
+        f"rag_context spans={len(packed.spans)} chunks={len(chunks)} tokens~{packed.tokens} "
+        f"raw_chars={sum(len(c.content) for c in chunks)} dropped={[c.chunk_id for c in packed.dropped]}"
+    )
+    return packed
 
 
-async def ask_with_rag(query: str, k: int = 4) -> Tuple[str, List[RetrievedChunk]]:
+REFUSAL_LOW_RELEVANCE = "资料不足：检索到的资料相关度不够，我不想胡编。请补充更具体的教材/题库/规则文档到 data/kb/。"
+REFUSAL_NO_CITATION = "资料不足：我无法在保证引用合规的情况下回答。请补充更明确的资料或换一种问法。"
+REFUSAL_UPSTREAM = "生成回答时模型服务出错或超时了，这次没能回答完。请稍后再试。"
+RETRY_NOTICE = "\n\n【注意】你刚才没有按要求引用。请重写，并确保每条关键建议后都带 [C1]/[C2] 引用，且不要引用不存在的编号。"
+
+
+@dataclass
+class _Prepared:
     """
-    返回：回答文本 + 引用 chunks（便于你在后处理里展示引用详情）
+    调 LLM 之前的准备结果：answer 不为空表示不用调 LLM（缓存命中 / 拒答），直接返回它。
+    """
+    answer: Optional[Tuple[str, List[RetrievedChunk]]] = None
+    chunks: List[RetrievedChunk] = field(default_factory=list)  # 打包后的 chunk（cite_key 是段编号）
+    evidence: List[int] = field(default_factory=list)  # 检索到的 chunk_id（近似重复缓存用）
+    generation: int = 0
+    user_prompt: str = ""
+    use_cache: bool = False
+
+
+# 经验阈值：bm25 越接近 0 越不相关；负数通常更相关 bm25越小越相关
+_BM25_MAX_SCORE = -0.05
+
+
+def is_answerable(chunks: List[RetrievedChunk]) -> bool:
     """
+    检索结果够不够相关、值不值得让 LLM 回答：
+    bm25 最好分数 <= -0.05，或者（开了稠密检索）向量余弦相似度 >= RAG_VECTOR_MIN_SIMILARITY。
+    后者让 bm25 完全没命中、只被向量召回的问题也能回答（稠密检索存在的意义）。
+    """
+    if not chunks:
+        return False
+    if min(c.score for c in chunks) <= _BM25_MAX_SCORE:
+        return True
+    return max(c.vector_score for c in chunks) >= settings.RAG_VECTOR_MIN_SIMILARITY
 
-    cache_key = (query, k)
-    if cache_key in _RAG_CACHE:
-        return _RAG_CACHE[cache_key]
 
-    chunks = retrieve(query, k=k)
+async def _prepare(query: str, k: int) -> _Prepared:
+    use_cache = settings.RAG_CACHE_ENABLED
+    generation = 0
+    if use_cache:
+        generation = await RAG_CACHE.ageneration()
+        cached = await RAG_CACHE.get_answer(query, k, generation)
+        if cached is not None:
+            logger.info(f"rag_answer_cache_hit query={query!r} generation={generation}")
+            return _Prepared(answer=cached)
+        chunks = await RAG_CACHE.get_retrieval(query, k, generation)
+        if chunks is None:
+            chunks = await aretrieve(query, k=k)
+            await RAG_CACHE.set_retrieval(query, k, generation, chunks)
+    else:
+        chunks = await aretrieve(query, k=k)
 
     logger.info(f"rag_retrieve query={query!r} got={len(chunks)}")
     if chunks:
-        logger.info(f"rag_best_score={min(c.score for c in chunks)} titles={[c.title for c in chunks]}")
-
-    # 经验阈值：bm25 越接近 0 越不相关；负数通常更相关 bm25越小越相关
-    best_score = min([c.score for c in chunks]) if chunks else 0.0
+        logger.info(
+            f"rag_best_score={min(c.score for c in chunks)} "
+            f"best_vector_score={max(c.vector_score for c in chunks):.3f} titles={[c.title for c in chunks]}"
+        )
 
     # 低相关/结果太少：拒答
-    if (len(chunks) < 1) or (best_score > -0.05):
-        return "资料不足：检索到的资料相关度不够，我不想胡编。请补充更具体的教材/题库/规则文档到 data/kb/。", []
+    if not is_answerable(chunks):
+        return _Prepared(answer=(REFUSAL_LOW_RELEVANCE, []))
+
+    evidence = [c.chunk_id for c in chunks]
+    if use_cache:
+        similar = await RAG_CACHE.get_similar_answer(query, k, generation, evidence)
+        if similar is not None:
+            logger.info(f"rag_semantic_cache_hit query={query!r} generation={generation}")
+            return _Prepared(answer=similar)
 
-    context = _build_context(chunks)
+    packed = _build_context(chunks, query)
+    context = packed.text
 
     user_prompt = f"""用户问题：
     {query}
@@ -82,29 +144,152 @@ async def ask_with_rag(query: str, k: int = 4) -> Tuple[str, List[RetrievedChunk
     - 然后给 3-5 条可执行建议
     - 每条关键建议后面必须带引用，如 [C1]
     """
+    # 之后的引用校验 / 返回都用打包后的编号：[Cn] 对应一段，一段可能包含多个原始 chunk
+    return _Prepared(chunks=packed.chunks, evidence=evidence, generation=generation,
+                     user_prompt=user_prompt, use_cache=use_cache)
+
 
-    messages = [
+def _messages(user_prompt: str) -> list[dict]:
+    return [
         {"role": "system", "content": RAG_SYSTEM},
         {"role": "user", "content": user_prompt},
     ]
-    text = await call_llm(messages)
-    # ✅ 引用校验：如果模型没按要求引用，就再严格重试一次
-    if not _has_valid_citations(text, chunks):
-        retry_prompt = user_prompt + "\n\n【注意】你刚才没有按要求引用。请重写，并确保每条关键建议后都带 [C1]/[C2] 引用，且不要引用不存在的编号。"
-        messages = [
-            {"role": "system", "content": RAG_SYSTEM},
-            {"role": "user", "content": retry_prompt},
-        ]
-        text = await call_llm(messages)
 
-    # 再不行就拒答（宁可不答，不胡答）
-    if not _has_valid_citations(text, chunks):
-        return "资料不足：我无法在保证引用合规的情况下回答。请补充更明确的资料或换一种问法。", chunks
 
+async def _finish(prep: _Prepared, query: str, k: int, text: str) -> Tuple[str, List[RetrievedChunk]]:
     # 3) 过滤出实际被引用的 chunk
+    chunks = prep.chunks
     used = _extract_used_cite_keys(text)
     if used:
         chunks = [c for c in chunks if c.cite_key in used]
 
-    _RAG_CACHE[cache_key] = (text, chunks)
+    if prep.use_cache:
+        await RAG_CACHE.set_answer(query, k, prep.generation, text, chunks, evidence=prep.evidence)
     return text, chunks
+
+
+def citation_payload(chunks: List[RetrievedChunk]) -> List[dict]:
+    return [
+        {
+            "cite_key": c.cite_key,
+            "title": c.title,
+            "chunk_index": c.chunk_index,
+            "chunk_id": c.chunk_id,
+        }
+        for c in chunks
+    ]
+
+
+async def ask_with_rag(query: str, k: int = 4, user_id: str | None = None,
+                       deadline: Optional[Deadline] = None) -> Tuple[str, List[RetrievedChunk]]:
+    """
+    返回：回答文本 + 引用 chunks（便于你在后处理里展示引用详情）
+    user_id 只用于 LLM 准入层的公平排队，不参与缓存 key。
+    deadline：LLM 调用（含引用不合规时的重试）共用的时间预算，用完抛 DeadlineExceeded。
+    """
+    prep = await _prepare(query, k)
+    if prep.answer is not None:
+        return prep.answer
+
+    text = await call_llm(_messages(prep.user_prompt), user_id=user_id, deadline=deadline)
+    # ✅ 引用校验：如果模型没按要求引用，就再严格重试一次
+    if not _has_valid_citations(text, prep.chunks):
+        text = await call_llm(_messages(prep.user_prompt + RETRY_NOTICE), user_id=user_id, deadline=deadline)
+
+    # 再不行就拒答（宁可不答，不胡答）
+    if not _has_valid_citations(text, prep.chunks):
+        return REFUSAL_NO_CITATION, prep.chunks
+
+    return await _finish(prep, query, k, text)
+
+
+class CitationTracker:
+    """
+    流式输出时增量识别 [Cn]：每来一段 delta 只扫描新增部分（跨 delta 被切开的 "[C" + "1]" 也能识别）。
+    """
+
+    def __init__(self, chunks: List[RetrievedChunk]):
+        self._by_key: Dict[str, List[RetrievedChunk]] = {}
+        for c in chunks:
+            self._by_key.setdefault(c.cite_key, []).append(c)
+        self._text = ""
+        self._pos = 0
+        self.seen: List[str] = []
+        self.invalid: List[str] = []
+
+    def feed(self, delta: str) -> List[dict]:
+        """
+        返回这段 delta 里新出现的引用（同一个编号只报一次）。
+        """
+        self._text += delta
+        found = []
+        for m in _CITE_RE.finditer(self._text, self._pos):
+            self._pos = m.end()
+            key = m.group(1)
+            if key in self.seen or key in self.invalid:
+                continue
+            chunks = self._by_key.get(key)
+            if chunks is None:
+                self.invalid.append(key)
+                found.append({"cite_key": key, "valid": False})
+            else:
+                self.seen.append(key)
+                found.append({"cite_key": key, "valid": True, "sources": citation_payload(chunks)})
+        # 末尾可能是还没写完的 "[C1"：从那个 "[" 开始留着下次再扫
+        tail = self._text.rfind("[", self._pos)
+        if tail == -1 or "]" in self._text[tail:]:
+            self._pos = len(self._text)
+        else:
+            self._pos = tail
+        return found
+
+
+async def ask_with_rag_stream(query: str, k: int = 4, user_id: str | None = None,
+                              deadline: Optional[Deadline] = None) -> AsyncGenerator[Tuple[str, Any], None]:
+    """
+    流式版 ask_with_rag，产出 (事件, 数据)：
+    - token：模型输出的增量文本
+    - citation：流里新出现的引用 {"cite_key", "valid", "sources"}；出现不存在的编号立刻停止这一轮
+    - retract：这一轮的输出作废（没引用 / 引用了不存在的编号），前端应清掉已显示的内容；随后重试一次
+    - replace：重试也不合规 / 上游 LLM 中途失败或超时（reason=upstream_error），用这段文本替换全部输出（拒答）
+    - citations：最后一个事件，最终引用列表（和 /kb/ask 的 citations 一致）
+    缓存命中 / 拒答时只有一个 token 事件 + citations。
+    """
+    prep = await _prepare(query, k)
+    if prep.answer is not None:
+        text, chunks = prep.answer
+        yield "token", text
+        yield "citations", citation_payload(chunks)
+        return
+
+    prompt = prep.user_prompt
+    try:
+        for attempt in (1, 2):
+            tracker = CitationTracker(prep.chunks)
+            parts: List[str] = []
+            async with aclosing(stream_llm(_messages(prompt), user_id=user_id, deadline=deadline)) as stream:
+                async for delta in stream:
+                    parts.append(delta)
+                    yield "token", delta
+                    for cite in tracker.feed(delta):
+                        yield "citation", cite
+                    if tracker.invalid:
+                        break  # 已经不可能合规了，不再等剩下的输出
+            text = "".join(parts)
+            if not tracker.invalid and _has_valid_citations(text, prep.chunks):
+                text, chunks = await _finish(prep, query, k, text)
+                yield "citations", citation_payload(chunks)
+                return
+            reason = "invalid_citation" if tracker.invalid else "missing_citation"
+            logger.info(f"rag_stream_retract attempt={attempt} reason={reason} invalid={tracker.invalid}")
+            yield "retract", {"attempt": attempt, "reason": reason, "invalid": tracker.invalid}
+            prompt = prep.user_prompt + RETRY_NOTICE
+    except LLM_CALL_ERRORS as e:
+        # 上游中途断了 / 预算用完：已经推出去的 token 不完整，整体替换掉，流照常收尾
+        logger.warning(f"rag_stream_llm_failed err={e!r}")
+        yield "replace", {"text": REFUSAL_UPSTREAM, "reason": "upstream_error"}
+        yield "citations", []
+        return
+
+    yield "replace", {"text": REFUSAL_NO_CITATION}
+    yield "citations", citation_payload(prep.chunks)
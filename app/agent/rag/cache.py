@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：cache.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: RAG 缓存：检索结果 / 最终回答两层，key = 归一化 query + k + KB 版本号，reindex 后自动失效
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import unicodedata
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.agent.rag.db import get_kb_generation
+from app.agent.rag.retriever import RetrievedChunk
+from app.agent.rag.semantic_cache import SemanticCache
+from app.infra.cache import LRUTTLCache, SQLiteCache, TieredCache
+from app.infra.db import SQLitePool, get_db
+from app.infra.executor import run_blocking
+from app.infra.settings import settings
+
+log = logging.getLogger("rag.cache")
+
+
+def normalize_query(query: str) -> str:
+    """
+    全角半角统一（NFKC）、大小写折叠、标点/符号当空白、空白压成一个：
+    "STAR 怎么答？" / "star  怎么答" / "ＳＴＡＲ 怎么答?" 落到同一个 key。
+    """
+    t = unicodedata.normalize("NFKC", query or "").casefold()
+    t = "".join(" " if unicodedata.category(ch)[0] in "PSZ" else ch for ch in t)
+    return " ".join(t.split())
+
+
+def cache_key(query: str, k: int, generation: int) -> str:
+    digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+    return f"g{generation}:k{k}:{digest}"
+
+
+def _dump_chunks(chunks: List[RetrievedChunk]) -> List[Dict[str, Any]]:
+    return [asdict(c) for c in chunks]
+
+
+def _load_chunks(items: List[Dict[str, Any]]) -> List[RetrievedChunk]:
+    return [RetrievedChunk(**d) for d in items]
+
+
+class RagCache:
+    """
+    两层都是 TieredCache（进程内 LRU + TTL + 内存上限，SQLite 层跨重启、跨 worker 共享）：
+    - retrieval：query -> 检索到的 chunk（省 SQLite / 向量检索）
+    - answer：query -> 回答 + 引用（省最多两次 call_llm）
+    - semantic：换个说法、但检索到同一批资料的问题，复用 answer 层里已有的回答（见 SemanticCache）
+    KB 版本号（kb_meta.generation）写在 key 里：reindex 之后旧 key 不会再被查到。
+    每个进程每 RAG_GENERATION_CHECK_SEC 秒重读一次版本号；发现变了就清空本进程内存层（旧 key 留着只占内存）。
+    """
+
+    def __init__(self, db: Callable[[], SQLitePool], memory_entries: int, memory_bytes: int,
+                 max_rows: int, ttl: float, check_sec: float):
+        self.retrieval = TieredCache(
+            LRUTTLCache(memory_entries, default_ttl=ttl, max_bytes=memory_bytes),
+            SQLiteCache("rag_retrieval", db, max_rows=max_rows, default_ttl=ttl),
+        )
+        self.answer = TieredCache(
+            LRUTTLCache(memory_entries, default_ttl=ttl, max_bytes=memory_bytes),
+            SQLiteCache("rag_answer", db, max_rows=max_rows, default_ttl=ttl),
+        )
+        self.semantic = SemanticCache(
+            settings.RAG_SEMANTIC_MAX_ENTRIES,
+            evidence_threshold=settings.RAG_SEMANTIC_EVIDENCE_THRESHOLD,
+            query_threshold=settings.RAG_SEMANTIC_QUERY_THRESHOLD,
+        )
+        self._db = db
+        self._check_sec = check_sec
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._checked_at = 0.0
+        self.invalidations = 0
+
+    def _fresh_generation(self) -> Optional[int]:
+        if self._generation is not None and time.monotonic() - self._checked_at < self._check_sec:
+            return self._generation
+        return None
+
+    def generation(self) -> int:
+        gen = self._fresh_generation()
+        if gen is not None:
+            return gen
+        with self._db().connection() as conn:
+            gen = get_kb_generation(conn)
+        with self._lock:
+            if self._generation is not None and gen != self._generation:
+                self.retrieval.memory.clear()
+                self.answer.memory.clear()
+                self.semantic.clear()
+                self.invalidations += 1
+                log.info(f"rag_cache_generation_changed old={self._generation} new={gen}")
+            self._generation = gen
+            self._checked_at = time.monotonic()
+        return gen
+
+    async def ageneration(self) -> int:
+        gen = self._fresh_generation()
+        return gen if gen is not None else await run_blocking(self.generation)
+
+    async def get_retrieval(self, query: str, k: int, generation: int) -> Optional[List[RetrievedChunk]]:
+        raw = await self.retrieval.aget(cache_key(query, k, generation))
+        return _load_chunks(json.loads(raw)) if raw is not None else None
+
+    async def set_retrieval(self, query: str, k: int, generation: int, chunks: List[RetrievedChunk]) -> None:
+        value = json.dumps(_dump_chunks(chunks), ensure_ascii=False)
+        await self.retrieval.aset(cache_key(query, k, generation), value)
+
+    async def get_answer(self, query: str, k: int, generation: int) -> Optional[Tuple[str, List[RetrievedChunk]]]:
+        raw = await self.answer.aget(cache_key(query, k, generation))
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["text"], _load_chunks(data["chunks"])
+
+    async def set_answer(self, query: str, k: int, generation: int, text: str,
+                         chunks: List[RetrievedChunk], evidence: Optional[List[int]] = None) -> None:
+        """
+        evidence：这次检索到的 chunk_id（不是最终被引用的那几个），给近似重复匹配用。
+        """
+        value = json.dumps({"text": text, "chunks": _dump_chunks(chunks)}, ensure_ascii=False)
+        await self.answer.aset(cache_key(query, k, generation), value)
+        if evidence and settings.RAG_SEMANTIC_CACHE_ENABLED:
+            self.semantic.add(query, k, generation, evidence)
+
+    async def get_similar_answer(self, query: str, k: int, generation: int,
+                                 evidence: List[int]) -> Optional[Tuple[str, List[RetrievedChunk]]]:
+        if not evidence or not settings.RAG_SEMANTIC_CACHE_ENABLED:
+            return None
+        original = self.semantic.lookup(query, k, generation, evidence)
+        if original is None:
+            return None
+        cached = await self.get_answer(original, k, generation)
+        if cached is None:
+            self.semantic.discard(original)
+        return cached
+
+    def invalidate(self) -> None:
+        """
+        reindex 完成后调用：清掉两层（含 SQLite 里旧版本的行），下次请求重读版本号。
+        其它 worker 的内存层靠版本号检查失效。
+        """
+        self.retrieval.clear()
+        self.answer.clear()
+        self.semantic.clear()
+        with self._lock:
+            self._generation = None
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generation": self._generation,
+            "invalidations": self.invalidations,
+            "retrieval": self.retrieval.stats(),
+            "answer": self.answer.stats(),
+            "semantic": self.semantic.stats(),
+        }
+
+
+RAG_CACHE = RagCache(
+    get_db,
+    memory_entries=settings.RAG_CACHE_MEMORY_ENTRIES,
+    memory_bytes=settings.RAG_CACHE_MEMORY_BYTES,
+    max_rows=settings.RAG_CACHE_MAX_ROWS,
+    ttl=settings.RAG_CACHE_TTL_SEC,
+    check_sec=settings.RAG_GENERATION_CHECK_SEC,
+)
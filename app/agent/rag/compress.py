@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：compress.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: RAG 上下文压缩：每个 chunk 只保留和问题相关的句子窗口（本地打分，不调 LLM）
+
+不用 FTS5 的 snippet()：bigram 模式下 FTS 表里存的是切好的二元组，snippet 出来的文本是“行为 为面 面试”。
+"""
+import re
+from typing import List, Set, Tuple
+
+from app.agent.rag.fts import CJK_STOP_BIGRAMS
+from app.agent.rag.vectors import tokenize
+
+# 句子：以中英文句末标点或换行结尾（标点留在句子里）
+_SENT_RE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*")
+
+ELLIPSIS = "…"
+
+
+def query_terms(query: str) -> Set[str]:
+    return {t for t in tokenize(query) if t not in CJK_STOP_BIGRAMS}
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """
+    返回每个句子在原文里的 [start, end)（去掉首尾空白），拼回去时用原文切片，不改动内容。
+    """
+    spans = []
+    for m in _SENT_RE.finditer(text):
+        s, e = m.span()
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if s < e:
+            spans.append((s, e))
+    return spans
+
+
+def extract_snippet(terms: Set[str], text: str, max_chars: int) -> str:
+    """
+    从 text 里挑命中问题 term 最多的句子，按原文顺序拼起来，总长不超过 max_chars。
+    - 本身不超预算：原样返回
+    - 一句都没命中：取开头（检索排序已经认为它相关，开头通常是标题/主题句）
+    - 最相关的那句就超预算：以第一个命中的 term 为中心截一个窗口
+    不连续的句子之间用 … 连接，让模型知道中间省略过内容。
+    """
+    if len(text) <= max_chars:
+        return text
+    spans = split_sentences(text)
+    scored = []
+    for i, (s, e) in enumerate(spans):
+        hit = len(terms & set(tokenize(text[s:e])))
+        if hit:
+            scored.append((-hit, i))
+    if not scored:
+        return text[:max_chars - 1].rstrip() + ELLIPSIS
+
+    scored.sort()
+    picked: List[int] = []
+    used = 1  # 末尾可能的 …
+    for _, i in scored:
+        s, e = spans[i]
+        if used + (e - s) + 1 > max_chars:
+            continue
+        picked.append(i)
+        used += (e - s) + 1
+    if not picked:
+        s, e = spans[scored[0][1]]
+        sentence = text[s:e]
+        lowered = sentence.lower()
+        pos = min((lowered.find(t) for t in terms if t in lowered), default=0)
+        start = max(0, min(pos - max_chars // 3, len(sentence) - max_chars + 2))
+        return ELLIPSIS + sentence[start:start + max_chars - 2].strip() + ELLIPSIS
+
+    picked.sort()
+    parts = []
+    prev = None
+    for i in picked:
+        s, e = spans[i]
+        if (prev is None and i > 0) or (prev is not None and i != prev + 1):
+            parts.append(ELLIPSIS)
+        elif parts:
+            parts.append(" ")
+        parts.append(text[s:e])
+        prev = i
+    if prev != len(spans) - 1:
+        parts.append(ELLIPSIS)
+    return "".join(parts)
+
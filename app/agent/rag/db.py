@@ -6,53 +6,260 @@
 @Email : zqingy@work@163.com 
 @note: 
 """
+import logging
 import sqlite3
 from pathlib import Path
+from typing import Dict, Optional
 
-DB_PATH = Path("data/edu_agent.db")
+from app.agent.rag.fts import (
+    SEGMENTER_VERSION, fts_create_sql, fts_synced_by_triggers, fts_trigger_sql, segment_for_index,
+)
+from app.infra.db import connect, get_db
+from app.infra.settings import settings
+
+log = logging.getLogger("rag")
+
+DB_PATH = Path(settings.DB_PATH)
 
 def get_conn() -> sqlite3.Connection:
+    """
+    独立连接（离线脚本用，调用方负责 close）；服务内请用 get_db() 连接池。
+    """
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH.as_posix(), check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return connect(DB_PATH)
 
-def init_rag_tables() -> None:
+def init_rag_tables(fts_mode: Optional[str] = None) -> str:
     """
-    创建 RAG 用的表与 FTS5 索引。
+    创建 RAG 用的表与 FTS5 索引，返回当前索引的分词模式。
     注意：SQLite 必须支持 FTS5（大多数 Python 自带 sqlite3 都支持）。
+    fts_mode：新建索引时用的模式（默认 settings.RAG_FTS_MODE）；
+    索引已存在时沿用已有模式，要切换请用 reindex_kb(fts_mode=...) 重建。
     """
-    conn = get_conn()
-    cur = conn.cursor()
+    with get_db().write() as conn:
+        _create_tables(conn.cursor())
+        return _ensure_fts(conn, fts_mode)
 
-    # 资料文档表
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS kb_doc (
+def _create_tables(cur: sqlite3.Cursor) -> None:
+    _create_kb_tables(cur)
+    _create_meta_table(cur)
+    _add_missing_columns(cur, "kb_doc", {"content_hash": "TEXT", "mtime_ns": "INTEGER", "size": "INTEGER"})
+
+def _create_kb_tables(cur: sqlite3.Cursor, suffix: str = "") -> None:
+    """
+    文档表 + 分块表。suffix 非空时建的是全量重建用的影子表（kb_doc__shadow 等），建完整体换上线。
+    """
+    # 资料文档表（content_hash / mtime_ns / size：增量入库判断文件有没有变）
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS kb_doc{suffix} (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       path TEXT UNIQUE NOT NULL,
-      title TEXT NOT NULL
+      title TEXT NOT NULL,
+      content_hash TEXT,
+      mtime_ns INTEGER,
+      size INTEGER
     )
     """)
 
     # 文档分块表：一份文档会被切成多个 chunk
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS kb_chunk (
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS kb_chunk{suffix} (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       doc_id INTEGER NOT NULL,
       chunk_index INTEGER NOT NULL,
       content TEXT NOT NULL,
-      FOREIGN KEY(doc_id) REFERENCES kb_doc(id)
+      FOREIGN KEY(doc_id) REFERENCES kb_doc{suffix}(id)
     )
     """)
 
-    # FTS5 索引：用于全文检索 kb_chunk.content
-    # content_rowid='id'：让 FTS 表的 rowid 与 kb_chunk.id 对齐，方便 JOIN
+def _create_meta_table(cur: sqlite3.Cursor) -> None:
+    # KB 元信息：FTS 分词模式等（key-value）
     cur.execute("""
-    CREATE VIRTUAL TABLE IF NOT EXISTS kb_chunk_fts USING fts5(
-      content,
-      content_rowid='id'
+    CREATE TABLE IF NOT EXISTS kb_meta (
+      key TEXT PRIMARY KEY,
+      value TEXT NOT NULL
     )
     """)
 
-    conn.commit()
-    conn.close()
+def _add_missing_columns(cur: sqlite3.Cursor, table: str, columns: Dict[str, str]) -> None:
+    """
+    老库迁移：表已存在但缺新列时补上（值为 NULL，下次增量入库会当作“已修改”重新算一遍）。
+    """
+    existing = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def get_kb_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM kb_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_kb_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        "INSERT INTO kb_meta(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value),
+    )
+
+def get_fts_mode(conn: sqlite3.Connection) -> str:
+    """
+    当前 FTS 索引的分词模式。没有记录的老库就是默认的 unicode61。
+    """
+    try:
+        return get_kb_meta(conn, "fts_mode") or "unicode61"
+    except sqlite3.OperationalError:  # kb_meta 还没建（老库）
+        return "unicode61"
+
+def get_kb_generation(conn: sqlite3.Connection) -> int:
+    """
+    KB 版本号：每次 reindex 完成 +1，缓存 key 里带上它，重建索引后旧缓存自然失效。
+    """
+    try:
+        return int(get_kb_meta(conn, "generation") or 0)
+    except sqlite3.OperationalError:  # kb_meta 还没建（老库）
+        return 0
+
+def bump_kb_generation(conn: sqlite3.Connection) -> int:
+    generation = get_kb_generation(conn) + 1
+    set_kb_meta(conn, "generation", str(generation))
+    return generation
+
+def create_fts_table(conn: sqlite3.Connection, mode: str) -> None:
+    """
+    按模式（重新）创建 FTS5 索引（外部内容表，索引 kb_chunk.content），建同步触发器（bigram 没有），并把已有 chunk 补进索引。
+    """
+    conn.execute("DROP TABLE IF EXISTS kb_chunk_fts")
+    conn.execute(fts_create_sql(mode))
+    _fill_fts(conn, "kb_chunk_fts", mode)
+    create_fts_triggers(conn, mode)
+    _mark_fts_built(conn, mode)
+
+def _mark_fts_built(conn: sqlite3.Connection, mode: str) -> None:
+    """
+    记下当前 FTS 的分词模式和建索引时用的切分版本（见 fts.SEGMENTER_VERSION）。
+    """
+    set_kb_meta(conn, "fts_mode", mode)
+    set_kb_meta(conn, "fts_segmenter", SEGMENTER_VERSION)
+
+def is_fts_segmenter_stale(conn: sqlite3.Connection, mode: str) -> bool:
+    """
+    bigram 索引是不是按旧版切分建的（没记版本的老库也算）：是的话增量删行会删不干净，要整表重建。
+    其它模式索引的就是原文，和切分无关。
+    """
+    return not fts_synced_by_triggers(mode) and get_kb_meta(conn, "fts_segmenter") != SEGMENTER_VERSION
+
+def create_fts_triggers(conn: sqlite3.Connection, mode: str) -> None:
+    """
+    重建 kb_chunk 上的同步触发器；bigram 模式只删不建（FTS 行由 ingest 显式写）。
+    """
+    for name in ("kb_chunk_ai", "kb_chunk_ad", "kb_chunk_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    for sql in fts_trigger_sql(mode):
+        conn.execute(sql)
+
+def _fill_fts(conn: sqlite3.Connection, table: str, mode: str) -> int:
+    """
+    从 kb_chunk 整表灌进 FTS。bigram 模式索引的是切好的文本，不能用 FTS5 自带的 'rebuild'（它直接读原文），
+    在 Python 里边读边切边写。
+    """
+    if mode != "bigram":
+        return conn.execute(f"INSERT INTO {table}(rowid, content) SELECT id, content FROM kb_chunk").rowcount
+    rows = conn.execute("SELECT id, content FROM kb_chunk")
+    return conn.executemany(
+        f"INSERT INTO {table}(rowid, content) VALUES (?, ?)",
+        ((chunk_id, segment_for_index(content, mode)) for chunk_id, content in rows),
+    ).rowcount
+
+def is_external_content_fts(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'kb_chunk_fts'").fetchone()
+    return bool(row) and "content='kb_chunk'" in row[0]
+
+def migrate_fts_external_content(conn: sqlite3.Connection) -> int:
+    """
+    老库迁移：普通 FTS5 表（chunk 原文在 kb_chunk 和 FTS 里各存一份）-> 外部内容表（+ 同步触发器，bigram 除外）。
+    在调用方的写事务里新建索引、换名，返回迁移的 chunk 数；已经是外部内容表时返回 0。
+    旧表占的页要 VACUUM 之后才会还给文件系统（见 ingest --migrate-fts）。
+    """
+    if is_external_content_fts(conn):
+        return 0
+    mode = get_fts_mode(conn)
+    tmp = f"kb_chunk_fts{SHADOW_SUFFIX}"
+    conn.execute(f"DROP TABLE IF EXISTS {tmp}")
+    conn.execute(fts_create_sql(mode, tmp))
+    count = _fill_fts(conn, tmp, mode)
+    optimize_fts(conn, tmp)
+    conn.execute("DROP TABLE kb_chunk_fts")
+    conn.execute(f"ALTER TABLE {tmp} RENAME TO kb_chunk_fts")
+    create_fts_triggers(conn, mode)
+    _mark_fts_built(conn, mode)
+    log.info(f"kb_fts_migrated external_content=1 mode={mode} chunks={count}")
+    return count
+
+def optimize_fts(conn: sqlite3.Connection, table: str = "kb_chunk_fts") -> None:
+    """
+    把所有段合并成一个（全量重建 / 迁移之后做一次，查询只需读一个段）。
+    """
+    conn.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+
+def merge_fts(conn: sqlite3.Connection, pages: int) -> None:
+    """
+    增量合并：最多写 pages 个页（增量入库后做，代价有上限，不像 optimize 那样重写整个索引）。
+    """
+    conn.execute("INSERT INTO kb_chunk_fts(kb_chunk_fts, rank) VALUES ('merge', ?)", (pages,))
+
+# 全量重建写进影子表，建完在一个写事务里整体换上线（读请求一直用旧表，直到换表提交）
+SHADOW_SUFFIX = "__shadow"
+_KB_TABLES = ("kb_doc", "kb_chunk", "kb_chunk_fts")
+
+def drop_shadow_tables(conn: sqlite3.Connection) -> None:
+    for table in reversed(_KB_TABLES):
+        conn.execute(f"DROP TABLE IF EXISTS {table}{SHADOW_SUFFIX}")
+
+def create_shadow_tables(conn: sqlite3.Connection, mode: str) -> None:
+    """
+    建空的影子表（上次没建完的残留先删掉）。
+    自增 id 从线上表当前的最大值往后接：换表之后旧的 chunk_id（向量文件、缓存里的）不会指到别的内容上。
+    影子 FTS 表建的时候就指向 content='kb_chunk'（换名后的名字，FTS5 改名不会改这个选项）；
+    影子表上没有触发器，写入方自己往影子 FTS 里写（只写不读，不会去读线上的 kb_chunk）。
+    """
+    drop_shadow_tables(conn)
+    _create_kb_tables(conn.cursor(), SHADOW_SUFFIX)
+    conn.execute(fts_create_sql(mode, f"kb_chunk_fts{SHADOW_SUFFIX}"))
+    for table in ("kb_doc", "kb_chunk"):
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        if row and row[0]:
+            conn.execute("INSERT INTO sqlite_sequence(name, seq) VALUES (?, ?)", (f"{table}{SHADOW_SUFFIX}", row[0]))
+
+def swap_shadow_tables(conn: sqlite3.Connection, mode: str) -> int:
+    """
+    影子表换上线：删旧表、改名、记下 FTS 模式、bump 版本号，全在调用方的同一个写事务里，返回新版本号。
+    WAL 下正在读的连接看到的仍是提交前的快照，提交之后的查询直接看到新表。
+    """
+    for table in reversed(_KB_TABLES):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    for table in _KB_TABLES:
+        conn.execute(f"ALTER TABLE {table}{SHADOW_SUFFIX} RENAME TO {table}")
+    # 旧表上的触发器随 DROP TABLE 没了，给换上来的 kb_chunk 重建
+    create_fts_triggers(conn, mode)
+    _mark_fts_built(conn, mode)
+    return bump_kb_generation(conn)
+
+def _ensure_fts(conn: sqlite3.Connection, fts_mode: Optional[str]) -> str:
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kb_chunk_fts'"
+    ).fetchone()
+    if not exists:
+        mode = fts_mode or settings.RAG_FTS_MODE
+        create_fts_table(conn, mode)
+        return mode
+    mode = get_fts_mode(conn)
+    migrated = migrate_fts_external_content(conn)
+    if not migrated and is_fts_segmenter_stale(conn, mode):
+        # 切分规则改过：按旧切分写进去的行，用新切分的 'delete' 删不掉，整表按新切分重建
+        log.warning(f"kb_fts_segmenter_changed mode={mode} version={SEGMENTER_VERSION}, rebuilding fts")
+        create_fts_table(conn, mode)
+        bump_kb_generation(conn)
+    elif not migrated and not fts_synced_by_triggers(mode):
+        # 之前版本的 bigram 库在触发器里调 Python 函数，没注册函数的连接写 kb_chunk 会失败：删掉
+        create_fts_triggers(conn, mode)
+    if fts_mode and fts_mode != mode:
+        log.warning(f"kb_fts_mode_mismatch current={mode} requested={fts_mode}, run reindex_kb(fts_mode=...)")
+    return mode
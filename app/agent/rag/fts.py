@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：fts.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: FTS5 索引模式（中文分词方式）：建表语句 + 入库/查询两侧一致的切分
+"""
+import re
+from typing import List, Literal
+
+# - unicode61：默认分词器，一整串中文是一个 token（旧行为，中文基本只能整句命中）
+# - trigram：FTS5 内置 trigram 分词器，任意 >=3 字符的子串都能命中（2 字中文词查不到）
+# - bigram：入库和查询时把中文切成相邻二元组再交给 unicode61（"行为面试" -> "行为 为面 面试"）
+FtsMode = Literal["unicode61", "trigram", "bigram"]
+FTS_MODES = ("unicode61", "trigram", "bigram")
+
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+# segment_for_index 的版本号：bigram 的切分结果有任何变化（切法、正则、空白处理）都要改它。
+# bigram 的 FTS 里存的是切好的文本，外部内容表删行时必须传回当初那份切分结果；
+# 库里记的版本（kb_meta.fts_segmenter）和这里对不上时，init_rag_tables 会按新切分整表重建 FTS
+SEGMENTER_VERSION = "1"
+
+# 问句里常见、但对检索没帮助的二元组（不去掉的话 OR 查询会召回一堆无关 chunk）
+CJK_STOP_BIGRAMS = {"怎么", "什么", "如何", "请给", "给我", "一下", "我的", "你的", "可以", "应该", "是否", "一个", "这个"}
+
+
+def fts_create_sql(mode: str, table: str = "kb_chunk_fts") -> str:
+    """
+    外部内容表（content='kb_chunk'）：FTS 只存倒排索引，不再把 chunk 原文存第二份；
+    content_rowid='id' 让 FTS 表的 rowid 与 kb_chunk.id 对齐，方便 JOIN。
+    写入由 kb_chunk 上的触发器同步（bigram 模式由 ingest 显式写，见 fts_synced_by_triggers）。
+    bigram 模式下 FTS 索引的是切好的文本、kb_chunk.content 是原文：FTS5 的 'rebuild' / 'integrity-check'、
+    snippet() / highlight() 都会去读原文，结果不对，不要用（重建走 db._fill_fts，摘要走 compress.extract_snippet）。
+    """
+    if mode not in FTS_MODES:
+        raise ValueError(f"unknown fts mode: {mode!r} (expected one of {FTS_MODES})")
+    options = "content='kb_chunk', content_rowid='id'"
+    if mode == "trigram":
+        options += ", tokenize='trigram'"
+    return f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(content, {options})"
+
+
+def fts_synced_by_triggers(mode: str) -> bool:
+    """
+    FTS 行是否由 kb_chunk 上的触发器同步：unicode61 / trigram 索引的就是原文，用触发器；
+    bigram 索引的是切好的文本，触发器里切不了（要调 Python 函数，别的连接 / sqlite3 命令行上没有），
+    由写入方（ingest）在 Python 里切好后显式写入 / 删除。
+    """
+    return mode != "bigram"
+
+
+def fts_trigger_sql(mode: str) -> List[str]:
+    """
+    kb_chunk -> kb_chunk_fts 的同步触发器（只有 fts_synced_by_triggers 的模式有）。
+    外部内容表删除时要传入当初索引的文本（'delete' 命令）。
+    """
+    if not fts_synced_by_triggers(mode):
+        return []
+    return [
+        """CREATE TRIGGER kb_chunk_ai AFTER INSERT ON kb_chunk BEGIN
+          INSERT INTO kb_chunk_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+        """CREATE TRIGGER kb_chunk_ad AFTER DELETE ON kb_chunk BEGIN
+          INSERT INTO kb_chunk_fts(kb_chunk_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        """CREATE TRIGGER kb_chunk_au AFTER UPDATE OF content ON kb_chunk BEGIN
+          INSERT INTO kb_chunk_fts(kb_chunk_fts, rowid, content) VALUES ('delete', old.id, old.content);
+          INSERT INTO kb_chunk_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+    ]
+
+
+def cjk_ngrams(run: str, n: int) -> List[str]:
+    if len(run) <= n:
+        return [run]
+    return [run[i : i + n] for i in range(len(run) - n + 1)]
+
+
+def segment_for_index(text: str, mode: str) -> str:
+    """
+    入库时写进 FTS 的文本：bigram 模式把中文切成二元组（kb_chunk 里仍存原文），其它模式原样。
+    """
+    if mode != "bigram":
+        return text
+    return _CJK_RE.sub(lambda m: " " + " ".join(cjk_ngrams(m.group(), 2)) + " ", text)
+
+
+def cjk_query_terms(query: str, mode: str) -> List[str]:
+    """
+    查询里中文部分切成和索引一致的 term：
+    - bigram：二元组（去掉问句虚词）
+    - trigram：三元组（不足 3 字的中文片段 trigram 索引查不到，直接跳过）
+    """
+    terms: List[str] = []
+    for m in _CJK_RE.finditer(query):
+        run = m.group()
+        if mode == "bigram":
+            terms += [t for t in cjk_ngrams(run, 2) if t not in CJK_STOP_BIGRAMS]
+        elif mode == "trigram" and len(run) >= 3:
+            terms += cjk_ngrams(run, 3)
+    return terms
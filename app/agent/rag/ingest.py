@@ -4,18 +4,39 @@
 @File ：ingest.py
 @Author ：zqy
 @Email : zqingy@work@163.com
-@note: 文档切块 + 入库 + 建索引（ingest.py）
+@note: 文档切块 + 入库 + 建索引（ingest.py），按内容 hash 增量同步
 """
+import hashlib
+import itertools
+import os
 import re
+import sqlite3
 import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List, Tuple
-
-from app.agent.rag.db import get_conn, init_rag_tables
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.agent.rag.cache import RAG_CACHE
+from app.agent.rag.db import (
+    SHADOW_SUFFIX,
+    bump_kb_generation,
+    create_shadow_tables,
+    drop_shadow_tables,
+    init_rag_tables,
+    merge_fts,
+    optimize_fts,
+    swap_shadow_tables,
+)
+from app.agent.rag.fts import FTS_MODES, fts_synced_by_triggers, segment_for_index
+from app.agent.rag.vectors import build_vector_index, vector_path
+from app.infra.db import get_db
+from app.infra.settings import settings
 
 KB_DIR = Path("data/kb")
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-BATCH_SIZE = 200  # 批量写入更大一些更快（可按需调）
+BATCH_SIZE = 500  # 每个写事务攒多少个 chunk（executemany；更大更快，但单个事务占写锁更久）
 
 CHUNK_MAX_CHARS = 700
 CHUNK_OVERLAP = 80
@@ -109,76 +130,412 @@ def _iter_chunks_streaming(path: Path, max_chars: int = CHUNK_MAX_CHARS, overlap
     log(f"✅ 读取完成: {path} (生成 chunk 数: {produced})")
 
 
-def reindex_kb() -> None:
-    """把 data/kb 下所有 .md/.txt 重新入库并重建索引"""
-    log("🚀 开始重建 KB 索引")
+@dataclass
+class IngestReport:
+    """
+    一次 reindex 的结果：各类文档的路径 + 写入/删除的 chunk 数。
+    """
+    full: bool = False  # 是否全量重建（首次入库 / 切换了 FTS 模式 / 显式要求）
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    chunks_written: int = 0
+    chunks_deleted: int = 0
+    generation: Optional[int] = None  # 有变化时新的 KB 版本号；没变化为 None
+    # 吞吐：切块 + 写入这一段（不含向量索引）
+    workers: int = 0
+    batches: int = 0
+    bytes_read: int = 0  # 重新切块的文件总大小
+    seconds: float = 0.0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks_written / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.bytes_read / 1024 / 1024 / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"added={len(self.added)} updated={len(self.updated)} removed={len(self.removed)} "
+            f"unchanged={len(self.unchanged)} chunks_written={self.chunks_written} "
+            f"chunks_deleted={self.chunks_deleted} workers={self.workers} batches={self.batches} "
+            f"{self.seconds:.2f}s {self.chunks_per_sec:.0f} chunks/s {self.mb_per_sec:.2f} MB/s"
+        )
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def reindex_kb(fts_mode: Optional[str] = None, kb_dir: Path = KB_DIR, full: bool = False) -> IngestReport:
+    """
+    把 data/kb 下所有 .md/.txt 同步进索引（增量）：
+    - mtime + 大小都没变：直接跳过；变了再算内容 hash，hash 也没变只更新 mtime
+    - 内容变了的文档：只替换它自己的 chunk；目录里已经没有的文档：删掉它的 chunk
+    - 每个文档一个写事务：重建过程中其它文档照常可查，不会出现索引整个为空
+    fts_mode：FTS 分词模式（unicode61 / trigram / bigram），默认 settings.RAG_FTS_MODE；
+    和现有索引的模式不同（或 full=True）时全量重建：写进影子表，建完一次性换上线，
+    期间检索照常走旧索引；建到一半失败只删影子表，线上索引不受影响。
+    没有任何变化时不 bump KB 版本号，缓存继续有效。
+    """
+    mode = fts_mode or settings.RAG_FTS_MODE
+    current = init_rag_tables(mode)
+    full = full or current != mode
+    log(f"🚀 开始同步 KB 索引 (fts_mode={mode}, full={full})")
+
+    start = time.perf_counter()
+    report = _reindex(mode, kb_dir, full)
+    report.seconds = time.perf_counter() - start
+    log(f"🎉 索引同步完成: {report.summary()}")
+
+    if settings.RAG_VECTOR_ENABLED and (report.changed or not vector_path().exists()):
+        start = time.perf_counter()
+        with get_db().connection() as conn:
+            count = build_vector_index(conn)
+        log(f"🧮 向量索引完成: {count} 块 ({time.perf_counter() - start:.1f}s)")
+    if not report.changed and not report.full:
+        return report
+
+    if report.generation is None:  # 全量重建在换表的事务里已经 bump 过
+        with get_db().write() as conn:
+            report.generation = bump_kb_generation(conn)
+    # 版本号写进了 kb_meta：本进程直接清缓存，其它 worker 最多 RAG_GENERATION_CHECK_SEC 秒后发现
+    RAG_CACHE.invalidate()
+    log(f"🔖 KB 版本号: {report.generation}")
+    return report
+
+
+def _delete_doc_chunks(conn: sqlite3.Connection, doc_id: int, mode: str) -> int:
+    # unicode61 / trigram：FTS 里的行由 kb_chunk 上的删除触发器同步删掉；
+    # bigram 没有触发器，外部内容表的 'delete' 要带上当初索引的（切好的）文本。
+    # 约束：这里现切出来的文本必须和入库时切的一模一样，否则旧 term 删不掉、索引悄悄坏掉（FTS5 不报错）。
+    # 所以改了 segment_for_index 的输出就要改 fts.SEGMENTER_VERSION：版本对不上时 init_rag_tables 先整表重建 FTS
+    if not fts_synced_by_triggers(mode):
+        rows = conn.execute("SELECT id, content FROM kb_chunk WHERE doc_id = ?", (doc_id,)).fetchall()
+        conn.executemany(
+            "INSERT INTO kb_chunk_fts(kb_chunk_fts, rowid, content) VALUES ('delete', ?, ?)",
+            [(chunk_id, segment_for_index(content, mode)) for chunk_id, content in rows],
+        )
+    return conn.execute("DELETE FROM kb_chunk WHERE doc_id = ?", (doc_id,)).rowcount
+
+
+@dataclass
+class PreparedDoc:
+    """
+    切好块的文档（进程池 -> 写入方）：chunks 是原文，segmented 是写进 FTS 的文本（bigram 模式已切好）。
+    全量重建（影子表上没有触发器）和 bigram 模式（没有触发器）才需要 segmented；其它情况由触发器同步，这里为空。
+    """
+    path: str
+    title: str
+    digest: str
+    mtime_ns: int
+    size: int
+    chunks: List[str]
+    segmented: List[str]
 
-    init_rag_tables()
-    conn = get_conn()
-    cur = conn.cursor()
 
+def _prepare_doc(path: str, mode: Optional[str]) -> PreparedDoc:
+    """
+    进程池里跑的部分：hash + 读文件切块 + FTS 分词（mode 为 None 时不分词），CPU 活都在这里，写库只在主进程。
+    """
+    p = Path(path)
+    st = p.stat()
+    chunks = list(_iter_chunks_streaming(p))
+    return PreparedDoc(
+        path=p.as_posix(),
+        title=p.stem,
+        digest=_file_digest(p),
+        mtime_ns=st.st_mtime_ns,
+        size=st.st_size,
+        chunks=chunks,
+        segmented=[segment_for_index(c, mode) for c in chunks] if mode else [],
+    )
+
+
+def _ingest_workers(n_files: int) -> int:
+    workers = settings.RAG_INGEST_WORKERS or os.cpu_count() or 1
+    return max(1, min(workers, n_files))
+
+
+def _prepare_docs(paths: List[Path], mode: Optional[str], workers: int) -> Iterator[PreparedDoc]:
+    """
+    按 paths 的顺序产出切好的文档。
+    workers > 1 时用进程池并行切，在途的文件最多 workers * 2 个：写入跟不上时不会把整个 KB 堆在内存里。
+    """
+    if workers <= 1:
+        for p in paths:
+            yield _prepare_doc(p.as_posix(), mode)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
     try:
-        # 1) 清空旧索引
-        log("🗑️ 清空旧数据...")
-        cur.execute("DELETE FROM kb_chunk_fts")
-        cur.execute("DELETE FROM kb_chunk")
-        cur.execute("DELETE FROM kb_doc")
-        conn.commit()
-        log("✅ 旧数据已清空")
-
-        # 2) 遍历文件入库
-        log("📂 开始遍历文件目录...")
-        paths = sorted([p for p in KB_DIR.glob("**/*") if p.suffix.lower() in {".md", ".txt"}])
-        log(f"📊 共找到 {len(paths)} 个文档")
+        todo = iter(paths)
+        pending: Deque[Future] = deque(
+            pool.submit(_prepare_doc, p.as_posix(), mode) for p in itertools.islice(todo, workers * 2)
+        )
+        while pending:
+            doc = pending.popleft().result()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append(pool.submit(_prepare_doc, nxt.as_posix(), mode))
+            yield doc
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
 
-        total_chunks = 0
 
-        for idx, p in enumerate(paths, start=1):
-            log(f"\n[{idx}/{len(paths)}] 处理文件: {p}")
+def _next_chunk_id(conn: sqlite3.Connection, table: str) -> int:
+    row = conn.execute(
+        f"SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0), "
+        f"COALESCE((SELECT MAX(id) FROM {table}), 0))",
+        (table,),
+    ).fetchone()
+    return row[0] + 1
 
-            title = p.stem
-            cur.execute("INSERT INTO kb_doc(path, title) VALUES (?, ?)", (p.as_posix(), title))
-            doc_id = cur.lastrowid
-            log(f"📝 插入 kb_doc: {title} (doc_id={doc_id})")
 
-            # 批量缓存
-            pending_chunk_rows: List[Tuple[int, int, str]] = []
-            pending_fts_rows: List[Tuple[int, str]] = []
+class BulkWriter:
+    """
+    唯一的写入方：攒够 BATCH_SIZE 个 chunk 一个写事务，kb_chunk 用 executemany。
+    - 以整个文档为单位攒批（一个文档的删旧 + 写新一定在同一个事务里，读请求看不到写了一半的文档）
+    - chunk_id 在事务里按 sqlite_sequence 预先分配，不用逐行 INSERT 拿 lastrowid
+    suffix：全量重建时写影子表（SHADOW_SUFFIX）。
+    影子表和 bigram 模式没有触发器（write_fts），FTS 行用进程池切好的文本一起 executemany 写进去；
+    其它情况线上表的 FTS 由触发器同步。
+    """
 
-            chunk_index = 0
+    def __init__(self, mode: str, suffix: str = "", batch_size: Optional[int] = None):
+        self.mode = mode
+        self.suffix = suffix
+        self.write_fts = bool(suffix) or not fts_synced_by_triggers(mode)
+        self.batch_size = batch_size or BATCH_SIZE
+        self._pending: List[Tuple[Optional[int], PreparedDoc]] = []
+        self._pending_chunks = 0
+        self.written = 0
+        self.deleted = 0
+        self.batches = 0
+
+    def add(self, doc_id: Optional[int], doc: PreparedDoc) -> None:
+        """
+        doc_id：要替换的已有文档；新文档传 None。
+        """
+        self._pending.append((doc_id, doc))
+        self._pending_chunks += len(doc.chunks)
+        if self._pending_chunks >= self.batch_size:
+            self.flush()
+
+    def _upsert_doc(self, conn: sqlite3.Connection, doc_id: Optional[int], doc: PreparedDoc) -> int:
+        if doc_id is None:
+            cur = conn.execute(
+                f"INSERT INTO kb_doc{self.suffix}(path, title, content_hash, mtime_ns, size) VALUES (?, ?, ?, ?, ?)",
+                (doc.path, doc.title, doc.digest, doc.mtime_ns, doc.size),
+            )
+            return cur.lastrowid
+        self.deleted += _delete_doc_chunks(conn, doc_id, self.mode)
+        conn.execute(
+            "UPDATE kb_doc SET title = ?, content_hash = ?, mtime_ns = ?, size = ? WHERE id = ?",
+            (doc.title, doc.digest, doc.mtime_ns, doc.size, doc_id),
+        )
+        return doc_id
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        chunk_rows: List[Tuple[int, int, int, str]] = []
+        fts_rows: List[Tuple[int, str]] = []
+        with get_db().write() as conn:
+            chunk_id = _next_chunk_id(conn, f"kb_chunk{self.suffix}")
+            for doc_id, doc in self._pending:
+                doc_id = self._upsert_doc(conn, doc_id, doc)
+                for chunk_index, content in enumerate(doc.chunks):
+                    chunk_rows.append((chunk_id, doc_id, chunk_index, content))
+                    if self.write_fts:
+                        fts_rows.append((chunk_id, doc.segmented[chunk_index]))
+                    chunk_id += 1
+            conn.executemany(
+                f"INSERT INTO kb_chunk{self.suffix}(id, doc_id, chunk_index, content) VALUES (?, ?, ?, ?)",
+                chunk_rows,
+            )
+            if fts_rows:
+                conn.executemany(f"INSERT INTO kb_chunk_fts{self.suffix}(rowid, content) VALUES (?, ?)", fts_rows)
+        self.written += len(chunk_rows)
+        self.batches += 1
+        self._pending = []
+        self._pending_chunks = 0
+        log(f"💾 批量提交: 已写入 {self.written} 块")
+
+
+def _kb_paths(kb_dir: Path) -> List[Path]:
+    return sorted([p for p in kb_dir.glob("**/*") if p.suffix.lower() in {".md", ".txt"}])
+
+
+def _reindex(mode: str, kb_dir: Path, full: bool) -> IngestReport:
+    return _rebuild(mode, kb_dir) if full else _sync(mode, kb_dir)
+
+
+def _load(paths: List[Path], doc_ids: List[Optional[int]], mode: str, suffix: str,
+          report: IngestReport) -> None:
+    """
+    切块（进程池）-> 批量写入（当前线程），文档按 paths 的顺序入库。
+    """
+    report.workers = _ingest_workers(len(paths))
+    writer = BulkWriter(mode, suffix)
+    docs = _prepare_docs(paths, mode if writer.write_fts else None, report.workers)
+    for idx, (doc_id, doc) in enumerate(zip(doc_ids, docs), start=1):
+        log(f"[{idx}/{len(paths)}] {'更新' if doc_id is not None else '新增'}文件: {doc.path} (chunks={len(doc.chunks)})")
+        writer.add(doc_id, doc)
+        report.bytes_read += doc.size
+        (report.updated if doc_id is not None else report.added).append(doc.path)
+    writer.flush()
+    report.chunks_written += writer.written
+    report.chunks_deleted += writer.deleted
+    report.batches += writer.batches
+
+
+def _rebuild(mode: str, kb_dir: Path) -> IngestReport:
+    """
+    全量重建：所有文档写进影子表，最后在一个写事务里换表 + bump 版本号。
+    文档之间分批提交（不长时间占着写锁），但影子表对检索不可见，换表前线上索引一直是旧的完整版本。
+    批量导入期间关掉影子 FTS 表的自动合并，导完 optimize 一次（边写边合并会反复重写同一批段）。
+    """
+    report = IngestReport(full=True)
+    db = get_db()
+    fts = f"kb_chunk_fts{SHADOW_SUFFIX}"
+    with db.connection() as conn:
+        previous = [row["path"] for row in conn.execute("SELECT path FROM kb_doc")]
+
+    log("🧱 全量重建：写入影子表...")
+    with db.write() as conn:
+        create_shadow_tables(conn, mode)
+        conn.execute(f"INSERT INTO {fts}({fts}, rank) VALUES ('automerge', 0)")
+    try:
+        paths = _kb_paths(kb_dir)
+        log(f"📊 共找到 {len(paths)} 个文档")
+        _load(paths, [None] * len(paths), mode, SHADOW_SUFFIX, report)
+
+        with db.write() as conn:
+            optimize_fts(conn, fts)
+            conn.execute(f"INSERT INTO {fts}({fts}, rank) VALUES ('automerge', 4)")
+            report.chunks_deleted = conn.execute("SELECT COUNT(*) FROM kb_chunk").fetchone()[0]
+            report.generation = swap_shadow_tables(conn, mode)
+    except BaseException as e:
+        log(f"❌ 全量重建失败，线上索引未改动。错误: {e!r}")
+        with db.write() as conn:
+            drop_shadow_tables(conn)
+        raise
+    # 重建前后都在的路径不算删除
+    added = set(report.added)
+    report.removed = [path for path in previous if path not in added]
+    log("🔁 影子表已换上线")
+    return report
+
+
+def _sync(mode: str, kb_dir: Path) -> IngestReport:
+    report = IngestReport()
+    db = get_db()
+
+    with db.connection() as conn:
+        known: Dict[str, sqlite3.Row] = {
+            row["path"]: row
+            for row in conn.execute("SELECT id, path, content_hash, mtime_ns, size FROM kb_doc")
+        }
+
+    paths = _kb_paths(kb_dir)
+    log(f"📊 共找到 {len(paths)} 个文档（已入库 {len(known)} 个）")
+
+    # 1) 找出要重新入库的文档（stat / hash 都在这里，切块交给 _load）
+    changed: List[Path] = []
+    doc_ids: List[Optional[int]] = []
+    touched: List[Tuple[int, int, int]] = []
+    for p in paths:
+        key = p.as_posix()
+        row = known.pop(key, None)
+        st = p.stat()
+        if row is not None and row["mtime_ns"] == st.st_mtime_ns and row["size"] == st.st_size:
+            report.unchanged.append(key)
+            continue
+        if row is not None and row["content_hash"] == _file_digest(p):
+            # 只是 touch 过：内容没变，记下新的 mtime 下次直接跳过
+            touched.append((st.st_mtime_ns, st.st_size, row["id"]))
+            report.unchanged.append(key)
+            continue
+        changed.append(p)
+        doc_ids.append(row["id"] if row is not None else None)
+
+    if touched:
+        with db.write() as conn:
+            conn.executemany("UPDATE kb_doc SET mtime_ns = ?, size = ? WHERE id = ?", touched)
+
+    # 2) 新增 / 修改的文档：只替换它们自己的 chunk
+    try:
+        _load(changed, doc_ids, mode, "", report)
+    except Exception as e:
+        log(f"❌ 文档入库失败，当前批次已回滚（旧 chunk 保留）。错误: {e}")
+        raise
 
-            for chunk_text in _iter_chunks_streaming(p):
-                # 先插入 kb_chunk 以拿到 rowid(chunk_id)，fts 用 rowid 对齐
-                cur.execute(
-                    "INSERT INTO kb_chunk(doc_id, chunk_index, content) VALUES (?, ?, ?)",
-                    (doc_id, chunk_index, chunk_text),
-                )
-                chunk_id = cur.lastrowid
-                cur.execute(
-                    "INSERT INTO kb_chunk_fts(rowid, content) VALUES (?, ?)",
-                    (chunk_id, chunk_text),
-                )
+    # 3) 目录里已经没有的文档
+    if known:
+        with db.write() as conn:
+            for key, row in known.items():
+                report.chunks_deleted += _delete_doc_chunks(conn, row["id"], mode)
+                conn.execute("DELETE FROM kb_doc WHERE id = ?", (row["id"],))
+                report.removed.append(key)
+                log(f"🗑️ 删除文档: {key}")
 
-                chunk_index += 1
-                total_chunks += 1
+    # 4) 增量写入会留下很多小段：合并一部分（有页数上限），全量 optimize 交给重建 / --optimize
+    if report.changed and settings.RAG_FTS_MERGE_PAGES > 0:
+        with db.write() as conn:
+            merge_fts(conn, settings.RAG_FTS_MERGE_PAGES)
 
-                if total_chunks % BATCH_SIZE == 0:
-                    conn.commit()
-                    log(f"💾 批量提交: 已处理 {total_chunks} 块")
+    return report
 
-            conn.commit()
-            log(f"✅ 文档完成: {p} (chunks={chunk_index})")
 
-        log(f"\n🎉 索引重建完成！共处理 {total_chunks} 块数据")
+def _db_size() -> int:
+    path = Path(settings.DB_PATH)
+    wal = path.with_name(path.name + "-wal")
+    return sum(p.stat().st_size for p in (path, wal) if p.exists())
 
-    except Exception as e:
-        conn.rollback()
-        log(f"❌ 索引重建失败，已回滚。错误: {e}")
-        raise
-    finally:
-        conn.close()
+
+def compact_kb(optimize: bool = True) -> Tuple[int, int]:
+    """
+    维护命令（python -m app.agent.rag.ingest --migrate-fts）：
+    老库迁移到外部内容 FTS 表（init_rag_tables 也会自动迁移）、optimize 索引，
+    再 VACUUM + checkpoint 把省下来的页还给文件系统。返回前后的库文件大小（字节，含 WAL）。
+    VACUUM 期间会阻塞写入，挑没人写的时候跑。
+    """
+    before = _db_size()
+    init_rag_tables()
+    if optimize:
+        with get_db().write() as conn:
+            optimize_fts(conn)
+    with get_db().connection() as conn:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    after = _db_size()
+    log(f"🧹 KB 库整理完成: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB")
+    return before, after
 
 
 if __name__ == "__main__":
-    reindex_kb()
-    print("KB reindexed ✅")
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fts-mode", choices=FTS_MODES, default=None)
+    parser.add_argument("--full", action="store_true", help="忽略 hash，全量重建")
+    parser.add_argument("--migrate-fts", action="store_true", help="迁移到外部内容 FTS 表 + optimize + VACUUM，不入库")
+    args = parser.parse_args()
+    if args.migrate_fts:
+        before, after = compact_kb()
+        print(f"KB compacted ✅ {before} -> {after} bytes")
+    else:
+        report = reindex_kb(fts_mode=args.fts_mode, full=args.full)
+        print(f"KB reindexed ✅ {report.summary()}")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：packer.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: RAG 上下文打包：同一文档相邻的 chunk 合并成一段（去掉重叠部分），按相关度在 token 预算内装进 prompt
+"""
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, List
+
+from app.agent.rag.compress import extract_snippet, query_terms
+from app.agent.rag.retriever import RetrievedChunk
+
+_CJK_CHAR_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+
+# 预算太少时不再硬塞一段截得只剩几个字的内容
+_MIN_SPAN_TOKENS = 24
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估 token 数（不加载真正的 tokenizer）：
+    - 中文字符/全角标点：约 1 个 token 一个字
+    - 英文/数字：约 4 个字符一个 token，每个词至少 1 个
+    - 其它（空白、半角标点）：约 4 个字符一个 token
+    宁可略高估：预算是上限，估少了才会超。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_CHAR_RE.findall(text))
+    words = _WORD_RE.findall(text)
+    word_chars = sum(len(w) for w in words)
+    word_tokens = sum(max(1, (len(w) + 3) // 4) for w in words)
+    other = len(text) - cjk - word_chars
+    return cjk + word_tokens + (other + 3) // 4
+
+
+def _overlap_len(left: str, right: str, max_overlap: int, min_overlap: int = 8) -> int:
+    """
+    left 的后缀与 right 的前缀最长重合多少字符（切块时相邻 chunk 有 CHUNK_OVERLAP 的重叠）。
+    太短的重合（比如都是一个句号）当作巧合，不算重叠。
+    """
+    for n in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:n]):
+            return n
+    return 0
+
+
+@dataclass
+class ContextSpan:
+    cite_key: str
+    title: str
+    chunk_indexes: List[int]
+    chunks: List[RetrievedChunk]  # 组成这一段的原始 chunk（按 chunk_index 排序）
+    content: str
+    rank: int  # 组内最相关 chunk 在检索结果里的名次（越小越相关）
+
+    @property
+    def label(self) -> str:
+        first, last = self.chunk_indexes[0], self.chunk_indexes[-1]
+        return f"{self.title}#{first}" if first == last else f"{self.title}#{first}-{last}"
+
+
+@dataclass
+class PackedContext:
+    text: str
+    spans: List[ContextSpan]
+    tokens: int
+    dropped: List[RetrievedChunk] = field(default_factory=list)  # 预算装不下、没进 prompt 的 chunk
+
+    @property
+    def citations(self) -> Dict[str, List[int]]:
+        """
+        引用表：prompt 里的编号 -> 原始 chunk_id 列表。
+        """
+        return {s.cite_key: [c.chunk_id for c in s.chunks] for s in self.spans}
+
+    @property
+    def chunks(self) -> List[RetrievedChunk]:
+        """
+        放进 prompt 的原始 chunk，cite_key 换成它所在段的编号（回答里的 [Cn] 能直接对回 chunk_id）。
+        """
+        return [replace(c, cite_key=s.cite_key) for s in self.spans for c in s.chunks]
+
+
+def merge_adjacent(chunks: List[RetrievedChunk], max_overlap: int = 200) -> List[ContextSpan]:
+    """
+    同一文档里 chunk_index 连续的 chunk 合并成一段，去掉相邻两块之间重复的那段文字。
+    返回的段按相关度排序（组内最靠前的名次），cite_key 按这个顺序重新编号。
+    """
+    rank = {id(c): i for i, c in enumerate(chunks)}
+    by_doc: Dict[tuple, List[RetrievedChunk]] = {}
+    for c in chunks:
+        by_doc.setdefault((c.doc_id, c.title), []).append(c)
+
+    spans: List[ContextSpan] = []
+    for (_, title), group in by_doc.items():
+        group.sort(key=lambda c: c.chunk_index)
+        run = [group[0]]
+        for c in group[1:] + [None]:
+            if c is not None and c.chunk_index == run[-1].chunk_index + 1:
+                run.append(c)
+                continue
+            content = run[0].content
+            for nxt in run[1:]:
+                n = _overlap_len(content, nxt.content, max_overlap)
+                content += nxt.content[n:] if n else "\n" + nxt.content
+            spans.append(ContextSpan(
+                cite_key="",
+                title=title,
+                chunk_indexes=[x.chunk_index for x in run],
+                chunks=run,
+                content=content,
+                rank=min(rank[id(x)] for x in run),
+            ))
+            run = [c]
+
+    spans.sort(key=lambda s: s.rank)
+    for i, s in enumerate(spans, 1):
+        s.cite_key = f"C{i}"
+    return spans
+
+
+def _render(span: ContextSpan) -> str:
+    return f"[{span.cite_key}] ({span.label})\n{span.content}\n"
+
+
+def pack_context(chunks: List[RetrievedChunk], query: str = "", max_tokens: int = 1000,
+                 snippet_chars: int = 0) -> PackedContext:
+    """
+    1) 合并相邻 chunk（merge_adjacent）
+    2) snippet_chars > 0 且有 query 时，每段只保留相关句子（段里每个 chunk 给 snippet_chars 的额度）
+    3) 按相关度依次装入，直到 max_tokens；装不下的那段按剩余预算再截一次，还不够就丢掉
+    装进去的段重新连续编号（C1..Cn），引用表见 PackedContext.citations。
+    """
+    spans = merge_adjacent(chunks)
+    terms = query_terms(query) if query else set()
+    if terms and snippet_chars > 0:
+        for s in spans:
+            s.content = extract_snippet(terms, s.content, snippet_chars * len(s.chunks))
+
+    packed: List[ContextSpan] = []
+    dropped: List[RetrievedChunk] = []
+    used = 0
+    for s in spans:
+        s.cite_key = f"C{len(packed) + 1}"
+        cost = estimate_tokens(_render(s)) + 1
+        remaining = max_tokens - used
+        if cost > remaining and remaining >= _MIN_SPAN_TOKENS:
+            # 按 token/字符比例估一个能装下的长度，截完再量一次（估算不准就继续缩）
+            chars = len(s.content) * (remaining - estimate_tokens(_render(replace(s, content="")))) // cost
+            while chars >= _MIN_SPAN_TOKENS and cost > remaining:
+                s.content = extract_snippet(terms, s.content, chars)
+                cost = estimate_tokens(_render(s)) + 1
+                chars = chars * 3 // 4
+        if cost > remaining or not s.content:
+            dropped.extend(s.chunks)
+            continue
+        packed.append(s)
+        used += cost
+
+    text = "\n".join(_render(s) for s in packed)
+    return PackedContext(text=text, spans=packed, tokens=used, dropped=dropped)
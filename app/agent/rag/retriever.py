@@ -7,13 +7,19 @@
 @note: 
 """
 import re
+import sqlite3
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List, Optional
 
-from app.agent.rag.db import get_conn
+from app.agent.rag.db import get_fts_mode
+from app.agent.rag.fts import cjk_query_terms
+from app.agent.rag.vectors import HAS_NUMPY, VectorIndex, get_vector_index, mmr_select, np, term_vectors
+from app.infra.db import get_db
+from app.infra.executor import run_blocking
+from app.infra.settings import settings
 
 
-def _to_fts_query(user_query: str) -> str:
+def _to_fts_query(user_query: str, mode: str = "unicode61") -> str:
     """
     把用户自然语言 query 转为更稳定的 FTS5 查询字符串。
 
@@ -24,7 +30,8 @@ def _to_fts_query(user_query: str) -> str:
     策略：
     1) 先抽取英文/数字 token（最稳，例如 STAR / B1 / GPT）
     2) 再根据中文关键词做“同义扩展”（可控的规则，不依赖 LLM）
-    3) 用 OR 连接，并用双引号包住 token，避免 FTS 语法歧义
+    3) bigram / trigram 索引：中文按和入库一致的方式切成 n-gram term
+    4) 用 OR 连接，并用双引号包住 token，避免 FTS 语法歧义
     """
     q = (user_query or "").strip()
     if not q:
@@ -46,6 +53,12 @@ def _to_fts_query(user_query: str) -> str:
     if "语法" in q or "B1" in q.upper():
         tokens += ["grammar", "B1", "articles", "tense"]
 
+    # 3) 中文 n-gram（unicode61 模式下整串中文是一个 token，切了也查不到）
+    tokens += cjk_query_terms(q, mode)
+    if mode == "trigram":
+        # trigram 索引查不到不足 3 个字符的 term
+        tokens = [t for t in tokens if len(t) >= 3]
+
     # 去重（保持顺序）
     seen = set()
     uniq = []
@@ -59,12 +72,14 @@ def _to_fts_query(user_query: str) -> str:
         seen.add(key)
         uniq.append(tt)
 
-    # 3) 组装成 FTS 查询： "STAR" OR "behavioral" OR ...
+    # 4) 组装成 FTS 查询： "STAR" OR "behavioral" OR ...
     #    双引号可以避免 token 被当作语法操作符解析
     if uniq:
         return " OR ".join([f'"{t}"' for t in uniq])
 
     # 如果抽不到任何 token，就退回一个非常保守的查询（可能仍然命中率低）
+    if mode == "bigram":
+        return ""
     return f'"{q}"'
 
 
@@ -75,42 +90,113 @@ class RetrievedChunk:
     title: str
     chunk_index: int
     content: str
-    score: float  # SQLite bm25 分数（越小越相关，fts5 的 bm25 是“越小越好”）
+    score: float  # SQLite bm25 分数（越小越相关，fts5 的 bm25 是“越小越好”）；只被向量召回的为 0.0
+    doc_id: int = 0  # kb_doc.id（打包上下文时合并同一文档的相邻 chunk）
+    vector_score: float = 0.0  # 向量检索的余弦相似度（越大越相关）；没开稠密检索 / 没被向量召回的为 0.0
+
+
+def _rrf_fuse(ranked_lists: List[List[int]], k: int) -> List[int]:
+    """
+    Reciprocal Rank Fusion：每一路结果按名次给 1 / (k + rank) 分，求和排序。
+    只看名次不看原始分数，bm25（越小越好、无上界）和余弦相似度（0~1）不用对齐量纲。
+    """
+    fused: Dict[int, float] = {}
+    for ranked in ranked_lists:
+        for rank, chunk_id in enumerate(ranked, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=lambda cid: -fused[cid])
+
+
+def _fetch_chunks(conn: sqlite3.Connection, chunk_ids: List[int]) -> Dict[int, sqlite3.Row]:
+    if not chunk_ids:
+        return {}
+    placeholders = ",".join("?" * len(chunk_ids))
+    rows = conn.execute(f"""
+                SELECT kb_chunk.id          AS chunk_id,
+                       kb_chunk.doc_id      AS doc_id,
+                       kb_doc.title         AS title,
+                       kb_chunk.chunk_index AS chunk_index,
+                       kb_chunk.content     AS content,
+                       0.0                  AS score
+                FROM kb_chunk
+                         JOIN kb_doc ON kb_doc.id = kb_chunk.doc_id
+                WHERE kb_chunk.id IN ({placeholders})
+                """, chunk_ids).fetchall()
+    return {int(r["chunk_id"]): r for r in rows}
+
+
+def _diversify(rows: List[sqlite3.Row], k: int, index: Optional[VectorIndex]) -> List[sqlite3.Row]:
+    """
+    从按相关度排好序的候选里选 k 个：MMR（词向量相似度）+ 每文档软上限。
+    相关度用名次线性映射到 (0, 1]：bm25 / RRF 分数的量纲和余弦相似度对不上，名次最稳。
+    没装 numpy 时只做每文档上限。候选够 k 个就一定返回 k 个：上限只决定先选谁。
+    """
+    per_doc = settings.RAG_MAX_CHUNKS_PER_DOC
+    if not HAS_NUMPY or len(rows) <= 1:
+        taken: Dict[int, int] = {}
+        picked, overflow = [], []
+        for r in rows:
+            doc_id = int(r["doc_id"])
+            if per_doc > 0 and taken.get(doc_id, 0) >= per_doc:
+                overflow.append(r)
+                continue
+            taken[doc_id] = taken.get(doc_id, 0) + 1
+            picked.append(r)
+        return (picked + overflow)[:k]
+
+    vectors = term_vectors([int(r["chunk_id"]) for r in rows], [str(r["content"]) for r in rows], index)
+    relevance = 1.0 - np.arange(len(rows), dtype=np.float32) / len(rows)
+    order = mmr_select(vectors, relevance, k, settings.RAG_MMR_LAMBDA,
+                       groups=[int(r["doc_id"]) for r in rows], per_group=per_doc)
+    return [rows[i] for i in order]
 
 
 def retrieve(query: str, k: int = 4) -> List[RetrievedChunk]:
     """
     使用 SQLite FTS5 检索最相关的 chunk。
     如果 query 太短或为空，直接返回空。
+    开启 RAG_VECTOR_ENABLED 且向量文件存在时走混合检索：bm25 和向量各取候选，RRF 融合。
+    先多取一池候选（RAG_CANDIDATE_POOL），去重后用 MMR 选出 k 个互相不重复的 chunk，
+    同一文档优先只取 RAG_MAX_CHUNKS_PER_DOC 个（相邻 chunk 有 CHUNK_OVERLAP 的重叠，不挑开会浪费 prompt），
+    其它文档的候选不够时再从同一文档补满 k 个。
     """
     q = (query or "").strip()
     if len(q) < 2:
         return []
 
-    fts_q = _to_fts_query(q)
-    if not fts_q:
-        return []
-
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # FTS5 的 MATCH 语法：直接用 query 做匹配
-    # bm25(kb_chunk_fts) 可以得到相关度分数（越小越相关）
-    cur.execute("""
-                SELECT kb_chunk.id          AS chunk_id,
-                       kb_doc.title         AS title,
-                       kb_chunk.chunk_index AS chunk_index,
-                       kb_chunk.content     AS content,
-                       bm25(kb_chunk_fts)   AS score
-                FROM kb_chunk_fts
-                         JOIN kb_chunk ON kb_chunk.id = kb_chunk_fts.rowid
-                         JOIN kb_doc ON kb_doc.id = kb_chunk.doc_id
-                WHERE kb_chunk_fts MATCH ?
-                ORDER BY score LIMIT ?
-                """, (fts_q, k))
-
-    rows = cur.fetchall()
-    conn.close()
+    index = get_vector_index()
+    dense_scores: Dict[int, float] = {}
+    with get_db().connection() as conn:
+        fts_q = _to_fts_query(q, get_fts_mode(conn))
+        if not fts_q and index is None:
+            return []
+
+        # FTS5 的 MATCH 语法：直接用 query 做匹配
+        # bm25(kb_chunk_fts) 可以得到相关度分数（越小越相关）
+        pool = max(k, settings.RAG_CANDIDATE_POOL)
+        limit = pool if index is None else max(pool, settings.RAG_HYBRID_CANDIDATES)
+        rows = conn.execute("""
+                    SELECT kb_chunk.id          AS chunk_id,
+                           kb_chunk.doc_id      AS doc_id,
+                           kb_doc.title         AS title,
+                           kb_chunk.chunk_index AS chunk_index,
+                           kb_chunk.content     AS content,
+                           bm25(kb_chunk_fts)   AS score
+                    FROM kb_chunk_fts
+                             JOIN kb_chunk ON kb_chunk.id = kb_chunk_fts.rowid
+                             JOIN kb_doc ON kb_doc.id = kb_chunk.doc_id
+                    WHERE kb_chunk_fts MATCH ?
+                    ORDER BY score LIMIT ?
+                    """, (fts_q, limit)).fetchall() if fts_q else []
+
+        if index is not None:
+            dense_scores = dict(index.search(q, limit))
+            fused = _rrf_fuse([[int(r["chunk_id"]) for r in rows], list(dense_scores)], settings.RAG_RRF_K)[:pool]
+            by_id = {int(r["chunk_id"]): r for r in rows}
+            # 只被向量召回的 chunk 补查正文；score 记 0.0（bm25 没命中），相关度看 vector_score
+            by_id.update(_fetch_chunks(conn, [cid for cid in fused if cid not in by_id]))
+            # 向量文件比库旧时，已删除的 chunk 查不到，直接跳过
+            rows = [by_id[cid] for cid in fused if cid in by_id]
 
     # 2) 去重（相同 title + chunk_index 只保留一个）
     #    （因为 kb_chunk 里的 chunk_index 是按文档顺序严格递增的）
@@ -123,7 +209,7 @@ def retrieve(query: str, k: int = 4) -> List[RetrievedChunk]:
         seen.add(key)
         deduped_rows.append(r)
 
-    rows = deduped_rows
+    rows = _diversify(deduped_rows, k, index)
 
     results: List[RetrievedChunk] = []
     for i, r in enumerate(rows, 1):
@@ -135,6 +221,15 @@ def retrieve(query: str, k: int = 4) -> List[RetrievedChunk]:
                 chunk_index=int(r["chunk_index"]),
                 content=str(r["content"]),
                 score=float(r["score"]),
+                doc_id=int(r["doc_id"]),
+                vector_score=dense_scores.get(int(r["chunk_id"]), 0.0),
             )
         )
     return results
+
+
+async def aretrieve(query: str, k: int = 4) -> List[RetrievedChunk]:
+    """
+    async 版 retrieve：SQLite 查询放到 DB 线程池里跑，不阻塞 event loop。
+    """
+    return await run_blocking(retrieve, query, k)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：semantic_cache.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 近似重复问题的回答缓存：MinHash 签名 + LSH 分桶，换个说法但检索到同一批资料的问题复用已有回答
+"""
+import random
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.agent.rag.fts import CJK_STOP_BIGRAMS
+from app.agent.rag.vectors import tokenize
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+class MinHasher:
+    """
+    num_perm 个 (a * x + b) mod p 的哈希函数；集合的签名是每个函数下的最小值。
+    两个集合签名里相等位置的比例 ≈ Jaccard 相似度。种子固定，签名在进程间可比。
+    """
+
+    def __init__(self, num_perm: int, seed: int = 1):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [(rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def signature(self, features: Iterable[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(f.encode("utf-8")) for f in set(features)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH for a, b in self._params)
+
+
+def jaccard(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def containment(j: float, size_a: int, size_b: int) -> float:
+    """
+    由 Jaccard 反推“小集合有多少落在大集合里”：|A∩B| = J * (|A| + |B|) / (1 + J)。
+    短问题（“STAR 怎么答”）和长问题的 Jaccard 天然很低，用包含度比较才公平。
+    """
+    if not size_a or not size_b:
+        return 0.0
+    inter = j * (size_a + size_b) / (1 + j)
+    return min(1.0, inter / min(size_a, size_b))
+
+
+def query_shingles(query: str) -> Set[str]:
+    # 英文词 + 中文二元组，去掉问句虚词（“怎么”“如何”不说明问的是什么）
+    return {t for t in tokenize(query) if t not in CJK_STOP_BIGRAMS}
+
+
+@dataclass
+class _Entry:
+    query: str  # 原问题（回答本身存在精确缓存里，用它取）
+    k: int
+    generation: int
+    evidence_sig: Tuple[int, ...]
+    query_sig: Tuple[int, ...]
+    query_size: int
+    bands: List[Tuple[int, Tuple[int, ...]]]
+
+
+class SemanticCache:
+    """
+    只存“问题 -> 签名”，不存回答：命中后用记下的原问题去精确回答缓存里取（回答只存一份）。
+    - 证据签名：检索到的 chunk_id 集合的 MinHash，按 bands x rows 切段做 LSH，同段相同的进候选
+    - 候选要同时满足：证据 Jaccard >= evidence_threshold，问题包含度 >= query_threshold
+      （同一批资料也可能被完全不同的问题检索到，问题本身还要有一定重合）
+    - 条目数上限，超出按 LRU 淘汰；KB 版本号不同的条目不会命中（版本变了由 RagCache 整体清空）
+    只在进程内：跨 worker 共享的是精确回答缓存（SQLite 层）。
+    """
+
+    def __init__(self, max_entries: int, evidence_threshold: float, query_threshold: float,
+                 bands: int = 16, rows: int = 4):
+        self.max_entries = max_entries
+        self.evidence_threshold = evidence_threshold
+        self.query_threshold = query_threshold
+        self.bands = bands
+        self.rows = rows
+        self._evidence_hasher = MinHasher(bands * rows, seed=1)
+        self._query_hasher = MinHasher(64, seed=2)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.candidates = 0
+        self.rejected = 0  # 进了候选但相似度不够
+
+    def _bands(self, sig: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        return [(i, sig[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def add(self, query: str, k: int, generation: int, chunk_ids: Iterable[int]) -> None:
+        shingles = query_shingles(query)
+        evidence_sig = self._evidence_hasher.signature(str(c) for c in chunk_ids)
+        entry = _Entry(
+            query=query,
+            k=k,
+            generation=generation,
+            evidence_sig=evidence_sig,
+            query_sig=self._query_hasher.signature(shingles),
+            query_size=len(shingles),
+            bands=self._bands(evidence_sig),
+        )
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for band in entry.bands:
+                self._buckets.setdefault(band, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def lookup(self, query: str, k: int, generation: int, chunk_ids: Iterable[int]) -> Optional[str]:
+        """
+        返回可以复用的那条原问题（调用方用它查精确回答缓存），没有返回 None。
+        """
+        shingles = query_shingles(query)
+        evidence_sig = self._evidence_hasher.signature(str(c) for c in chunk_ids)
+        query_sig = self._query_hasher.signature(shingles)
+        with self._lock:
+            self.lookups += 1
+            ids: Set[int] = set()
+            for band in self._bands(evidence_sig):
+                ids |= self._buckets.get(band, set())
+            best: Optional[Tuple[float, int]] = None
+            for entry_id in ids:
+                e = self._entries[entry_id]
+                if e.k != k or e.generation != generation:
+                    continue
+                self.candidates += 1
+                ev = jaccard(evidence_sig, e.evidence_sig)
+                qc = containment(jaccard(query_sig, e.query_sig), len(shingles), e.query_size)
+                if ev < self.evidence_threshold or qc < self.query_threshold:
+                    self.rejected += 1
+                    continue
+                if best is None or ev + qc > best[0]:
+                    best = (ev + qc, entry_id)
+            if best is None:
+                return None
+            self._entries.move_to_end(best[1])
+            self.hits += 1
+            return self._entries[best[1]].query
+
+    def discard(self, query: str) -> None:
+        """
+        精确缓存里已经取不到回答（过期/被淘汰）的条目，删掉免得一直白命中。
+        """
+        with self._lock:
+            for entry_id in [i for i, e in self._entries.items() if e.query == query]:
+                self._remove(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "candidates": self.candidates,
+            "rejected": self.rejected,
+        }
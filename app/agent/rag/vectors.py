@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：vectors.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 本地稠密检索：哈希 TF-IDF 向量（入库时算好）+ mmap 的 float32 矩阵 + NumPy 点积，不依赖网络/模型
+
+numpy 是可选依赖：没装时 get_vector_index() 返回 None，检索退回纯 bm25。
+"""
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.agent.rag.fts import cjk_ngrams
+from app.infra.settings import settings
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 取决于部署环境
+    np = None
+
+log = logging.getLogger("rag.vectors")
+
+HAS_NUMPY = np is not None
+
+# 文件格式：MAGIC | version(u16) | header_len(u32) | header(JSON) | 填充到 64 字节对齐
+#          | chunk_id int64[count] | idf float32[dim] | 向量 float32[count * dim]（行主序，已 L2 归一化）
+# 整个文件只读 mmap：多个 worker 进程映射同一个文件，共用操作系统的页缓存，不各自拷一份
+MAGIC = b"EAKV"
+VERSION = 1
+_PREFIX = struct.Struct("<4sHI")
+_ALIGN = 64
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_ASCII_RE = re.compile(r"[A-Za-z0-9]+")
+
+
+def vector_path() -> Path:
+    """
+    向量文件和 SQLite 库放在一起（DB_PATH 换了，向量文件跟着换）。
+    """
+    return Path(settings.DB_PATH).with_suffix(".kbvec")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    英文/数字按词（小写），中文按二元组：和 bigram FTS 模式的切分一致。
+    """
+    tokens: List[str] = []
+    for m in _TOKEN_RE.finditer(text or ""):
+        run = m.group()
+        if _ASCII_RE.fullmatch(run):
+            tokens.append(run.lower())
+        else:
+            tokens += cjk_ngrams(run, 2)
+    return tokens
+
+
+def _hashed_tf(text: str, dim: int) -> Dict[int, float]:
+    """
+    特征哈希：term -> (桶, 符号)。带符号的哈希让碰撞的 term 互相抵消而不是累加，内积仍是无偏估计。
+    tf 用 1 + log(tf)，长 chunk 里反复出现的词不至于压过其它词。
+    """
+    vec: Dict[int, float] = {}
+    for term, tf in Counter(tokenize(text)).items():
+        h = zlib.crc32(term.encode("utf-8"))
+        bucket = h % dim
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        vec[bucket] = vec.get(bucket, 0.0) + sign * (1.0 + math.log(tf))
+    return vec
+
+
+def embed(text: str, dim: int, idf: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """
+    单条文本 -> L2 归一化的哈希 TF(-IDF) 向量（没有 idf 时就是纯 tf）。
+    """
+    v = np.zeros(dim, dtype=np.float32)
+    for bucket, w in _hashed_tf(text, dim).items():
+        v[bucket] = w
+    if idf is not None:
+        v *= idf
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+@lru_cache(maxsize=4096)
+def _chunk_vector(chunk_id: int, content: str, dim: int) -> "np.ndarray":
+    # kb_chunk.id 是 AUTOINCREMENT，重建索引也不会复用旧 id，按 id 缓存不会串
+    v = embed(content, dim)
+    v.flags.writeable = False
+    return v
+
+
+class VectorIndex:
+    """
+    只读的向量索引（mmap 打开，加载几乎不花时间，也不占进程私有内存）。
+    search：一次矩阵-向量乘法算出所有 chunk 的余弦相似度，再用 argpartition 取 top-n。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with path.open("rb") as f:
+            magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"not a kb vector file (magic={magic!r} version={version}): {path}")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        self.dim = int(header["dim"])
+        self.count = int(header["count"])
+        self.meta = header
+        offset = _data_offset(header_len)
+        self.ids = np.memmap(path, dtype=np.int64, mode="r", offset=offset, shape=(self.count,)) \
+            if self.count else np.zeros(0, dtype=np.int64)
+        offset += self.count * 8
+        self.idf = np.array(np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=(self.dim,)))
+        offset += self.dim * 4
+        self.matrix = np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=(self.count, self.dim)) \
+            if self.count else np.zeros((0, self.dim), dtype=np.float32)
+
+    def embed(self, text: str) -> "np.ndarray":
+        return embed(text, self.dim, self.idf)
+
+    def lookup(self, chunk_ids: Sequence[int]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        按 chunk_id 取已经算好的向量：返回 (矩阵, 是否找到)。ids 入库时按升序写入，二分查找即可。
+        """
+        ids = np.asarray(chunk_ids, dtype=np.int64)
+        out = np.zeros((len(ids), self.dim), dtype=np.float32)
+        if self.count == 0 or len(ids) == 0:
+            return out, np.zeros(len(ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.ids, ids), self.count - 1)
+        found = self.ids[pos] == ids
+        out[found] = self.matrix[pos[found]]
+        return out, found
+
+    def search(self, query: str, top_n: int) -> List[Tuple[int, float]]:
+        """
+        返回 [(chunk_id, 余弦相似度)]，按相似度降序；相似度 <= 0 的不要（和查询没有共同 term）。
+        """
+        if self.count == 0 or top_n <= 0:
+            return []
+        q = self.embed(query)
+        if not q.any():
+            return []
+        scores = self.matrix @ q
+        n = min(top_n, self.count)
+        top = np.argpartition(scores, self.count - n)[self.count - n :]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def _data_offset(header_len: int) -> int:
+    end = _PREFIX.size + header_len
+    return (end + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_vector_file(path: Path, ids: "np.ndarray", idf: "np.ndarray", matrix: "np.ndarray") -> None:
+    """
+    先写临时文件再 os.replace：正在用旧文件的 mmap 不受影响（还指向旧 inode），新请求读到新文件。
+    """
+    count, dim = matrix.shape
+    header = json.dumps({"dim": dim, "count": count, "built_at": time.time()}).encode("utf-8")
+    offset = _data_offset(len(header))
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(_PREFIX.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * (offset - _PREFIX.size - len(header)))
+        f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        f.write(np.ascontiguousarray(idf, dtype=np.float32).tobytes())
+        f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def build_vector_index(conn: sqlite3.Connection, path: Optional[Path] = None,
+                       dim: Optional[int] = None) -> int:
+    """
+    从 kb_chunk 全量算向量写成文件，返回 chunk 数。
+    两步：先算每个 chunk 的稀疏 tf 和各桶的文档频率，再乘 idf、归一化，写进矩阵。
+    """
+    if np is None:
+        log.warning("kb_vectors_skipped reason=numpy_not_installed")
+        return 0
+    path = path or vector_path()
+    dim = dim or settings.RAG_VECTOR_DIM
+
+    ids: List[int] = []
+    sparse: List[Tuple["np.ndarray", "np.ndarray"]] = []
+    df = np.zeros(dim, dtype=np.int64)
+    for row in conn.execute("SELECT id, content FROM kb_chunk ORDER BY id"):
+        vec = _hashed_tf(row[1], dim)
+        idx = np.fromiter(vec.keys(), dtype=np.int64, count=len(vec))
+        ids.append(int(row[0]))
+        sparse.append((idx, np.fromiter(vec.values(), dtype=np.float32, count=len(vec))))
+        df[idx] += 1
+
+    count = len(ids)
+    idf = (np.log((count + 1) / (df + 1)) + 1.0).astype(np.float32)
+    matrix = np.zeros((count, dim), dtype=np.float32)
+    for i, (idx, val) in enumerate(sparse):
+        matrix[i, idx] = val * idf[idx]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_vector_file(path, np.asarray(ids, dtype=np.int64), idf, matrix)
+    log.info(f"kb_vectors_built path={path} count={count} dim={dim}")
+    return count
+
+
+def term_vectors(chunk_ids: Sequence[int], contents: Sequence[str],
+                 index: Optional[VectorIndex] = None) -> "np.ndarray":
+    """
+    候选 chunk 的词向量（MMR 算相似度用）：向量文件里有的直接取 mmap 的行，
+    没有的（没开稠密检索 / 文件比库旧）现算纯 tf 向量并按 chunk_id 缓存。
+    """
+    if index is not None:
+        out, found = index.lookup(chunk_ids)
+    else:
+        out = np.zeros((len(chunk_ids), settings.RAG_VECTOR_DIM), dtype=np.float32)
+        found = np.zeros(len(chunk_ids), dtype=bool)
+    dim = out.shape[1]
+    for i in np.flatnonzero(~found):
+        out[i] = _chunk_vector(int(chunk_ids[i]), contents[i], dim)
+    return out
+
+
+def mmr_select(vectors: "np.ndarray", relevance: "np.ndarray", k: int, lambda_: float,
+               groups: Optional[Sequence[int]] = None, per_group: int = 0) -> List[int]:
+    """
+    Maximal Marginal Relevance：每一步选 lambda * 相关度 - (1 - lambda) * 与已选结果的最大相似度 最高的候选。
+    - vectors：候选的 L2 归一化向量（相似度 = 点积，一次算出 n x n 矩阵）
+    - relevance：候选的相关度，越大越相关（建议归一化到 0~1，和相似度同量纲）
+    - groups / per_group：同一组（文档）最多选 per_group 个，0 表示不限。
+      这是软上限：只剩超上限的候选时，按 MMR 顺序从它们里补满 k 个（宁可同文档多几块，也不少给）
+    返回选中候选的下标（按选中顺序）。
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    sim = vectors @ vectors.T
+    rel = np.asarray(relevance, dtype=np.float32)
+    max_sim = np.zeros(n, dtype=np.float32)
+    chosen = np.zeros(n, dtype=bool)
+    capped = np.zeros(n, dtype=bool)  # 所在组已经选满 per_group 个
+    taken: Dict[int, int] = {}
+    selected: List[int] = []
+    while len(selected) < k:
+        score = lambda_ * rel - (1.0 - lambda_) * max_sim
+        score[chosen] = -np.inf
+        if not np.all(chosen | capped):
+            score[capped] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        chosen[best] = True
+        np.maximum(max_sim, sim[best], out=max_sim)
+        if groups is not None and per_group > 0:
+            g = groups[best]
+            taken[g] = taken.get(g, 0) + 1
+            if taken[g] >= per_group:
+                capped |= np.asarray(groups) == g
+    return selected
+
+
+_index: Optional[VectorIndex] = None
+_index_key: Optional[Tuple[str, int, int, int]] = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index() -> Optional[VectorIndex]:
+    """
+    当前向量索引；没开启 / 没装 numpy / 还没建过 时返回 None。
+    文件被 reindex 替换后自动重新映射：按 (inode, 大小, mtime) 判断，
+    同一个 mtime 时间片里 os.replace 换上来的新文件（inode 不同）也能发现。
+    """
+    global _index, _index_key
+    if not settings.RAG_VECTOR_ENABLED or np is None:
+        return None
+    path = vector_path()
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    key = (str(path), st.st_ino, st.st_size, st.st_mtime_ns)
+    if _index_key == key:
+        return _index
+    with _index_lock:
+        if _index_key != key:
+            try:
+                _index = VectorIndex(path)
+            except (ValueError, OSError) as e:
+                log.warning(f"kb_vectors_load_failed path={path} err={e}")
+                _index = None
+            _index_key = key
+        return _index
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：warmup.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: RAG 缓存预热：固定会被问到的查询（口语陪练 FEEDBACK 的四个检索主题等）在启动 / reindex 后先算好
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.agent.deadline import Deadline
+from app.agent.rag.answer import REFUSAL_LOW_RELEVANCE, REFUSAL_NO_CITATION, ask_with_rag
+from app.agent.rag.cache import RAG_CACHE
+from app.infra.settings import settings
+
+log = logging.getLogger("rag.warmup")
+
+# 注册的预热查询：(query, k)。k 要和线上调用一致，否则缓存 key 对不上
+_WARM_QUERIES: List[Tuple[str, int]] = []
+
+
+def register_warm_query(query: str, k: int) -> None:
+    if (query, k) not in _WARM_QUERIES:
+        _WARM_QUERIES.append((query, k))
+
+
+def warm_queries() -> List[Tuple[str, int]]:
+    return list(_WARM_QUERIES)
+
+
+class WarmupStatus:
+    """
+    - state：idle / running / done / failed / disabled
+    - ready：第一次预热跑完（不管单条成功与否）就一直是 True；
+      之后因为 reindex 再预热不会把实例重新标成未就绪（否则所有 worker 会同时被摘流量）
+    """
+
+    def __init__(self):
+        self.state = "idle"
+        self.ready = False
+        self.generation: Optional[int] = None  # 最近一次预热针对的 KB 版本号
+        self.runs = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.results: List[Dict[str, Any]] = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "generation": self.generation,
+            "runs": self.runs,
+            "duration_ms": round((self.finished_at - self.started_at) * 1000, 1)
+            if self.started_at and self.finished_at and self.finished_at >= self.started_at else None,
+            "queries": len(self.results),
+            "answered": sum(1 for r in self.results if r["answered"]),
+            "failed": sum(1 for r in self.results if r["error"]),
+            "results": self.results,
+        }
+
+
+WARMUP_STATUS = WarmupStatus()
+
+
+async def _warm_one(query: str, k: int, sem: asyncio.Semaphore, deadline: Deadline) -> Dict[str, Any]:
+    async with sem:
+        start = time.perf_counter()
+        result: Dict[str, Any] = {"query": query, "k": k, "answered": False, "error": None}
+        try:
+            text, chunks = await ask_with_rag(query, k=k, user_id="__warmup__", deadline=deadline)
+            # 拒答不会进回答缓存（检索结果仍然缓存了）
+            result["answered"] = bool(chunks) and text not in (REFUSAL_LOW_RELEVANCE, REFUSAL_NO_CITATION)
+        except Exception as e:
+            result["error"] = repr(e)
+            log.warning(f"rag_warmup_failed query={query!r} err={e!r}")
+        result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+
+async def warm_rag_cache(reason: str = "manual") -> WarmupStatus:
+    """
+    把注册的查询都跑一遍 ask_with_rag：检索结果和带引用的回答写进 RAG 缓存（SQLite 层其它 worker 也能用）。
+    整轮共用一个 RAG_WARMUP_TIMEOUT_SEC 的预算：LLM 慢 / 挂了时没跑完的查询直接记失败，
+    照样标记 ready（预热只是为了缓存热，不能让 /health/ready 跟着 LLM 重试一起卡几分钟）。
+    """
+    status = WARMUP_STATUS
+    if not settings.RAG_WARMUP_ENABLED:
+        status.state = "disabled"
+        status.ready = True
+        return status
+
+    status.state = "running"
+    status.started_at = time.time()
+    queries = warm_queries()
+    try:
+        status.generation = await RAG_CACHE.ageneration()
+        log.info(f"rag_warmup_start reason={reason} generation={status.generation} queries={len(queries)}")
+        sem = asyncio.Semaphore(max(1, settings.RAG_WARMUP_CONCURRENCY))
+        deadline = Deadline.after(settings.RAG_WARMUP_TIMEOUT_SEC)
+        status.results = list(await asyncio.gather(*[_warm_one(q, k, sem, deadline) for q, k in queries]))
+        status.state = "done"
+    except Exception as e:
+        # 预热只是加速：失败也照常对外服务（第一个用户慢一点而已）
+        status.state = "failed"
+        log.warning(f"rag_warmup_aborted reason={reason} err={e!r}")
+    status.finished_at = time.time()
+    status.runs += 1
+    status.ready = True
+    if status.state == "failed":
+        return status
+    log.info(
+        f"rag_warmup_done reason={reason} generation={status.generation} "
+        f"answered={sum(1 for r in status.results if r['answered'])}/{len(queries)} "
+        f"ms={(status.finished_at - status.started_at) * 1000:.0f}"
+    )
+    return status
+
+
+async def warmup_loop() -> None:
+    """
+    后台任务（lifespan 里启动）：先预热一次，之后每 RAG_WARMUP_CHECK_SEC 秒看一眼 KB 版本号，
+    变了（reindex_kb 跑完，不管是本进程还是离线脚本）就重新预热。
+    """
+    await warm_rag_cache("startup")
+    if not settings.RAG_WARMUP_ENABLED:
+        return
+    while True:
+        await asyncio.sleep(settings.RAG_WARMUP_CHECK_SEC)
+        try:
+            generation = await RAG_CACHE.ageneration()
+        except Exception as e:
+            log.warning(f"rag_warmup_check_failed err={e!r}")
+            continue
+        if generation != WARMUP_STATUS.generation:
+            await warm_rag_cache("reindex")
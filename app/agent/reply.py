@@ -1,8 +1,7 @@
 import logging
-import httpx
 from typing import AsyncGenerator, Dict, Any, Optional
 
-from app.infra.settings import settings
+from app.agent.core import stream_llm
 from app.agent.prompts import SYSTEM_PROMPT
 from app.agent.formatters import format_plan_steps, format_tool_results
 
@@ -43,8 +42,6 @@ async def stream_final_reply(
     核心原则：只让模型输出自然语言，不要让它“看见”你的内部 JSON 结构。
     """
 
-    headers = {"Authorization": f"Bearer {settings.LLM_API_KEY}"}
-
     # 关键：把 plan/tool_results 先格式化成“人类可读文本”，再喂给模型
     plan_text = format_plan_steps(plan)
     tool_text = format_tool_results(tool_results)
@@ -60,46 +57,15 @@ async def stream_final_reply(
         f"已执行的动作结果（仅供参考）：\n{tool_text}\n"
     )
 
-    payload = {
-        "model": settings.LLM_MODEL,
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-        "temperature": 0.3,
-        "stream": True,
-    }
-
-    async with httpx.AsyncClient(timeout=settings.LLM_TIMEOUT_SEC) as client:
-        async with client.stream(
-            "POST",
-            f"{settings.LLM_BASE_URL}/chat/completions",
-            json=payload,
-            headers=headers,
-        ) as resp:
-            resp.raise_for_status()
-
-            async for line in resp.aiter_lines():
-                if not line:
-                    continue
-                if not line.startswith("data: "):
-                    continue
-
-                data = line.removeprefix("data: ").strip()
-                if data == "[DONE]":
-                    break
-
-                try:
-                    obj = __import__("json").loads(data)
-                    delta = obj["choices"][0]["delta"].get("content")
-                    if not delta:
-                        continue
-
-                    # 兜底过滤：丢弃 JSON/字段名碎片
-                    if _looks_like_json_noise(delta):
-                        continue
-
-                    yield delta
-                except Exception:
-                    # 流式行解析失败，直接跳过即可（不要让接口崩）
-                    continue
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+    # 复用 core.stream_llm：共享连接池、准入层和重试策略
+    # 不走响应缓存：缓存命中会一次性吐出整段文本，会被下面按 delta 设计的噪音过滤误伤
+    async for delta in stream_llm(messages, temperature=0.3, use_cache=False):
+        # 兜底过滤：丢弃 JSON/字段名碎片
+        if _looks_like_json_noise(delta):
+            continue
+        yield delta
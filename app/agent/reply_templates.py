@@ -9,7 +9,8 @@
 from typing import Any, Dict, Optional
 from app.agent.schemas import AgentPlan
 
-def render_plan_reply(plan: AgentPlan, tool_results: Optional[Dict[str, Any]]) -> str:
+def render_plan_reply(plan: AgentPlan, tool_results: Optional[Dict[str, Any]],
+                      include_steps: bool = True) -> str:
     """
     把 plan + tool_results 渲染成最终给用户看的文本（不经过 LLM）。
 
@@ -17,18 +18,22 @@ def render_plan_reply(plan: AgentPlan, tool_results: Optional[Dict[str, Any]]) -
     - 用户能看懂
     - 不暴露内部字段名
     - 输出可控稳定
+
+    include_steps=False：步骤已经通过 step 事件推给前端了，这里只给收尾，不再重复列一遍
     """
     lines = []
-    lines.append("我给你一个可执行的一周口语提升安排（每天约45分钟）：")
-
-    # plan.steps 是我们已经结构化好的建议
-    if plan.steps:
-        for idx, s in enumerate(plan.steps, 1):
-            lines.append(f"{idx}. {s}")
+    if not include_steps:
+        lines.append("以上就是给你的一周口语提升安排（每天约45分钟），按步骤每天练就行。")
     else:
-        # 万一 plan 没 steps，也要给个兜底
-        lines.append("1. 每天选一个主题练口语 20 分钟（先输出观点，再举例）。")
-        lines.append("2. 每天复盘 10 分钟：把表达写下来，改成更自然的说法。")
+        lines.append("我给你一个可执行的一周口语提升安排（每天约45分钟）：")
+        # plan.steps 是我们已经结构化好的建议
+        if plan.steps:
+            for idx, s in enumerate(plan.steps, 1):
+                lines.append(f"{idx}. {s}")
+        else:
+            # 万一 plan 没 steps，也要给个兜底
+            lines.append("1. 每天选一个主题练口语 20 分钟（先输出观点，再举例）。")
+            lines.append("2. 每天复盘 10 分钟：把表达写下来，改成更自然的说法。")
 
     # 工具结果提示（如果你创建了待办）
     if tool_results:
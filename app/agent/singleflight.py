@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：singleflight.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: single-flight：相同的在途请求只打一次上游，其余调用方共享同一个结果
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+log = logging.getLogger("singleflight")
+
+
+def _normalize_content(content: Any) -> Any:
+    """
+    只做“不改变语义”的归一化：统一换行、去掉行尾空白和首尾空白。
+    （prompt 里的缩进/空行差异对模型几乎没影响，但会让 key 对不上）
+    """
+    if not isinstance(content, str):
+        return content
+    lines = content.replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def llm_request_key(model: str, temperature: float, messages: List[dict]) -> str:
+    """
+    LLM 请求的规范化 key：model + temperature + messages 的稳定哈希。
+    """
+    norm = {
+        "model": model,
+        "temperature": round(float(temperature), 4),
+        "messages": [
+            {"role": m.get("role"), "content": _normalize_content(m.get("content"))}
+            for m in messages
+        ],
+    }
+    raw = json.dumps(norm, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    按 key 合并并发调用：
+    - 第一个调用方（leader）真正发起请求，结果放在一个 Task 里
+    - 在它完成前进来的相同 key（follower）直接等这个 Task
+    - Task 完成后立即从 inflight 移除，不做缓存（缓存是另一层的事）
+
+    用 asyncio.shield 等待：某个调用方被取消（例如客户端断开）不会连带取消共享请求。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._state: Dict[str, Any] = {}  # 在途调用附带的共享状态（见 shared_state）
+        self.calls = 0  # 总调用次数
+        self.upstream = 0  # 真正发到上游的次数
+        self.coalesced = 0  # 被合并（搭便车）的次数
+
+    def shared_state(self, key: str, factory: Callable[[], Any]) -> Any:
+        """
+        key 当前这次共享调用附带的状态（例如所有等待方共用的时间预算）：
+        有在途调用时返回它的那份，没有就用 factory 新建一份，交给紧接着的 do(key, ...) 发起的调用，调用结束时清掉。
+        和 do() 之间不能有 await，否则可能对不上同一次调用。
+        """
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = factory()
+        return state
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        timeout：本调用方最多等多久（超时抛 asyncio.TimeoutError），不影响共享请求本身。
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+            self.upstream += 1
+        else:
+            self.coalesced += 1
+            log.info(f"singleflight_coalesced name={self.name} key={key[:12]} inflight={len(self._inflight)}")
+        if timeout is None:
+            return await asyncio.shield(task)
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._state.pop(key, None)
+        # 所有等待方都被取消时，避免 "Task exception was never retrieved" 噪音
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "upstream": self.upstream,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "coalesce_ratio": round(self.coalesced / self.calls, 4) if self.calls else 0.0,
+        }
@@ -8,13 +8,16 @@
 """
 import logging
 import re
+from typing import Optional
 
+from app.agent.deadline import Deadline
 from app.agent.rag.answer import ask_with_rag
+from app.agent.rag.warmup import register_warm_query
 from app.agent.schemas import SpeakingState
 from app.agent.speaking_judge import judge_speaking_answer
 from app.agent.speaking_render import render_feedback_text
 from app.agent.state_store import get_state, save_state
-from app.agent.memory.repo import upsert_profile, insert_attempt, get_avg_scores
+from app.agent.memory.repo import aupsert_profile, ainsert_attempt, aget_avg_scores
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +31,19 @@ def _extract_minutes(text: str) -> int | None:
         return int(m.group(1))
     return None
 
+# 最弱项 -> 检索主题（只有这几条固定查询：启动 / reindex 后预热进 RAG 缓存，FEEDBACK 这一轮不用现算）
+SPEAKING_RAG_QUERIES = {
+    "grammar": "B1 grammar common issues tips",
+    "structure": "STAR method behavioral questions structure",
+    "fluency": "speaking fluency short complete sentences tips",
+    "vocabulary": "self introduction interview structure 30-60 seconds",
+}
+SPEAKING_RAG_K = 3
+
+for _query in SPEAKING_RAG_QUERIES.values():
+    register_warm_query(_query, SPEAKING_RAG_K)
+
+
 def pick_rag_query(fb) -> str:
     """
     根据评分选择检索主题（非常像教育产品的个性化策略）。
@@ -42,19 +58,13 @@ def pick_rag_query(fb) -> str:
     weakest = min(scores, key=scores.get)
 
     # 根据 weakest 决定查什么
-    if weakest == "grammar":
-        return "B1 grammar common issues tips"
-    if weakest == "structure":
-        return "STAR method behavioral questions structure"
-    if weakest == "fluency":
-        return "speaking fluency short complete sentences tips"
-    # vocabulary
-    return "self introduction interview structure 30-60 seconds"
-
-async def speaking_next(user_id: str, user_message: str) -> tuple[str, SpeakingState]:
+    return SPEAKING_RAG_QUERIES[weakest]
+
+async def speaking_next(user_id: str, user_message: str,
+                        deadline: Optional[Deadline] = None) -> tuple[str, SpeakingState]:
     """
     speaking 陪练状态机：
-    输入：用户一句话
+    输入：用户一句话（以及本次请求的时间预算，FEEDBACK 阶段的 judge 会用到）
     输出：给用户的回复（纯文本） + 更新后的状态
     """
     state = get_state(user_id)
@@ -95,7 +105,7 @@ async def speaking_next(user_id: str, user_message: str) -> tuple[str, SpeakingS
         state.last_question = q
         save_state(user_id, state)
 
-        upsert_profile(
+        await aupsert_profile(
             user_id=user_id,
             level=state.profile.level,
             goal=state.profile.goal,
@@ -130,7 +140,7 @@ async def speaking_next(user_id: str, user_message: str) -> tuple[str, SpeakingS
 
         # ✅ 这里才调用 LLM（成本集中在“反馈”而不是“闲聊”）
         try:
-            fb = await judge_speaking_answer(question=question, answer=answer)
+            fb = await judge_speaking_answer(question=question, answer=answer, user_id=user_id, deadline=deadline)
             logger.info(
                 f"judge_scores={fb.overall_score}/{fb.fluency_score}/{fb.grammar_score}/{fb.vocabulary_score}/{fb.structure_score}")
         except Exception:
@@ -138,7 +148,7 @@ async def speaking_next(user_id: str, user_message: str) -> tuple[str, SpeakingS
             reply = "我这次没能稳定生成评分，但我给你一个通用改写模板...（略）下一题：..."
         else:
 
-            insert_attempt(
+            await ainsert_attempt(
                 user_id=user_id,
                 question=question,
                 answer=answer,
@@ -148,7 +158,7 @@ async def speaking_next(user_id: str, user_message: str) -> tuple[str, SpeakingS
             # 渲染为纯文本（不让 LLM 直接输出最终回复，避免污染）
             reply = render_feedback_text(fb)
 
-            avg = get_avg_scores(user_id, last_n=10)
+            avg = await aget_avg_scores(user_id, last_n=10)
             # 找到最低分项（简单 heuristic）
             weakest = min(
                 [("fluency", avg["fluency"]), ("grammar", avg["grammar"]),
@@ -163,7 +173,7 @@ async def speaking_next(user_id: str, user_message: str) -> tuple[str, SpeakingS
             reply += f"\n你最近 10 次最弱项是：{weakest.title()}（{avg[weakest]:.1f}/10），下一轮我会重点要求你按 {weakest.title()} 讲 Result。"
 
             rag_query = pick_rag_query(fb)
-            rag_text, used_chunks = await ask_with_rag(rag_query, k=3)
+            rag_text, used_chunks = await ask_with_rag(rag_query, k=SPEAKING_RAG_K, user_id=user_id)
             # 如果资料不足就不追加，避免污染输出
             if used_chunks:
                 reply += "\n\n---\n基于资料的针对性建议（带引用）：\n"
@@ -7,9 +7,11 @@
 @note: 
 """
 import logging
+from typing import Optional
 
 from app.agent.core import call_llm
-from app.agent.json_utils import extract_json_object
+from app.agent.deadline import Deadline
+from app.agent.json_utils import parse_model_with_repair
 from app.agent.prompts import SYSTEM_PROMPT
 from app.agent.schemas import SpeakingFeedback
 
@@ -39,10 +41,12 @@ JUDGE_PROMPT = """你是英语口语面试陪练的评审官（严格、专业
 - 如果用户回答太短，要指出“信息不足”，并告诉如何补充
 """
 
-async def judge_speaking_answer(question: str, answer: str) -> SpeakingFeedback:
+async def judge_speaking_answer(question: str, answer: str, user_id: str | None = None,
+                                deadline: Optional[Deadline] = None) -> SpeakingFeedback:
     """
     用 LLM 对用户回答做评测与纠错，输出结构化反馈。
     这里的关键是：LLM 只负责“评审”，不负责“流程控制”。
+    deadline 用完会抛 DeadlineExceeded，由调用方（状态机）走降级反馈。
     """
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
@@ -52,8 +56,9 @@ async def judge_speaking_answer(question: str, answer: str) -> SpeakingFeedback:
         },
     ]
 
-    raw = await call_llm(messages)
+    # 评审要拿新鲜输出：同一回答重复提交时也重新评分，不读响应缓存
+    raw = await call_llm(messages, use_cache=False, user_id=user_id, deadline=deadline)
     log.info(f"llm_raw(judge)={raw[:400]}")  # 只打前 400 字，避免日志太大
 
-    obj = extract_json_object(raw)  # 复用 Day2 的鲁棒 JSON 提取
-    return SpeakingFeedback.model_validate(obj)  # Pydantic 校验，保证字段齐全
+    # 复用 Day2 的鲁棒 JSON 提取（本地多策略修复 + schema 纠正），最后 Pydantic 校验保证字段齐全
+    return parse_model_with_repair(raw, SpeakingFeedback)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：speculation.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 投机执行：intent 还在等 LLM 时先把 plan 生成起来，路由确定后再决定用还是丢
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from app.agent.core import generate_plan_stream
+from app.agent.deadline import Deadline
+from app.agent.plan_stream import PlanEvent
+from app.agent.schemas import AgentPlan
+
+log = logging.getLogger("speculation")
+
+_END = object()
+
+
+class SpeculationStats:
+    """
+    - saved_ms：commit 时 plan 已经跑了多久（= 少等的时间）
+    - wasted_ms：被取消的 plan 白跑了多久
+    - wasted_completed：取消时 plan 已经生成完（整次 LLM 调用都浪费了）
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.committed = 0
+        self.cancelled = 0
+        self.wasted_completed = 0
+        self.saved_ms = 0.0
+        self.wasted_ms = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "committed": self.committed,
+            "cancelled": self.cancelled,
+            "wasted_completed": self.wasted_completed,
+            "commit_ratio": round(self.committed / self.started, 4) if self.started else 0.0,
+            "saved_ms_total": round(self.saved_ms, 1),
+            "saved_ms_avg": round(self.saved_ms / self.committed, 1) if self.committed else 0.0,
+            "wasted_ms_total": round(self.wasted_ms, 1),
+        }
+
+
+SPECULATION_STATS = SpeculationStats()
+
+
+class SpeculativePlan:
+    """
+    后台跑 generate_plan_stream，把事件先缓存在队列里：
+    - commit 之后用 events() 按原顺序读出（已经缓存的立刻吐出，后面的边生成边吐）
+    - tool_call 只缓存不执行：有副作用的事必须等路由确定（commit）以后才做
+    - 路由到 speaking 就 cancel()：取消后台任务，LLM 流随之关闭、准入名额归还
+    """
+
+    def __init__(self, user_id: str, user_message: str, deadline: Optional[Deadline] = None):
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._started_at = time.perf_counter()
+        self._finished_at: Optional[float] = None
+        self._settled = False
+        self._task = asyncio.create_task(self._produce(user_id, user_message, deadline))
+        SPECULATION_STATS.started += 1
+
+    async def _produce(self, user_id: str, user_message: str, deadline: Optional[Deadline]) -> None:
+        try:
+            async for event in generate_plan_stream(user_id, user_message, deadline=deadline):
+                self._queue.put_nowait(event)
+        except Exception as e:
+            # 异常留给 commit 之后的消费方处理（和不投机时的行为一致）
+            self._queue.put_nowait(e)
+        finally:
+            self._finished_at = time.perf_counter()
+            self._queue.put_nowait(_END)
+
+    def _elapsed_ms(self) -> float:
+        end = self._finished_at or time.perf_counter()
+        return (end - self._started_at) * 1000
+
+    def commit(self) -> None:
+        if self._settled:
+            return
+        self._settled = True
+        saved = self._elapsed_ms()
+        SPECULATION_STATS.committed += 1
+        SPECULATION_STATS.saved_ms += saved
+        log.info(f"speculation_commit saved_ms={saved:.0f} done={self._finished_at is not None}")
+
+    def cancel(self) -> None:
+        if self._settled:
+            self._task.cancel()
+            return
+        self._settled = True
+        wasted = self._elapsed_ms()
+        SPECULATION_STATS.cancelled += 1
+        SPECULATION_STATS.wasted_ms += wasted
+        if self._finished_at is not None:
+            SPECULATION_STATS.wasted_completed += 1
+        self._task.cancel()
+        log.info(f"speculation_cancel wasted_ms={wasted:.0f} done={self._finished_at is not None}")
+
+    async def events(self) -> AsyncGenerator[PlanEvent, None]:
+        self.commit()
+        while True:
+            item = await self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def plan(self) -> AgentPlan:
+        """
+        非流式消费：只要最终 plan。
+        """
+        plan = None
+        async for kind, payload in self.events():
+            if kind == "plan":
+                plan = payload
+        return plan
@@ -24,3 +24,7 @@ TOOL_REGISTRY = {
     "create_todo": create_todo,
     "list_todos": list_todos,
 }
+
+# 没有副作用的工具：plan 还在流式生成时就可以提前执行（最终 plan 变了，结果丢掉即可）。
+# 有副作用的（create_todo 等）必须等最终 plan 确定再执行
+READ_ONLY_TOOLS = {"list_todos"}
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：cache.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 通用缓存：进程内 LRU+TTL 一级缓存 + SQLite 二级缓存（跨重启、同机多 worker 共享）
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.infra.db import SQLitePool
+from app.infra.executor import run_blocking
+
+log = logging.getLogger("cache")
+
+
+class LRUTTLCache:
+    """
+    进程内 LRU + TTL 缓存（value 为 str）。
+    - max_entries：条目数上限，超出淘汰最久未使用的
+    - max_bytes：按 value 字符数粗估的内存上限（None 表示不限）
+    - ttl 过期的条目在读取时惰性清理
+    """
+
+    def __init__(self, max_entries: int, default_ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (value, expires_at)
+            self._bytes += len(value)
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._data))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _pop(self, key: str) -> None:
+        value, _ = self._data.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteCache:
+    """
+    SQLite 二级缓存：同一张 kv_cache 表，按 namespace 区分用途。
+    - 服务重启后仍可命中；同机多个 uvicorn worker 共享同一个 db 文件
+    - 每个 namespace 有行数上限，超出按 last_access 淘汰（近似 LRU）
+    - 为了不让每次写入都 COUNT(*)，每 evict_every 次写入才检查一次上限
+    - 命中时只有 last_access 比 touch_after 秒更旧才回写（近似 LRU 的精度是 touch_after），
+      否则命中只读：并发读不用排队抢 SQLite 唯一的写锁
+    """
+
+    def __init__(self, namespace: str, db: Callable[[], SQLitePool],
+                 max_rows: int, default_ttl: Optional[float] = None, evict_every: int = 50,
+                 touch_after: float = 300.0):
+        self.namespace = namespace
+        self.max_rows = max_rows
+        self.default_ttl = default_ttl
+        self.evict_every = evict_every
+        self.touch_after = touch_after
+        self._db = db
+        self._table_ready_for: Optional[SQLitePool] = None  # 建过表的连接池（DB_PATH 换了要重新建）
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _ensure_table(self) -> None:
+        pool = self._db()
+        if self._table_ready_for is pool:
+            return
+        with pool.write() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS kv_cache (
+              namespace TEXT NOT NULL,
+              key TEXT NOT NULL,
+              value TEXT NOT NULL,
+              created_at REAL NOT NULL,
+              expires_at REAL,            -- NULL 表示不过期
+              last_access REAL NOT NULL,
+              PRIMARY KEY(namespace, key)
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_cache_lru ON kv_cache(namespace, last_access)")
+        self._table_ready_for = pool
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            self._ensure_table()
+            # 读走普通连接（WAL 下不等写锁），过期 / last_access 太旧时才进写事务
+            with self._db().connection() as conn:
+                row = conn.execute(
+                    "SELECT value, expires_at, last_access FROM kv_cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row["expires_at"] is not None and row["expires_at"] <= now:
+                with self._db().write() as conn:
+                    conn.execute("DELETE FROM kv_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self.misses += 1
+                return None
+            if now - row["last_access"] >= self.touch_after:
+                with self._db().write() as conn:
+                    conn.execute(
+                        "UPDATE kv_cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                        (now, self.namespace, key),
+                    )
+            self.hits += 1
+            return row["value"]
+        except sqlite3.Error as e:
+            # 缓存是“加速层”，出错只记录，不影响主流程
+            self.errors += 1
+            log.warning(f"cache_get_failed ns={self.namespace} err={e!r}")
+            return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl else None
+        try:
+            self._ensure_table()
+            with self._db().write() as conn:
+                conn.execute("""
+                INSERT INTO kv_cache(namespace, key, value, created_at, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                  value = excluded.value,
+                  created_at = excluded.created_at,
+                  expires_at = excluded.expires_at,
+                  last_access = excluded.last_access
+                """, (self.namespace, key, value, now, expires_at, now))
+                self._writes += 1
+                if self._writes % self.evict_every == 0:
+                    self._evict(conn, now)
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning(f"cache_set_failed ns={self.namespace} err={e!r}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._ensure_table()
+            with self._db().write() as conn:
+                conn.execute("DELETE FROM kv_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning(f"cache_delete_failed ns={self.namespace} err={e!r}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        cur = conn.execute(
+            "DELETE FROM kv_cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, now),
+        )
+        removed = cur.rowcount
+        count = conn.execute("SELECT COUNT(*) FROM kv_cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        overflow = count - self.max_rows
+        if overflow > 0:
+            cur = conn.execute("""
+            DELETE FROM kv_cache WHERE namespace = ? AND key IN (
+              SELECT key FROM kv_cache WHERE namespace = ? ORDER BY last_access LIMIT ?
+            )
+            """, (self.namespace, self.namespace, overflow))
+            removed += cur.rowcount
+        self.evictions += removed
+
+    def clear(self) -> None:
+        try:
+            self._ensure_table()
+            with self._db().write() as conn:
+                conn.execute("DELETE FROM kv_cache WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning(f"cache_clear_failed ns={self.namespace} err={e!r}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+class TieredCache:
+    """
+    两级缓存：先查进程内 LRU，再查 SQLite；SQLite 命中会回填到内存。
+    """
+
+    def __init__(self, memory: LRUTTLCache, persistent: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.persistent = persistent
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None or self.persistent is None:
+            return value
+        value = self.persistent.get(key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl=ttl)
+        if self.persistent is not None:
+            self.persistent.set(key, value, ttl=ttl)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """
+        async 版 get：内存层直接查，SQLite 层放到 DB 线程池，不阻塞 event loop。
+        """
+        value = self.memory.get(key)
+        if value is not None or self.persistent is None:
+            return value
+        value = await run_blocking(self.persistent.get, key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def aset(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl=ttl)
+        if self.persistent is not None:
+            await run_blocking(self.persistent.set, key, value, ttl=ttl)
+
+    async def adelete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.persistent is not None:
+            await run_blocking(self.persistent.delete, key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "sqlite": self.persistent.stats() if self.persistent is not None else None,
+        }
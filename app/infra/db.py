@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：db.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 统一的 SQLite 访问层：连接池 + WAL + pragma 调优 + 语句缓存（memory / rag / cache 共用）
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from app.infra.settings import settings
+
+log = logging.getLogger("db")
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """连接池在 DB_POOL_TIMEOUT_SEC 内拿不到连接（和 database is locked 一样按 OperationalError 处理）"""
+
+
+def connect(path: str | Path) -> sqlite3.Connection:
+    """
+    打开一个调好 pragma 的连接（连接池内部和一次性脚本共用）。
+    - WAL：读不阻塞写、写不阻塞读（journal_mode 是持久化到文件的，设置一次即可，这里幂等）
+    - busy_timeout：写锁被占用时等待而不是立刻报 database is locked
+    - synchronous=NORMAL：WAL 下仍然保证一致性，只是掉电可能丢最后几个事务
+    - cache_size / mmap_size：读多的检索查询少走系统调用
+    - cached_statements：sqlite3 模块自带的预编译语句缓存（按 SQL 文本复用）
+    """
+    conn = sqlite3.connect(
+        Path(path).as_posix(),
+        check_same_thread=False,
+        timeout=settings.DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=settings.DB_STATEMENT_CACHE,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={int(settings.DB_BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{int(settings.DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size={int(settings.DB_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+class SQLitePool:
+    """
+    有上限的连接池：
+    - 连接按需创建，最多 size 个；用完放回（LIFO，热连接的页缓存更有用）
+    - connection()：普通读/写，调用方自己 commit（兼容原来的写法）
+    - write()：写事务。进程内先拿写锁再 BEGIN IMMEDIATE，
+      写入方在 Python 里排队，而不是在 SQLite 里自旋 busy；读连接不受影响（WAL）
+    - 放回时如果还有没提交的事务就回滚，避免泄漏的事务一直占着写锁
+    """
+
+    def __init__(self, path: str | Path, size: int, timeout: float):
+        self.path = Path(path)
+        self.size = size
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self.acquired = 0
+        self.waits = 0  # 池满、需要等别人归还的次数
+        self.wait_ms_total = 0.0
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = connect(self.path)
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                self.waits += 1
+                start = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"no sqlite connection available in {self.timeout}s (size={self.size})")
+                self.wait_ms_total += (time.perf_counter() - start) * 1000
+        self.acquired += 1
+        return conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 连接坏了：丢掉，让下次按需重建
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """
+        写事务：成功提交，异常回滚。
+        """
+        with self._write_lock, self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        idle = self._idle.qsize()
+        return {
+            "size": self.size,
+            "open": self._created,
+            "idle": idle,
+            "in_use": self._created - idle,
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "wait_ms_total": round(self.wait_ms_total, 1),
+        }
+
+
+_pool: Optional[SQLitePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_db() -> SQLitePool:
+    """
+    进程内唯一的连接池（按 settings.DB_PATH 懒创建；路径变了就重建，方便测试指向临时库）。
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.path == Path(settings.DB_PATH):
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.path != Path(settings.DB_PATH):
+            if _pool is not None:
+                _pool.close()
+            _pool = SQLitePool(settings.DB_PATH, settings.DB_POOL_SIZE, settings.DB_POOL_TIMEOUT_SEC)
+            log.info(f"sqlite_pool_ready path={settings.DB_PATH} size={settings.DB_POOL_SIZE}")
+        return _pool
+
+
+def close_db() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：executor.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 阻塞调用（SQLite / 同步工具）放到专用线程池里跑，不卡 event loop
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from app.infra.settings import settings
+
+log = logging.getLogger("executor")
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """
+    有上限的专用线程池 + 指标：
+    - 线程数固定（max_workers），超出的调用在池内排队，queue_depth 反映积压
+    - wait_ms：排队等线程的时间；run_ms：真正执行的时间
+    - contextvars 会带进线程（trace_id 日志不会丢）
+    不同用途用不同的池：慢工具把自己的池占满，也不会拖住数据库读写。
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self.max_queue_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_samples: deque = deque(maxlen=1024)
+        self._run_samples: deque = deque(maxlen=1024)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._pool
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        enqueued = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+
+        def call() -> T:
+            start = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_samples.append(start - enqueued)
+            ok = False
+            try:
+                result = ctx.run(fn, *args, **kwargs)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._running -= 1
+                    self._run_samples.append(elapsed)
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                if elapsed > settings.BLOCKING_SLOW_LOG_SEC:
+                    log.warning(f"blocking_call_slow pool={self.name} fn={getattr(fn, '__name__', fn)} ms={elapsed * 1000:.0f}")
+
+        return await loop.run_in_executor(self._executor(), call)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._wait_samples)
+            runs = sorted(self._run_samples)
+            queued, running = self._queued, self._running
+
+        def _pct(samples: list, p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "max_workers": self.max_workers,
+            "running": running,
+            "queue_depth": queued,
+            "max_queue_depth": self.max_queue_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_ms_p50": _pct(waits, 0.50),
+            "wait_ms_p95": _pct(waits, 0.95),
+            "run_ms_p50": _pct(runs, 0.50),
+            "run_ms_p95": _pct(runs, 0.95),
+            "run_ms_max": round(runs[-1] * 1000, 2) if runs else 0.0,
+        }
+
+
+# SQLite 读写（线程数与连接池大小一致，线程拿连接不用排队）
+DB_EXECUTOR = BlockingExecutor("db", settings.DB_POOL_SIZE)
+# 同步工具（可能很慢，例如 create_todo 的 IO）
+TOOL_EXECUTOR = BlockingExecutor("tools", settings.TOOL_EXECUTOR_WORKERS)
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any, executor: Optional[BlockingExecutor] = None,
+                       **kwargs: Any) -> T:
+    """
+    在线程池里执行阻塞函数并等待结果（默认用 DB 池）。
+    """
+    return await (executor or DB_EXECUTOR).run(fn, *args, **kwargs)
+
+
+def executor_stats() -> Dict[str, Any]:
+    return {"db": DB_EXECUTOR.stats(), "tools": TOOL_EXECUTOR.stats()}
+
+
+def shutdown_executors() -> None:
+    DB_EXECUTOR.shutdown()
+    TOOL_EXECUTOR.shutdown()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：http_client.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: app 级共享的 LLM HTTP client（连接池 + keep-alive + 可选 HTTP/2）
+"""
+import asyncio
+import logging
+from typing import Literal, Optional
+
+import httpx
+
+from app.infra.settings import settings
+
+log = logging.getLogger("http_client")
+
+LLMEndpoint = Literal["chat", "stream"]
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def llm_timeout(endpoint: LLMEndpoint = "chat", budget: Optional[float] = None) -> httpx.Timeout:
+    """
+    按接口区分超时：
+    - chat：非流式，整包返回，read 超时 = LLM_TIMEOUT_SEC
+    - stream：流式，read 超时指“两次 chunk 之间”的最大等待 = LLM_STREAM_TIMEOUT_SEC
+    connect 超时单独配置，握手慢的时候尽快失败、交给重试。
+    budget：本次请求剩余的时间预算（deadline），超时不会超过它。
+    """
+    read = settings.LLM_STREAM_TIMEOUT_SEC if endpoint == "stream" else settings.LLM_TIMEOUT_SEC
+    connect = settings.LLM_CONNECT_TIMEOUT_SEC
+    if budget is not None:
+        read = min(read, budget)
+        connect = min(connect, budget)
+    return httpx.Timeout(read, connect=connect)
+
+
+def _http2_enabled() -> bool:
+    if not settings.LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        # 没装 httpx[http2] 时降级为 HTTP/1.1，不要让服务起不来
+        log.warning("LLM_HTTP2=true but h2 is not installed, fallback to HTTP/1.1")
+        return False
+    return True
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SEC,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=llm_timeout("chat"),
+        http2=_http2_enabled(),
+        headers={"Authorization": f"Bearer {settings.LLM_API_KEY}"},
+    )
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    """
+    FastAPI 启动时调用：创建唯一的共享 client。
+    """
+    global _client, _client_loop
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+        _client_loop = asyncio.get_running_loop()
+        log.info(
+            f"llm_http_client_ready max_conn={settings.LLM_POOL_MAX_CONNECTIONS} "
+            f"keepalive={settings.LLM_POOL_MAX_KEEPALIVE} http2={_http2_enabled()}"
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """
+    FastAPI 关闭时调用：优雅关闭连接池。
+    """
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取共享 client。
+    - 服务内：由 lifespan 创建，直接复用
+    - 脚本/测试（没有走 FastAPI 启动）：按需懒创建
+    client 绑定创建时的 event loop；换了 loop（例如 asyncio.run 多次）就重建，避免跨 loop 复用连接。
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = _build_client()
+        _client_loop = loop
+    return _client
@@ -20,4 +20,101 @@ class Settings(BaseSettings):
     LLM_TIMEOUT_SEC: int = 30
     MAX_TOOL_STEPS: int = 4
 
+    # LLM HTTP 连接池（整个进程共享一个 client，复用 TCP/TLS 连接）
+    LLM_POOL_MAX_CONNECTIONS: int = 100  # 同时打开的最大连接数
+    LLM_POOL_MAX_KEEPALIVE: int = 20  # 空闲时保留的 keep-alive 连接数
+    LLM_KEEPALIVE_EXPIRY_SEC: float = 30.0  # 空闲连接保留多久
+    LLM_HTTP2: bool = False  # 需要安装 httpx[http2]
+    LLM_CONNECT_TIMEOUT_SEC: float = 5.0
+    LLM_STREAM_TIMEOUT_SEC: int = 60  # 流式接口：两次 chunk 之间的最大等待
+
+    # LLM 响应缓存（内容寻址：model + temperature + messages）
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_TTL_SEC: int = 7 * 24 * 3600
+    LLM_CACHE_MEMORY_ENTRIES: int = 1024  # 进程内 LRU 条目上限
+    LLM_CACHE_MAX_ROWS: int = 50000  # SQLite 层行数上限，超出按最近访问时间淘汰
+    LLM_CACHE_MAX_TEMPERATURE: float = 0.3  # 高于该温度的调用输出不稳定，不缓存
+
+    # LLM 准入控制（全局并发 + 限速 + 按用户公平排队）
+    LLM_MAX_CONCURRENCY: int = 16  # 同时在途的上游请求上限
+    LLM_RATE_PER_SEC: float = 10.0  # 令牌桶速率，<=0 表示不限速
+    LLM_RATE_BURST: int = 20  # 令牌桶容量（允许的突发）
+    LLM_ADMISSION_TIMEOUT_SEC: float = 30.0  # 排队最长等待
+
+    # 请求级时间预算：一次 /chat 请求里所有 LLM 调用（含 repair、重试）共享
+    REQUEST_DEADLINE_SEC: float = 45.0
+    LLM_MAX_ATTEMPTS: int = 3  # 单次 LLM 调用最多尝试次数
+    LLM_MIN_ATTEMPT_SEC: float = 2.0  # 剩余预算不足这个值就不再发起新尝试
+    LLM_RETRY_AFTER_MAX_SEC: float = 10.0  # Retry-After 最多等多久
+
+    # /chat/stream：流式生成 plan，边解析边推送 step、边执行 tool_call
+    PLAN_STREAMING: bool = True
+
+    # 关键词规则（intent/domain 路由 + 注入检测）：文件里的词追加到默认规则上，改完自动热加载
+    KEYWORD_RULES_PATH: str = "data/keyword_rules.json"
+    KEYWORD_RULES_CHECK_SEC: float = 5.0  # 多久检查一次规则文件 mtime
+
+    # 本地意图模型（规则判不出来时先问它，置信度不够才调 LLM）
+    INTENT_MODEL_PATH: str = "data/intent_model.bin"
+    INTENT_MODEL_MIN_CONFIDENCE: float = 0.85
+
+    # /chat/stream：intent 需要问 LLM 时，同时投机生成 plan（路由到 speaking 就取消；工具不会提前执行）
+    SPECULATIVE_PLAN: bool = True
+
+    # SQLite（memory / rag / 缓存共用一个库、一个连接池）
+    DB_PATH: str = "data/edu_agent.db"
+    DB_POOL_SIZE: int = 8  # 连接数上限
+    DB_POOL_TIMEOUT_SEC: float = 10.0  # 池满时最多等多久
+    DB_BUSY_TIMEOUT_MS: int = 5000  # 写锁被占用时的等待
+    DB_CACHE_SIZE_KB: int = 16 * 1024  # 每个连接的页缓存
+    DB_MMAP_SIZE: int = 256 * 1024 * 1024
+    DB_STATEMENT_CACHE: int = 256  # 每个连接缓存的预编译语句数
+
+    # 阻塞调用的专用线程池（SQLite 用 DB_POOL_SIZE 个线程；同步工具单独一个池）
+    TOOL_EXECUTOR_WORKERS: int = 4
+    BLOCKING_SLOW_LOG_SEC: float = 0.5  # 单次阻塞调用超过这个时间打 warning
+
+    # RAG 全文索引的中文分词模式：unicode61（旧）/ trigram / bigram，切换后需 reindex_kb
+    RAG_FTS_MODE: str = "bigram"
+    # reindex_kb：多进程切块 + 分词，单线程批量写入
+    RAG_INGEST_WORKERS: int = 0  # 切块进程数，0 = CPU 核数；1 = 不开进程池，在当前进程里切
+    RAG_FTS_MERGE_PAGES: int = 500  # 增量入库后 FTS 合并最多写多少页（0 = 不合并，交给 FTS5 自动合并）
+
+    # RAG 稠密检索（可选，需要 numpy）：入库时算哈希 TF-IDF 向量写成 mmap 文件，检索时和 bm25 用 RRF 融合
+    RAG_VECTOR_ENABLED: bool = False  # 打开后需 reindex_kb 生成向量文件
+    RAG_VECTOR_DIM: int = 128  # 向量维度：10 万 chunk 约 50MB，查询要整体扫一遍（内存带宽决定延迟）
+    RAG_HYBRID_CANDIDATES: int = 50  # bm25 / 向量各取多少候选参与融合
+    RAG_RRF_K: int = 60  # RRF 的平滑常数：1 / (k + rank)
+    RAG_VECTOR_MIN_SIMILARITY: float = 0.15  # bm25 没命中时，向量相似度到这个值也算“相关”，不拒答
+
+    # RAG 结果多样化：先多取一池候选，再用 MMR 挑出 k 个互不重复的 chunk
+    RAG_CANDIDATE_POOL: int = 20  # 候选池大小（>= k）
+    RAG_MMR_LAMBDA: float = 0.7  # 1 = 只看相关度，越小越偏向多样
+    RAG_MAX_CHUNKS_PER_DOC: int = 2  # 同一文档优先只取几个 chunk（软上限：其它文档不够时仍补满 k 个），0 表示不限
+
+    # RAG 上下文压缩：每个 chunk 只把和问题相关的句子放进 prompt（/kb/ask 和口语 FEEDBACK 共用）
+    RAG_SNIPPET_ENABLED: bool = True
+    RAG_SNIPPET_MAX_CHARS: int = 300  # 单个 chunk 最多保留多少字符（合并后的段按 chunk 数累加）
+    # RAG 上下文打包：相邻 chunk 合并去重叠后，按相关度在这个 token 预算（本地粗估）内装入 prompt
+    RAG_CONTEXT_MAX_TOKENS: int = 1000
+
+    # RAG 缓存（检索结果 / 最终回答两层；key 带 KB 版本号，reindex 后自动失效）
+    RAG_CACHE_ENABLED: bool = True
+    RAG_CACHE_TTL_SEC: int = 24 * 3600
+    RAG_CACHE_MEMORY_ENTRIES: int = 512  # 每层进程内 LRU 条目上限
+    RAG_CACHE_MEMORY_BYTES: int = 8 * 1024 * 1024  # 每层进程内按字符数粗估的内存上限
+    RAG_CACHE_MAX_ROWS: int = 20000  # 每层 SQLite 行数上限
+    RAG_GENERATION_CHECK_SEC: float = 2.0  # 多久重读一次 KB 版本号（别的进程 reindex 后最多这么久失效）
+    # 近似重复问题复用回答：检索到的 chunk 集合足够像、问题本身也有足够重合才算命中
+    RAG_SEMANTIC_CACHE_ENABLED: bool = True
+    RAG_SEMANTIC_EVIDENCE_THRESHOLD: float = 0.75  # 检索结果 chunk_id 集合的 Jaccard 下限
+    RAG_SEMANTIC_QUERY_THRESHOLD: float = 0.5  # 问题词（英文词 + 中文二元组）的包含度下限
+    RAG_SEMANTIC_MAX_ENTRIES: int = 4096  # 每个进程最多记多少条问题签名
+
+    # RAG 缓存预热：启动时、以及发现 KB 版本号变了（reindex）时，把注册的固定查询先跑一遍
+    RAG_WARMUP_ENABLED: bool = True
+    RAG_WARMUP_CONCURRENCY: int = 2  # 同时预热几条（别把 LLM 准入名额占满）
+    RAG_WARMUP_CHECK_SEC: float = 10.0  # 多久检查一次 KB 版本号
+    RAG_WARMUP_TIMEOUT_SEC: float = 30.0  # 一轮预热的总预算（LLM 慢 / 挂了也不会一直卡着就绪检查）
+
 settings = Settings()
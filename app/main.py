@@ -1,26 +1,57 @@
+import asyncio
 import json
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from app.agent.core import generate_plan, run_tools
-from app.agent.intent import classify_intent
+from app.agent.core import (
+    generate_plan, generate_plan_stream, run_tools, ToolDispatcher,
+    LLM_SINGLEFLIGHT, LLM_CACHE, LLM_LIMITER,
+)
+from app.agent.deadline import Deadline
+from app.agent.intent import classify_intent_local, classify_intent_llm
+from app.agent.intent_model import load_intent_model
+from app.agent.json_utils import json_repair_stats
 from app.agent.memory.db import init_db
-from app.agent.rag.answer import ask_with_rag
+from app.agent.rag.answer import ask_with_rag, ask_with_rag_stream, citation_payload
+from app.agent.rag.cache import RAG_CACHE
 from app.agent.rag.db import init_rag_tables
 from app.agent.rag.schemas import KBAskRequest
+from app.agent.rag.warmup import WARMUP_STATUS, warmup_loop
 from app.agent.reply_templates import render_plan_reply
 from app.agent.schemas import ChatRequest, ChatResponse
 from app.agent.speaking_flow import speaking_next
+from app.agent.speculation import SpeculativePlan, SPECULATION_STATS
 from app.agent.state_store import get_state
 from app.agent.text_stream import stream_text
+from app.infra.db import close_db, get_db
+from app.infra.executor import executor_stats, shutdown_executors
+from app.infra.http_client import init_http_client, close_http_client
 from app.infra.logging import setup_logging, new_trace_id
+from app.infra.settings import settings
 
 setup_logging()
 log = logging.getLogger("api")
 
-app = FastAPI(title="Edu Agent MVP")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动：创建共享的 LLM HTTP 连接池、加载本地意图模型、后台预热 RAG 缓存；关闭：释放 HTTP / SQLite 连接
+    await init_http_client()
+    load_intent_model()
+    warmup_task = asyncio.create_task(warmup_loop())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        await close_http_client()
+        shutdown_executors()
+        close_db()
+
+
+app = FastAPI(title="Edu Agent MVP", lifespan=lifespan)
 init_db()
 init_rag_tables()
 
@@ -28,7 +59,8 @@ init_rag_tables()
 @app.post("/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest):
     trace_id = new_trace_id()
-    plan = await generate_plan(req.user_id, req.message)
+    deadline = Deadline.after(settings.REQUEST_DEADLINE_SEC)
+    plan = await generate_plan(req.user_id, req.message, deadline=deadline)
     tool_results = await run_tools(req.user_id, plan) if plan.tool_calls else None
 
     # 仍然保留非流式版本（方便调试 / 兼容）
@@ -51,12 +83,24 @@ async def chat(req: ChatRequest):
     )
 
 
+def _sse_step(index: int, text: str) -> str:
+    return f"event: step\ndata: {json.dumps({'index': index, 'text': text}, ensure_ascii=False)}\n\n"
+
+
+def _sse_replace_steps(steps: list) -> str:
+    # 已经推出去的步骤和最终 plan 对不上（被修复 / 降级）：让前端整体换成最终步骤
+    payload = {"steps": steps, "reason": "plan_changed"}
+    return f"event: replace\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
 @app.post("/chat/stream")
 async def chat_stream(req: ChatRequest):
     """
     SSE 流式输出接口（核心：先路由，再决定走哪条链路）
     """
     trace_id = new_trace_id()
+    # 整个请求（intent + plan/judge + 重试）共享一个时间预算，控制长尾延迟
+    deadline = Deadline.after(settings.REQUEST_DEADLINE_SEC)
 
     async def event_gen():
         # 1) 先发 meta，便于前端/日志关联
@@ -65,44 +109,109 @@ async def chat_stream(req: ChatRequest):
         # 0) 如果用户已经在 speaking 会话中：不做 intent，直接继续状态机
         #    （因为状态机里有很多逻辑，你不希望它被 interrupt）
         state = get_state(req.user_id)
+        spec = None
         if state.domain == "speaking":
             if state.stage == 'ONBOARDING':
-                text, _ = await speaking_next(req.user_id, req.message)
+                text, _ = await speaking_next(req.user_id, req.message, deadline=deadline)
                 async for chunk in stream_text(text):
                     yield f"{chunk}\n\n"
                 yield "event: done\ndata: [DONE]\n\n"
                 return
             elif state.stage == 'PRACTICE':
-                text, _ = await speaking_next(req.user_id, req.message)
+                text, _ = await speaking_next(req.user_id, req.message, deadline=deadline)
                 async for chunk in stream_text(text):
                     yield f"{chunk}\n\n"
                 if state.stage == 'FEEDBACK':
-                    text, _ = await speaking_next(req.user_id, req.message)
+                    text, _ = await speaking_next(req.user_id, req.message, deadline=deadline)
                     async for chunk in stream_text(text):
                         yield f"{chunk}\n\n"
                 yield "event: done\ndata: [DONE]\n\n"
                 return
         else:
             # 2) ✅ 最重要：先做 intent 分类
-            intent_res = await classify_intent(req.message)
+            #    规则/本地模型判不出来才需要 LLM：这段等待里先投机生成 plan（路由到 speaking 再丢掉）
+            intent_res = classify_intent_local(req.message)
+            if intent_res is None:
+                if settings.SPECULATIVE_PLAN:
+                    spec = SpeculativePlan(req.user_id, req.message, deadline=deadline)
+                try:
+                    intent_res = await classify_intent_llm(req.message, user_id=req.user_id, deadline=deadline)
+                except BaseException:
+                    if spec is not None:
+                        spec.cancel()
+                    raise
             state.domain = intent_res.domain
 
             # 3) ✅ speaking（口语/自我介绍）优先走状态机，不走 generate_plan
             #    这样你就不会再看到 next_steps/todos/title 这些伪字段污染
             if intent_res.domain == "speaking":
-                text, _ = await speaking_next(req.user_id, req.message)
+                if spec is not None:
+                    spec.cancel()
+                text, _ = await speaking_next(req.user_id, req.message, deadline=deadline)
                 async for chunk in stream_text(text):
                     yield f"{chunk}\n\n"
                 yield "event: done\ndata: [DONE]\n\n"
                 return
 
         # 4) 其他 domain 才走原来的 plan + tool
-        plan = await generate_plan(req.user_id, req.message)
-        tool_results = await run_tools(req.user_id, plan) if plan.tool_calls else None
+        if settings.PLAN_STREAMING:
+            # 流式生成 plan：step 解析出来就推给前端，tool_call 一完整就开始执行
+            # 推出去的步骤只是草稿：最终 plan（修复 / 降级后）和它对不上就发 replace
+            plan = None
+            intent = None
+            pending_steps = []
+            shown_steps = []
+            dispatcher = ToolDispatcher(req.user_id)
+            if spec is not None:
+                plan_events = spec.events()
+            else:
+                plan_events = generate_plan_stream(req.user_id, req.message, deadline=deadline)
+            try:
+                async for kind, payload in plan_events:
+                    if kind == "intent":
+                        intent = payload
+                        if intent == "plan":
+                            for idx, text in pending_steps:
+                                shown_steps.append(text)
+                                yield _sse_step(idx, text)
+                        pending_steps = []
+                    elif kind == "step":
+                        # 只有 plan 场景才展示步骤；intent 还没解析到时先暂存
+                        if intent == "plan":
+                            shown_steps.append(payload[1])
+                            yield _sse_step(*payload)
+                        elif intent is None:
+                            pending_steps.append(payload)
+                    elif kind == "tool_call":
+                        dispatcher.dispatch(*payload)
+                    elif kind == "plan":
+                        plan = payload
+                        final_steps = plan.steps if plan.intent == "plan" else []
+                        if shown_steps and shown_steps != final_steps:
+                            yield _sse_replace_steps(final_steps)
+                            shown_steps = list(final_steps)
+                tool_results = await dispatcher.finish(plan)
+            except BaseException:
+                dispatcher.cancel()
+                if spec is not None:
+                    spec.cancel()
+                raise
+        else:
+            if spec is not None:
+                try:
+                    plan = await spec.plan()
+                except BaseException:
+                    spec.cancel()
+                    raise
+            else:
+                plan = await generate_plan(req.user_id, req.message, deadline=deadline)
+            tool_results = await run_tools(req.user_id, plan) if plan.tool_calls else None
+            shown_steps = []
 
         # 4.1 plan 场景：服务端模板输出（可控）
         if plan.intent == "plan":
-            final_text = render_plan_reply(plan, tool_results)
+            # 步骤已经用 step 事件推过了：正文只给收尾，不再重复列一遍
+            final_text = render_plan_reply(plan, tool_results, include_steps=not shown_steps)
             async for chunk in stream_text(final_text):
                 yield f"data: {chunk}\n\n"
             yield "event: done\ndata: [DONE]\n\n"
@@ -125,15 +234,60 @@ async def kb_ask(req: KBAskRequest):
     text, chunks = await ask_with_rag(req.message, k=req.k)
     return {
         "answer": text,
-        "citations": [
-            {
-                "cite_key": c.cite_key,
-                "title": c.title,
-                "chunk_index": c.chunk_index,
-                "chunk_id": c.chunk_id,
-            }
-            for c in chunks
-        ],
+        "citations": citation_payload(chunks),
+    }
+
+
+# 流式问知识库：边生成边推 token，引用边出现边校验（事件说明见 ask_with_rag_stream）
+@app.post("/kb/ask/stream")
+async def kb_ask_stream(req: KBAskRequest):
+    trace_id = new_trace_id()
+
+    async def event_gen():
+        yield f"event: meta\ndata: {json.dumps({'trace_id': trace_id}, ensure_ascii=False)}\n\n"
+        deadline = Deadline.after(settings.REQUEST_DEADLINE_SEC)
+        async for kind, payload in ask_with_rag_stream(req.message, k=req.k, deadline=deadline):
+            if kind == "token":
+                payload = {"text": payload}
+            yield f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: [DONE]\n\n"
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+
+# 存活检查：进程能响应就是 ok；附带预热进度
+@app.get("/health")
+async def health():
+    return {"status": "ok", "warmup": WARMUP_STATUS.stats()}
+
+
+# 就绪检查：第一次 RAG 预热完成前返回 503（负载均衡先别把流量打过来）
+@app.get("/health/ready")
+async def health_ready():
+    ready = WARMUP_STATUS.ready
+    body = {"ready": ready, "warmup_state": WARMUP_STATUS.state, "kb_generation": WARMUP_STATUS.generation}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+# LLM 调用链路的运行指标（用于观察合并/容量）
+@app.get("/metrics/llm")
+async def llm_metrics():
+    return {
+        "singleflight": LLM_SINGLEFLIGHT.stats(),
+        "cache": LLM_CACHE.stats(),
+        "admission": LLM_LIMITER.stats(),
+        "json_repair": json_repair_stats(),
+        "speculation": SPECULATION_STATS.stats(),
+        "rag_cache": RAG_CACHE.stats(),
+    }
+
+
+# 阻塞调用线程池 + SQLite 连接池的运行指标（排队深度 / 执行耗时）
+@app.get("/metrics/runtime")
+async def runtime_metrics():
+    return {
+        "executors": executor_stats(),
+        "db_pool": get_db().stats(),
     }
 
 
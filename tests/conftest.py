@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：conftest.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note: 测试共用的临时库 / 临时知识库
+"""
+import sys
+import os
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag.cache import RAG_CACHE
+from app.agent.rag.ingest import reindex_kb
+from app.infra.db import close_db
+from app.infra.settings import settings
+
+KB_FILES = {
+    "interview.md": "行为面试推荐使用STAR方法：先讲情境，再讲任务和行动。",
+    "grammar.md": "常见语法错误包括冠词遗漏和时态混用。",
+    "speaking.md": "口语练习每天跟读二十分钟，注意连读和重音。",
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated_db(tmp_path, monkeypatch):
+    """
+    每个测试用自己的临时 SQLite 库（LLM 缓存 / RAG 缓存 / memory 都在里面），不碰 data/ 下的运行时库。
+    """
+    monkeypatch.setattr(settings, "DB_PATH", str(tmp_path / "test.db"))
+    yield
+    close_db()
+
+
+@pytest.fixture
+def kb_files():
+    """
+    kb 目录里的文件（文件名 -> 内容）。测试模块里覆盖这个 fixture 就能增删 / 替换文件：
+        @pytest.fixture
+        def kb_files(kb_files):
+            return {**kb_files, "extra.md": "..."}
+    """
+    return dict(KB_FILES)
+
+
+@pytest.fixture
+def kb(tmp_path, kb_files):
+    """
+    写好 kb_files 的知识库目录（还没建索引，库是 isolated_db 的临时库）；结束时清掉答案缓存。
+    """
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+    for name, text in kb_files.items():
+        (kb_dir / name).write_text(text, encoding="utf-8")
+    yield kb_dir
+    RAG_CACHE.invalidate()
+
+
+@pytest.fixture
+def indexed_kb(kb):
+    """
+    已经按 bigram 建好索引的 kb。
+    """
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    return kb
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_cache.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import time
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.infra.cache import LRUTTLCache, SQLiteCache, TieredCache
+from app.infra.db import SQLitePool
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    c = LRUTTLCache(max_entries=2)
+    c.set("a", "1")
+    c.set("b", "2")
+    assert c.get("a") == "1"  # a 变成最近使用
+    c.set("c", "3")  # 淘汰 b
+    assert c.get("b") is None
+    assert c.get("a") == "1"
+
+    c.set("t", "x", ttl=0.01)
+    time.sleep(0.02)
+    assert c.get("t") is None
+    assert c.stats()["expirations"] == 1
+
+
+def test_sqlite_tier_survives_new_process_memory(tmp_path):
+    pool = SQLitePool(tmp_path / "cache.db", size=2, timeout=1.0)
+
+    def db():
+        return pool
+
+    first = TieredCache(LRUTTLCache(10), SQLiteCache("llm", db, max_rows=10))
+    first.set("k", "cached answer")
+
+    # 模拟重启 / 另一个 worker：内存层是空的
+    second = TieredCache(LRUTTLCache(10), SQLiteCache("llm", db, max_rows=10))
+    assert second.get("k") == "cached answer"
+    assert second.stats()["sqlite"]["hits"] == 1
+    assert second.memory.get("k") == "cached answer"
+
+
+def test_sqlite_hit_only_touches_stale_last_access(tmp_path):
+    pool = SQLitePool(tmp_path / "cache.db", size=2, timeout=1.0)
+    cache = SQLiteCache("llm", lambda: pool, max_rows=10, touch_after=60)
+    cache.set("k", "v")
+
+    def last_access():
+        with pool.connection() as conn:
+            return conn.execute("SELECT last_access FROM kv_cache WHERE key = 'k'").fetchone()[0]
+
+    def set_last_access(value):
+        with pool.write() as conn:
+            conn.execute("UPDATE kv_cache SET last_access = ? WHERE key = 'k'", (value,))
+
+    # 最近访问过：命中不回写（不进写事务）
+    recent = time.time() - 10
+    set_last_access(recent)
+    assert cache.get("k") == "v"
+    assert last_access() == recent
+
+    # 超过 touch_after：回写，LRU 淘汰仍然看得到它在被用
+    set_last_access(1.0)
+    assert cache.get("k") == "v"
+    assert last_access() > recent
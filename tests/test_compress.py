@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_compress.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag.answer import _build_context
+from app.agent.rag.compress import extract_snippet, query_terms, split_sentences
+from app.agent.rag.retriever import RetrievedChunk
+from app.infra.settings import settings
+
+TEXT = (
+    "口语练习每天跟读二十分钟。"
+    "行为面试推荐使用STAR方法，先讲情境再讲任务。"
+    "注意连读和重音。"
+    "回答时把结果量化，例如提升了百分之三十。"
+    "最后留一点时间反问面试官。"
+)
+
+
+def test_split_sentences_keeps_punctuation():
+    text = "第一句。 第二句！\nthird one."
+    assert [text[s:e] for s, e in split_sentences(text)] == ["第一句。", "第二句！", "third one."]
+
+
+def test_snippet_keeps_matching_sentences_in_order():
+    out = extract_snippet(query_terms("行为面试怎么量化结果"), TEXT, 60)
+    assert len(out) <= 60
+    assert "STAR" in out and "量化" in out
+    assert "跟读" not in out
+    assert out.startswith("…") and out.endswith("…")
+
+
+def test_snippet_short_text_and_no_match():
+    assert extract_snippet(query_terms("面试"), "很短的内容。", 60) == "很短的内容。"
+    out = extract_snippet(query_terms("dynamic programming"), TEXT, 20)
+    assert len(out) <= 20 and out.startswith("口语练习")
+
+
+def test_build_context_keeps_cite_keys(monkeypatch):
+    monkeypatch.setattr(settings, "RAG_SNIPPET_MAX_CHARS", 40)
+    chunks = [
+        RetrievedChunk(cite_key="C1", chunk_id=7, title="interview", chunk_index=0, content=TEXT, score=-1.0),
+        RetrievedChunk(cite_key="C2", chunk_id=9, title="tips", chunk_index=3, content="时态错误可以通过复述练习纠正。", score=-0.5),
+    ]
+    ctx = _build_context(chunks, "行为面试 STAR").text
+    assert "[C1] (interview#0)" in ctx and "[C2] (tips#3)" in ctx
+    assert "STAR" in ctx and "跟读" not in ctx
+    assert chunks[0].content == TEXT  # 原 chunk 不被改写（返回给调用方展示用）
+    assert TEXT in _build_context(chunks).text  # 不传 query 时不压缩
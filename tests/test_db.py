@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_db.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.infra.db import PoolTimeout, SQLitePool
+
+
+def test_pool_is_bounded_and_reuses_connections(tmp_path):
+    pool = SQLitePool(tmp_path / "t.db", size=1, timeout=0.05)
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        with pytest.raises(PoolTimeout):
+            with pool.connection():
+                pass
+    with pool.connection() as again:
+        assert again is conn
+    assert pool.stats()["open"] == 1
+
+
+def test_write_rolls_back_and_readers_see_last_commit(tmp_path):
+    pool = SQLitePool(tmp_path / "t.db", size=2, timeout=1.0)
+    with pool.write() as conn:
+        conn.execute("CREATE TABLE t (v INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+
+    with pytest.raises(RuntimeError):
+        with pool.write() as conn:
+            conn.execute("INSERT INTO t VALUES (2)")
+            raise RuntimeError("boom")
+
+    with pool.write() as writer:
+        writer.execute("INSERT INTO t VALUES (3)")
+        # WAL：写事务进行中，读连接不阻塞，看到的是上一次提交
+        with pool.connection() as reader:
+            assert [r[0] for r in reader.execute("SELECT v FROM t")] == [1]
+    with pool.connection() as reader:
+        assert [r[0] for r in reader.execute("SELECT v FROM t ORDER BY v")] == [1, 3]
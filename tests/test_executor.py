@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_executor.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import asyncio
+import time
+
+import pytest
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.infra.executor import BlockingExecutor
+from app.infra.logging import trace_id_var
+
+
+@pytest.mark.asyncio
+async def test_blocking_call_does_not_stall_event_loop():
+    ex = BlockingExecutor("test", max_workers=1)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    t = asyncio.create_task(ticker())
+    trace_id_var.set("abc")
+    result = await ex.run(lambda: (time.sleep(0.2), trace_id_var.get())[1])
+    t.cancel()
+    ex.shutdown()
+
+    assert result == "abc"  # contextvars 带进线程
+    assert ticks >= 10  # 阻塞期间 event loop 仍在跑
+    stats = ex.stats()
+    assert stats["completed"] == 1 and stats["queue_depth"] == 0
+    assert stats["run_ms_max"] >= 200
+
+
+@pytest.mark.asyncio
+async def test_queue_depth_and_failures_are_recorded():
+    ex = BlockingExecutor("test", max_workers=1)
+
+    def boom():
+        raise ValueError("x")
+
+    results = await asyncio.gather(
+        ex.run(time.sleep, 0.05), ex.run(time.sleep, 0.05), ex.run(boom), return_exceptions=True
+    )
+    ex.shutdown()
+
+    assert isinstance(results[2], ValueError)
+    stats = ex.stats()
+    assert stats["max_queue_depth"] >= 2
+    assert stats["failed"] == 1 and stats["completed"] == 2
+    assert stats["wait_ms_p95"] >= 50
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_fts_modes.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+import sqlite3
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag import db as rag_db, ingest
+from app.agent.rag.db import get_fts_mode, get_kb_generation, get_kb_meta, init_rag_tables, is_external_content_fts
+from app.agent.rag.fts import SEGMENTER_VERSION, segment_for_index
+from app.agent.rag.ingest import compact_kb, reindex_kb
+from app.agent.rag.retriever import retrieve
+from app.infra.db import get_db
+from app.infra.settings import settings
+
+
+def test_segment_for_index_bigram():
+    assert segment_for_index("STAR方法", "bigram").split() == ["STAR", "方法"]
+    assert segment_for_index("行为面试", "bigram").split() == ["行为", "为面", "面试"]
+    assert segment_for_index("行为面试", "trigram") == "行为面试"
+
+
+@pytest.mark.parametrize("mode,expect_hit", [("unicode61", False), ("trigram", True), ("bigram", True)])
+def test_chinese_query_by_mode(kb, mode, expect_hit):
+    reindex_kb(fts_mode=mode, kb_dir=kb)
+    chunks = retrieve("行为面试怎么准备", k=2)
+    assert bool(chunks) == expect_hit
+    if expect_hit:
+        assert chunks[0].title == "interview"
+        assert "行为面试" in chunks[0].content  # kb_chunk 里存的是原文
+
+
+def test_existing_index_keeps_its_mode(kb):
+    reindex_kb(fts_mode="trigram", kb_dir=kb)
+    assert init_rag_tables("bigram") == "trigram"
+    with get_db().connection() as conn:
+        assert get_fts_mode(conn) == "trigram"
+
+
+def test_fts_is_external_content_synced_by_triggers(kb):
+    reindex_kb(fts_mode="trigram", kb_dir=kb)
+    with get_db().connection() as conn:
+        assert is_external_content_fts(conn)
+        # 外部内容表没有 _content 影子表：原文只在 kb_chunk 里存一份
+        names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master")}
+    assert "kb_chunk_fts_content" not in names
+
+    with get_db().write() as conn:
+        conn.execute("UPDATE kb_chunk SET content = ? WHERE doc_id = (SELECT id FROM kb_doc WHERE title = 'grammar')",
+                     ("主谓一致是常见语法错误。",))
+    assert retrieve("主谓一致", k=2)[0].title == "grammar"
+    assert not retrieve("冠词遗漏", k=2)
+
+
+def test_bigram_fts_is_written_by_ingest(kb):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    with get_db().connection() as conn:
+        assert is_external_content_fts(conn)
+        assert not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger'").fetchone()
+
+    # 没有调 Python 函数的触发器：普通连接（sqlite3 命令行等）也能写 kb_chunk
+    raw = sqlite3.connect(settings.DB_PATH)
+    with raw:
+        raw.execute("INSERT INTO kb_chunk(doc_id, chunk_index, content) VALUES (1, 99, '外部写入')")
+        raw.execute("DELETE FROM kb_chunk WHERE chunk_index = 99")
+    raw.close()
+
+    # 增量修改 / 删除：旧的二元组从索引里删干净
+    (kb / "grammar.md").write_text("主谓一致是常见语法错误。", encoding="utf-8")
+    (kb / "interview.md").unlink()
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert retrieve("主谓一致", k=2)[0].title == "grammar"
+    assert not retrieve("冠词遗漏", k=2)
+    assert not retrieve("行为面试", k=2)
+    with get_db().connection() as conn:
+        stale = conn.execute("SELECT COUNT(*) FROM kb_chunk_fts WHERE kb_chunk_fts MATCH '冠词 OR 行为'").fetchone()[0]
+    assert stale == 0
+
+
+def test_segmenter_change_rebuilds_bigram_fts(kb, monkeypatch):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    with get_db().connection() as conn:
+        assert get_kb_meta(conn, "fts_segmenter") == SEGMENTER_VERSION
+        generation = get_kb_generation(conn)
+
+    # 新版切分：中文前后多带一个 term（和旧版切出来的文本不一样）
+    def new_segmenter(text, mode):
+        return segment_for_index(text, mode) + (" zhseg" if mode == "bigram" else "")
+
+    monkeypatch.setattr(rag_db, "segment_for_index", new_segmenter)
+    monkeypatch.setattr(ingest, "segment_for_index", new_segmenter)
+    monkeypatch.setattr(rag_db, "SEGMENTER_VERSION", "test-2")
+    assert init_rag_tables() == "bigram"
+    with get_db().connection() as conn:
+        assert get_kb_meta(conn, "fts_segmenter") == "test-2"
+        assert get_kb_generation(conn) == generation + 1
+        assert conn.execute("SELECT COUNT(*) FROM kb_chunk_fts WHERE kb_chunk_fts MATCH 'zhseg'").fetchone()[0] == 3
+
+    # 重建后按新切分增量删改，旧 term 能删干净
+    (kb / "grammar.md").write_text("主谓一致是常见语法错误。", encoding="utf-8")
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert not retrieve("冠词遗漏", k=2)
+    with get_db().connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM kb_chunk_fts WHERE kb_chunk_fts MATCH '冠词'").fetchone()[0] == 0
+
+
+def test_legacy_fts_table_is_migrated(kb):
+    with get_db().write() as conn:
+        conn.execute("CREATE TABLE kb_doc (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE NOT NULL, title TEXT NOT NULL)")
+        conn.execute("CREATE TABLE kb_chunk (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id INTEGER NOT NULL, "
+                     "chunk_index INTEGER NOT NULL, content TEXT NOT NULL)")
+        conn.execute("CREATE TABLE kb_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("INSERT INTO kb_meta(key, value) VALUES ('fts_mode', 'bigram')")
+        conn.execute("CREATE VIRTUAL TABLE kb_chunk_fts USING fts5(content, content_rowid='id')")
+        conn.execute("INSERT INTO kb_doc(path, title) VALUES ('interview.md', 'interview')")
+        for i in range(200):
+            text = f"第{i}条：行为面试推荐使用STAR方法，先讲情境，再讲任务和行动。" * 10
+            cur = conn.execute("INSERT INTO kb_chunk(doc_id, chunk_index, content) VALUES (1, ?, ?)", (i, text))
+            conn.execute("INSERT INTO kb_chunk_fts(rowid, content) VALUES (?, ?)", (cur.lastrowid, segment_for_index(text, "bigram")))
+
+    before, after = compact_kb()
+    with get_db().connection() as conn:
+        assert is_external_content_fts(conn)
+        assert get_fts_mode(conn) == "bigram"
+    assert after < before
+    assert retrieve("行为面试", k=2)[0].title == "interview"
+
+    # 迁移后的库继续增量入库（bigram：ingest 显式写 / 删 FTS 行）
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert report.removed == ["interview.md"] and len(report.added) == 3
+    assert retrieve("冠词遗漏", k=2)[0].title == "grammar"
+    with get_db().connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM kb_chunk_fts WHERE kb_chunk_fts MATCH '行为'").fetchone()[0] == 1
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_ingest.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag import ingest
+from app.agent.rag.db import get_fts_mode, get_kb_generation, init_rag_tables
+from app.agent.rag.ingest import reindex_kb
+from app.agent.rag.retriever import retrieve
+from app.infra.db import get_db
+from app.infra.settings import settings
+
+
+@pytest.fixture
+def kb_files(kb_files):
+    del kb_files["speaking.md"]
+    return kb_files
+
+
+def _chunk_ids(title):
+    with get_db().connection() as conn:
+        rows = conn.execute(
+            "SELECT c.id FROM kb_chunk c JOIN kb_doc d ON d.id = c.doc_id WHERE d.title = ? ORDER BY c.id", (title,)
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def _generation():
+    with get_db().connection() as conn:
+        return get_kb_generation(conn)
+
+
+def test_unchanged_kb_is_skipped(kb):
+    first = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert len(first.added) == 2 and first.generation == 1
+
+    again = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert not again.changed
+    assert len(again.unchanged) == 2 and again.chunks_written == 0
+    assert again.generation is None and _generation() == 1
+
+    # 只 touch 不改内容：hash 相同，仍然算未修改
+    p = kb / "grammar.md"
+    st = p.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))
+    assert not reindex_kb(fts_mode="bigram", kb_dir=kb).changed
+
+
+def test_modified_doc_replaces_only_its_chunks(kb):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    interview_ids = _chunk_ids("interview")
+    grammar_ids = _chunk_ids("grammar")
+
+    (kb / "grammar.md").write_text("时态一致：过去的经历用一般过去时。", encoding="utf-8")
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert report.updated == [(kb / "grammar.md").as_posix()]
+    assert report.chunks_deleted == len(grammar_ids) and report.chunks_written == 1
+    assert _chunk_ids("interview") == interview_ids
+    assert _chunk_ids("grammar") != grammar_ids
+    assert _generation() == 2
+
+    assert not retrieve("冠词遗漏", k=2)
+    assert retrieve("一般过去时", k=2)[0].title == "grammar"
+
+
+def test_removed_doc_is_deleted(kb):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    (kb / "interview.md").unlink()
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert report.removed == [(kb / "interview.md").as_posix()]
+    assert _chunk_ids("interview") == []
+    assert not retrieve("行为面试", k=2)
+    with get_db().connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM kb_chunk_fts").fetchone()[0] == len(_chunk_ids("grammar"))
+
+
+def test_mode_change_forces_full_rebuild(kb):
+    reindex_kb(fts_mode="unicode61", kb_dir=kb)
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert report.full and len(report.added) == 2
+    assert retrieve("行为面试", k=2)[0].title == "interview"
+
+
+def test_old_kb_doc_table_is_migrated(kb):
+    with get_db().write() as conn:
+        conn.execute("CREATE TABLE kb_doc (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE NOT NULL, title TEXT NOT NULL)")
+        conn.execute("INSERT INTO kb_doc(path, title) VALUES (?, ?)", ((kb / "grammar.md").as_posix(), "grammar"))
+    init_rag_tables("bigram")
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    # 老数据没有 hash：当作修改过重新入库
+    assert report.updated == [(kb / "grammar.md").as_posix()]
+    assert report.added == [(kb / "interview.md").as_posix()]
+
+
+def test_full_rebuild_keeps_serving_old_index_until_swap(kb, monkeypatch):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    old_ids = _chunk_ids("interview") + _chunk_ids("grammar")
+    monkeypatch.setattr(settings, "RAG_INGEST_WORKERS", 1)  # 在当前进程里切，才能记下中途的检索结果
+    seen = []
+    real = ingest._iter_chunks_streaming
+
+    def chunks_and_query(path, *a, **kw):
+        # 重建进行中：检索仍然走旧表
+        seen.append([c.title for c in retrieve("行为面试", k=2)])
+        return real(path, *a, **kw)
+
+    monkeypatch.setattr(ingest, "_iter_chunks_streaming", chunks_and_query)
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb, full=True)
+    assert seen == [["interview"], ["interview"]]
+    assert report.full and report.generation == 2 and not report.removed
+    # 新 chunk_id 接在旧的后面，不会和旧向量文件/缓存里的 id 撞上
+    assert min(_chunk_ids("interview") + _chunk_ids("grammar")) > max(old_ids)
+    assert retrieve("行为面试", k=2)[0].title == "interview"
+
+
+def test_failed_full_rebuild_leaves_live_index(kb, monkeypatch):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    monkeypatch.setattr(settings, "RAG_INGEST_WORKERS", 1)
+
+    def broken(path, *a, **kw):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(ingest, "_iter_chunks_streaming", broken)
+    with pytest.raises(RuntimeError):
+        reindex_kb(fts_mode="trigram", kb_dir=kb)
+    with get_db().connection() as conn:
+        assert get_fts_mode(conn) == "bigram"
+        names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%shadow%'")]
+    assert names == []
+    assert _generation() == 1
+    assert retrieve("行为面试", k=2)[0].title == "interview"
+
+
+def test_parallel_chunking_matches_serial(kb, monkeypatch):
+    for i in range(6):
+        (kb / f"note{i}.txt").write_text(f"第{i}篇笔记：复述练习。" + "跟读英文材料，注意连读和重音。" * 80, encoding="utf-8")
+
+    def snapshot():
+        with get_db().connection() as conn:
+            return conn.execute(
+                "SELECT d.path, c.chunk_index, c.content FROM kb_chunk c JOIN kb_doc d ON d.id = c.doc_id "
+                "ORDER BY d.path, c.chunk_index"
+            ).fetchall()
+
+    monkeypatch.setattr(settings, "RAG_INGEST_WORKERS", 1)
+    serial = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    expected = [tuple(r) for r in snapshot()]
+
+    monkeypatch.setattr(settings, "RAG_INGEST_WORKERS", 2)
+    parallel = reindex_kb(fts_mode="bigram", kb_dir=kb, full=True)
+    assert parallel.workers == 2 and serial.workers == 1
+    assert [tuple(r) for r in snapshot()] == expected
+    assert parallel.chunks_written == serial.chunks_written == len(expected)
+    assert parallel.bytes_read > 0 and parallel.chunks_per_sec > 0 and parallel.mb_per_sec > 0
+    assert retrieve("连读重音", k=2)[0].title.startswith("note")
+
+
+def test_bulk_writer_batches_whole_documents(kb, monkeypatch):
+    for i in range(3):
+        (kb / f"long{i}.txt").write_text("口语练习每天跟读二十分钟。" * 200, encoding="utf-8")
+    monkeypatch.setattr(ingest, "BATCH_SIZE", 5)
+    report = reindex_kb(fts_mode="bigram", kb_dir=kb)
+    assert 1 < report.batches <= len(report.added)
+    with get_db().connection() as conn:
+        ids = [r[0] for r in conn.execute("SELECT id FROM kb_chunk ORDER BY doc_id, chunk_index")]
+        fts_ids = sorted(r[0] for r in conn.execute("SELECT rowid FROM kb_chunk_fts"))
+    assert sorted(ids) == fts_ids and len(set(ids)) == report.chunks_written
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_intent_model.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+import json
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent import intent, intent_model
+from app.agent.intent_model import IntentModel, load_samples_from_log
+from app.agent.schemas import IntentResult
+from app.infra.settings import settings
+
+SAMPLES = [
+    ("我想练练英语对白", {"intent": "practice", "domain": "speaking"}),
+    ("陪我用英语聊聊天气", {"intent": "practice", "domain": "speaking"}),
+    ("英语聊天练一下", {"intent": "practice", "domain": "speaking"}),
+    ("HR 问我离职原因怎么答", {"intent": "tutor", "domain": "interview"}),
+    ("HR 面谈时怎么谈薪资", {"intent": "tutor", "domain": "interview"}),
+    ("跟 HR 怎么介绍项目经历", {"intent": "tutor", "domain": "interview"}),
+    ("今天天气怎么样", {"intent": "other", "domain": "unknown"}),
+    ("你是谁", {"intent": "other", "domain": "unknown"}),
+    ("讲个笑话", {"intent": "other", "domain": "unknown"}),
+]
+
+
+def test_train_predict_and_roundtrip(tmp_path):
+    model = IntentModel.train(SAMPLES, dim=1 << 12)
+    assert model.predict("用英语聊天")["domain"][0] == "speaking"
+    assert model.predict("HR 问我为什么离职")["domain"][0] == "interview"
+
+    path = tmp_path / "m.bin"
+    model.save(path)
+    loaded = IntentModel.load(path)
+    for text, _ in SAMPLES:
+        assert loaded.predict(text) == model.predict(text)
+
+
+def test_samples_from_json_log_lines():
+    record = {"text": "英语聊天", "intent": "practice", "domain": "speaking"}
+    lines = [
+        json.dumps({"msg": f"intent(llm)={json.dumps(record, ensure_ascii=False)}", "logger": "intent"}),
+        json.dumps({"msg": "intent(rule)={'intent': 'plan'}", "logger": "intent"}),
+        "garbage",
+    ]
+    assert load_samples_from_log(lines) == [("英语聊天", {"intent": "practice", "domain": "speaking"})]
+
+
+def test_middle_tier_respects_threshold(monkeypatch):
+    model = IntentModel.train(SAMPLES, dim=1 << 12)
+    monkeypatch.setattr(intent_model, "_model", model)
+    monkeypatch.setattr(intent_model, "_model_loaded", True)
+    rule = IntentResult(intent="other", domain="unknown")
+
+    monkeypatch.setattr(settings, "INTENT_MODEL_MIN_CONFIDENCE", 0.5)
+    assert intent.classify_intent_model("英语聊天练一下吧", rule) == IntentResult(intent="practice", domain="speaking")
+    # 规则命中的 intent 优先
+    assert intent.classify_intent_model("英语聊天", IntentResult(intent="plan")).intent == "plan"
+
+    monkeypatch.setattr(settings, "INTENT_MODEL_MIN_CONFIDENCE", 1.01)
+    assert intent.classify_intent_model("英语聊天练一下吧", rule) is None
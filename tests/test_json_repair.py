@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_json_repair.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import httpx
+import pytest
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.core import generate_plan
+from app.agent.json_utils import JSON_REPAIR_STATS, parse_model_with_repair
+from app.agent.schemas import AgentPlan, IntentResult, SpeakingFeedback
+from app.infra import http_client
+
+
+@pytest.mark.parametrize("raw", [
+    # 前后夹杂解释文字，且解释里也有 }
+    '好的，计划如下：{"intent": "plan", "steps": ["每天练 20 分钟"], "tool_calls": []} 希望有帮助 :}',
+    # 尾逗号 + 单引号 + Python 字面量
+    "{'intent': 'plan', 'steps': ['每天练 20 分钟',], 'tool_calls': [],}",
+    # 裸 key
+    '{intent: "plan", steps: ["每天练 20 分钟"], tool_calls: []}',
+    # 被截断
+    '```json\n{"intent": "plan", "steps": ["每天练 20 分钟", "周末复',
+])
+def test_local_repair_recovers_common_llm_mistakes(raw):
+    plan = parse_model_with_repair(raw, AgentPlan)
+    assert plan.intent == "plan"
+    assert plan.steps[0] == "每天练 20 分钟"
+    assert plan.tool_calls == []
+
+
+def test_schema_coercion_and_path_stats():
+    before = dict(JSON_REPAIR_STATS["SpeakingFeedback"])
+    raw = """{"overall_score": "7/10", "fluency_score": 6.6, "grammar_score": "5",
+      "vocabulary_score": 7, "structure_score": 6, "top_mistakes": "时态不一致",
+      "improved_version": "Hi, I'm Tom.", "chinese_coaching": [], "next_question": "Tell me about a project.",
+      "extra_field": true}"""
+    fb = parse_model_with_repair(raw, SpeakingFeedback)
+    assert (fb.overall_score, fb.fluency_score, fb.grammar_score) == (7, 7, 5)
+    assert fb.top_mistakes == ["时态不一致"]
+    assert JSON_REPAIR_STATS["SpeakingFeedback"]["strict"] == before.get("strict", 0) + 1
+
+    assert parse_model_with_repair('{"intent": "Practice", "domain": "speaking"}', IntentResult).intent == "practice"
+
+
+def test_unrepairable_output_raises():
+    with pytest.raises(ValueError):
+        parse_model_with_repair("抱歉，我无法生成计划。", AgentPlan)
+
+
+def test_failed_parse_is_recorded_once():
+    before = JSON_REPAIR_STATS["IntentResult"]["failed"]
+    with pytest.raises(ValueError):
+        parse_model_with_repair("没有 JSON", IntentResult)
+    assert JSON_REPAIR_STATS["IntentResult"]["failed"] == before + 1
+
+
+@pytest.mark.asyncio
+async def test_llm_repaired_plan_is_recorded_once():
+    replies = iter(["抱歉，我无法生成计划。", '{"intent": "plan", "steps": ["每天练 20 分钟"], "tool_calls": []}'])
+    http_client.get_http_client()._transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, json={"choices": [{"message": {"content": next(replies)}}]})
+    )
+    before = dict(JSON_REPAIR_STATS["AgentPlan"])
+    plan = await generate_plan("u-repair", "帮我做一个只修复一次的计划")
+    assert plan.steps == ["每天练 20 分钟"]
+    after = JSON_REPAIR_STATS["AgentPlan"]
+    # 只记 llm_repair 一条：修复后的那次本地解析（strict）不再重复计数
+    assert {k: after[k] - before.get(k, 0) for k in after if after[k] != before.get(k, 0)} == {"llm_repair": 1}
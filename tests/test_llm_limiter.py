@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_llm_limiter.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import asyncio
+
+import pytest
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.llm_limiter import AdmissionTimeout, FairLimiter
+
+
+@pytest.mark.asyncio
+async def test_chatty_user_does_not_starve_others():
+    limiter = FairLimiter(max_concurrency=1)
+    order = []
+
+    async def call(user: str, tag: str):
+        async with limiter.slot(user):
+            order.append(tag)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.create_task(call("chatty", f"a{i}")) for i in range(4)]
+    await asyncio.sleep(0)  # 让 chatty 的请求先排进队列
+    tasks.append(asyncio.create_task(call("quiet", "b0")))
+    await asyncio.gather(*tasks)
+
+    # a0 直接放行；排队中轮转，quiet 用户不用等 chatty 的全部请求
+    assert order.index("b0") <= 2
+    assert limiter.stats()["queue_depth"] == 0
+    assert limiter.stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_wait_times_out():
+    limiter = FairLimiter(max_concurrency=1)
+    await limiter.acquire("u1")
+    with pytest.raises(AdmissionTimeout):
+        await limiter.acquire("u2", timeout=0.02)
+    limiter.release()
+    assert limiter.stats()["timeouts"] == 1
+    assert limiter.stats()["queue_depth"] == 0
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_llm_retry.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import asyncio
+
+import httpx
+import pytest
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.core import call_llm, generate_plan, generate_plan_stream
+from app.agent.deadline import Deadline, DeadlineExceeded
+from app.agent.intent import classify_intent_llm
+from app.infra import http_client
+
+
+def _mock_upstream(responses):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return responses[min(len(calls), len(responses)) - 1]
+
+    client = http_client.get_http_client()
+    client._transport = httpx.MockTransport(handler)
+    return calls
+
+
+def _ok(text):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+@pytest.mark.asyncio
+async def test_non_retryable_4xx_is_not_retried():
+    calls = _mock_upstream([httpx.Response(400, json={"error": "bad request"})])
+    with pytest.raises(httpx.HTTPStatusError):
+        await call_llm([{"role": "user", "content": "retry-400"}], use_cache=False)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_429_is_retried_after_retry_after():
+    calls = _mock_upstream([httpx.Response(429, headers={"Retry-After": "0"}), _ok("ok")])
+    text = await call_llm([{"role": "user", "content": "retry-429"}], use_cache=False)
+    assert text == "ok"
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_no_retry_when_budget_cannot_cover_another_attempt():
+    calls = _mock_upstream([httpx.Response(503, headers={"Retry-After": "5"}), _ok("late")])
+    with pytest.raises(DeadlineExceeded) as exc_info:
+        await call_llm([{"role": "user", "content": "retry-503"}], use_cache=False, deadline=Deadline.after(3))
+    assert isinstance(exc_info.value.__cause__, httpx.HTTPStatusError)
+    assert len(calls) == 1
+
+    with pytest.raises(DeadlineExceeded):
+        await call_llm([{"role": "user", "content": "expired"}], use_cache=False, deadline=Deadline.after(0))
+
+
+@pytest.mark.asyncio
+async def test_coalesced_caller_is_not_bound_by_leader_budget():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.1)  # 慢一点：follower 在第一次尝试返回前就合并进来
+        return httpx.Response(503, headers={"Retry-After": "0"}) if len(calls) == 1 else _ok("shared")
+
+    http_client.get_http_client()._transport = httpx.MockTransport(handler)
+    messages = [{"role": "user", "content": "shared-budget"}]
+    # leader 的预算不够再试一次；共享调用按 follower 的预算重试，follower 拿到结果
+    leader = asyncio.create_task(call_llm(messages, use_cache=False, deadline=Deadline.after(0.3)))
+    await asyncio.sleep(0.01)
+    follower = call_llm(messages, use_cache=False, deadline=Deadline.after(60))
+    results = await asyncio.gather(leader, follower, return_exceptions=True)
+    assert isinstance(results[0], DeadlineExceeded)
+    assert results[1] == "shared" and len(calls) == 2
+
+
+def _failing_upstream():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("upstream too slow", request=request)
+
+    http_client.get_http_client()._transport = httpx.MockTransport(handler)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_exhausted_budget_degrades_instead_of_raising():
+    calls = _failing_upstream()
+    with pytest.raises(DeadlineExceeded) as exc_info:
+        await call_llm([{"role": "user", "content": "timeout"}], use_cache=False, deadline=Deadline.after(1.0))
+    assert isinstance(exc_info.value.__cause__, httpx.ReadTimeout)
+    assert len(calls) == 1
+
+    plan = await generate_plan("u1", "帮我做一个学习计划", deadline=Deadline.after(1.0))
+    assert plan.intent == "other" and plan.tool_calls == []
+
+    events = [e async for e in generate_plan_stream("u1", "帮我做一个学习计划（流式）", deadline=Deadline.after(1.0))]
+    assert events[-1][0] == "plan" and events[-1][1].tool_calls == []
+
+    result = await classify_intent_llm("随便聊聊", user_id="u1", deadline=Deadline.after(1.0))
+    assert result.domain == "unknown"
+
+
+@pytest.mark.asyncio
+async def test_unparseable_intent_falls_back_and_is_not_replayed_from_cache():
+    calls = _mock_upstream([_ok("抱歉，我无法判断"), _ok('{"intent": "practice", "domain": "speaking"}')])
+    result = await classify_intent_llm("一句解析不了的话", user_id="u1")
+    assert result.domain == "unknown" and len(calls) == 1
+
+    # 坏输出没留在缓存里：第二次重新问上游
+    result = await classify_intent_llm("一句解析不了的话", user_id="u1")
+    assert result.domain == "speaking" and len(calls) == 2
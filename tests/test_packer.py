@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_packer.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag.ingest import _iter_chunks_from_text
+from app.agent.rag.packer import estimate_tokens, merge_adjacent, pack_context
+from app.agent.rag.retriever import RetrievedChunk
+
+
+def _chunk(cite, cid, doc, idx, content, title=None):
+    return RetrievedChunk(cite_key=cite, chunk_id=cid, title=title or f"doc{doc}", chunk_index=idx,
+                          content=content, score=-1.0, doc_id=doc)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("行为面试") == 4
+    assert estimate_tokens("hello world") == 5  # 每词 ceil(5/4) + 1 个空白（略高估）
+    assert estimate_tokens("STAR 方法") == 4
+
+
+def test_merge_adjacent_removes_overlap_and_keeps_citation_table():
+    text = "".join(f"第{i}句话讲的是行为面试的第{i}个要点。" for i in range(60))
+    parts = _iter_chunks_from_text(text, max_chars=200, overlap=40)
+    chunks = [
+        _chunk("C1", 11, 1, 1, parts[1]),
+        _chunk("C2", 50, 2, 0, "另一篇文档。"),
+        _chunk("C3", 10, 1, 0, parts[0]),
+    ]
+    spans = merge_adjacent(chunks)
+    assert [s.cite_key for s in spans] == ["C1", "C2"]
+    assert spans[0].label == "doc1#0-1"
+    assert spans[0].content == text[:len(spans[0].content)]  # 重叠部分只出现一次
+    assert [c.chunk_id for c in spans[0].chunks] == [10, 11]
+
+
+def test_pack_context_respects_budget_and_relevance_order():
+    chunks = [
+        _chunk("C1", 1, 1, 0, "最相关的资料。" * 20),
+        _chunk("C2", 2, 2, 5, "次相关的资料。" * 20),
+        _chunk("C3", 3, 3, 9, "不太相关的资料。" * 20),
+    ]
+    packed = pack_context(chunks, max_tokens=300)
+    assert packed.tokens <= 300
+    assert [s.chunks[0].chunk_id for s in packed.spans][:2] == [1, 2]
+    assert packed.citations["C1"] == [1]
+    assert {c.chunk_id for c in packed.chunks} | {c.chunk_id for c in packed.dropped} == {1, 2, 3}
+    assert [c.cite_key for c in packed.chunks] == [f"C{i}" for i in range(1, len(packed.chunks) + 1)]
+    assert packed.text.startswith("[C1] (doc1#0)")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_plan_stream.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+import json
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app import main
+from app.agent import tools
+from app.agent.core import ToolDispatcher, _degraded_plan
+from app.agent.plan_stream import PlanStreamParser
+from app.agent.schemas import AgentPlan, ChatRequest, IntentResult, ToolCall
+
+
+def test_steps_and_tool_calls_are_emitted_as_soon_as_complete():
+    raw = ('```json\n{"intent": "plan", "steps": ["每天 \\"20\\" 分钟", "周末复盘"], '
+           '"tool_calls": [{"name": "create_todo", "arguments": {"title": "练口语 {x}"}}]}\n```'
+           ' 之后的说明 {"intent": "other"}')
+    parser = PlanStreamParser()
+    events = []
+    for i in range(0, len(raw), 3):  # 模拟模型的碎 delta
+        for ev in parser.feed(raw[i:i + 3]):
+            events.append((i, ev))
+
+    kinds = [ev[0] for _, ev in events]
+    assert kinds == ["intent", "step", "step", "tool_call"]
+    assert events[1][1] == ("step", (0, '每天 "20" 分钟'))
+
+    # 第一个 step 在整个 JSON 结束之前就发出
+    assert events[1][0] < raw.index("tool_calls")
+    index, tc = events[3][1][1]
+    assert index == 0 and tc.name == "create_todo" and tc.arguments == {"title": "练口语 {x}"}
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_only_runs_read_only_tools_early_and_follows_final_plan(monkeypatch):
+    monkeypatch.setattr(tools, "FAKE_TODO_DB", {"u-dispatch": [{"title": "旧任务"}]})
+    monkeypatch.setitem(tools.TOOL_REGISTRY, "list_todos", lambda user_id: {"ok": True, "items": tools.FAKE_TODO_DB[user_id]})
+
+    d = ToolDispatcher("u-dispatch")
+    # 有副作用的工具不会提前执行
+    d.dispatch(0, ToolCall(name="create_todo", arguments={"title": "草稿里的任务"}))
+    d.dispatch(1, ToolCall(name="list_todos"))
+    final = AgentPlan(intent="plan", steps=["s"], tool_calls=[
+        ToolCall(name="create_todo", arguments={"title": "最终任务"}),
+        ToolCall(name="list_todos"),
+    ])
+    results = await d.finish(final)
+    assert tools.FAKE_TODO_DB["u-dispatch"] == [{"title": "旧任务"}, {"title": "最终任务"}]
+    assert set(results) == {"0:create_todo", "1:list_todos"} and not d.discarded
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_discards_early_calls_missing_from_final_plan():
+    d = ToolDispatcher("u-dispatch-2")
+    d.dispatch(0, ToolCall(name="list_todos"))
+    # 最终 plan 降级成没有 tool_calls：提前执行的结果不能混进来
+    assert await d.finish(_degraded_plan()) is None
+    assert d.discarded == ["0:list_todos"]
+
+    d = ToolDispatcher("u-dispatch-3")
+    d.dispatch(0, ToolCall(name="list_todos", arguments={"limit": 1}))
+    final = AgentPlan(intent="plan", steps=["s"], tool_calls=[ToolCall(name="list_todos")])
+    results = await d.finish(final)
+    assert d.discarded == ["0:list_todos"] and results["0:list_todos"]["ok"]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_keeps_plan_order_after_side_effects(monkeypatch):
+    monkeypatch.setattr(tools, "FAKE_TODO_DB", {})
+    monkeypatch.setitem(tools.TOOL_REGISTRY, "list_todos", lambda user_id: {"ok": True, "items": list(tools.FAKE_TODO_DB.get(user_id, []))})
+
+    # create_todo 在前：后面的只读调用不能提前执行，要读到刚建的任务（和 run_tools 一致）
+    d = ToolDispatcher("u-order")
+    d.dispatch(0, ToolCall(name="create_todo", arguments={"title": "x"}))
+    d.dispatch(1, ToolCall(name="list_todos"))
+    final = AgentPlan(intent="plan", steps=["s"], tool_calls=[
+        ToolCall(name="create_todo", arguments={"title": "x"}),
+        ToolCall(name="list_todos"),
+    ])
+    results = await d.finish(final)
+    assert results["1:list_todos"]["items"] == [{"title": "x"}]
+
+    # 草稿里前面是只读的、最终 plan 前面插进了有副作用的调用：提前结果作废，按顺序重跑
+    d = ToolDispatcher("u-order-2")
+    d.dispatch(0, ToolCall(name="list_todos"))
+    d.dispatch(1, ToolCall(name="list_todos"))
+    final = AgentPlan(intent="plan", steps=["s"], tool_calls=[
+        ToolCall(name="create_todo", arguments={"title": "y"}),
+        ToolCall(name="list_todos"),
+    ])
+    results = await d.finish(final)
+    assert d.discarded == ["0:list_todos", "1:list_todos"]
+    assert results["1:list_todos"]["items"] == [{"title": "y"}]
+
+
+async def _chat_stream_events(monkeypatch, user_id, final_plan):
+    """
+    跑一遍 /chat/stream：流式阶段推出两个草稿步骤，最终 plan 是 final_plan；返回 (事件名, 数据) 列表。
+    """
+    async def fake_plan_stream(user_id, user_message, deadline=None):
+        yield "intent", "plan"
+        yield "step", (0, "草稿步骤一")
+        yield "step", (1, "草稿步骤二")
+        yield "plan", final_plan
+
+    monkeypatch.setattr(main, "classify_intent_local", lambda message: IntentResult(intent="plan", domain="interview"))
+    monkeypatch.setattr(main, "generate_plan_stream", fake_plan_stream)
+    resp = await main.chat_stream(ChatRequest(user_id=user_id, message="帮我做个面试准备计划"))
+    events = []
+    async for frame in resp.body_iterator:
+        for block in frame.strip().split("\n\n"):
+            lines = block.split("\n")
+            if lines[0].startswith("event: "):
+                events.append((lines[0][len("event: "):], "\n".join(lines[1:])[len("data: "):]))
+            else:
+                events.append(("data", block[len("data: "):]))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_replaces_draft_steps_and_does_not_repeat_them(monkeypatch):
+    final_plan = AgentPlan(intent="plan", steps=["修复后的步骤"], tool_calls=[])
+    events = await _chat_stream_events(monkeypatch, "u-stream-replace", final_plan)
+    kinds = [k for k, _ in events]
+    assert kinds.count("step") == 2
+    replace = [json.loads(d) for k, d in events if k == "replace"]
+    assert replace == [{"steps": ["修复后的步骤"], "reason": "plan_changed"}]
+    assert kinds.index("replace") > max(i for i, k in enumerate(kinds) if k == "step")
+    text = "".join(d for k, d in events if k == "data")
+    assert "修复后的步骤" not in text and "草稿步骤" not in text
+    assert kinds[-1] == "done"
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_matching_plan_needs_no_replace(monkeypatch):
+    final_plan = AgentPlan(intent="plan", steps=["草稿步骤一", "草稿步骤二"], tool_calls=[])
+    events = await _chat_stream_events(monkeypatch, "u-stream-same", final_plan)
+    assert "replace" not in [k for k, _ in events]
+    assert "草稿步骤" not in "".join(d for k, d in events if k == "data")
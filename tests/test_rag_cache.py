@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_rag_cache.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag import answer
+from app.agent.rag.cache import RAG_CACHE, cache_key, normalize_query
+from app.agent.rag.ingest import reindex_kb
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    async def fake_call_llm(messages, **kw):
+        calls.append(messages)
+        return "先讲情境再讲行动 [C1]"
+
+    monkeypatch.setattr(answer, "call_llm", fake_call_llm)
+    return calls
+
+
+def test_normalize_query_folds_case_width_and_punctuation():
+    assert normalize_query("  STAR 怎么答？") == normalize_query("ｓｔａｒ   怎么答!") == "star 怎么答"
+    assert cache_key("STAR 怎么答？", 4, 1) != cache_key("STAR 怎么答？", 4, 2)
+    assert cache_key("STAR 怎么答？", 4, 1) != cache_key("STAR 怎么答？", 3, 1)
+
+
+@pytest.mark.asyncio
+async def test_answer_cache_hits_variants_and_invalidates_on_reindex(indexed_kb, llm_calls):
+    text, chunks = await answer.ask_with_rag("行为面试 STAR 怎么准备？", k=2)
+    assert chunks and len(llm_calls) == 1
+
+    again, cached_chunks = await answer.ask_with_rag("行为面试  star 怎么准备", k=2)
+    assert again == text and cached_chunks == chunks
+    assert len(llm_calls) == 1
+    assert RAG_CACHE.stats()["answer"]["memory"]["hits"] >= 1
+
+    generation = RAG_CACHE.generation()
+    # 没有文件变化的 reindex 不动版本号，缓存继续有效
+    reindex_kb(fts_mode="bigram", kb_dir=indexed_kb)
+    await answer.ask_with_rag("行为面试 STAR 怎么准备？", k=2)
+    assert len(llm_calls) == 1
+
+    (indexed_kb / "grammar.md").write_text("常见语法错误包括冠词遗漏、时态混用和主谓不一致。", encoding="utf-8")
+    reindex_kb(fts_mode="bigram", kb_dir=indexed_kb)
+    await answer.ask_with_rag("行为面试 STAR 怎么准备？", k=2)
+    assert len(llm_calls) == 2
+    assert RAG_CACHE.generation() == generation + 1
+
+
+@pytest.mark.asyncio
+async def test_paraphrase_reuses_answer_through_semantic_tier(indexed_kb, llm_calls):
+    hits = RAG_CACHE.stats()["semantic"]["hits"]
+    text, _ = await answer.ask_with_rag("行为面试STAR方法怎么回答？", k=2)
+    again, _ = await answer.ask_with_rag("STAR 怎么答", k=2)
+    assert again == text
+    assert len(llm_calls) == 1
+    assert RAG_CACHE.stats()["semantic"]["hits"] == hits + 1
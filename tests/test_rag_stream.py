@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_rag_stream.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+import httpx
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag import answer
+from app.agent.rag.answer import REFUSAL_NO_CITATION, REFUSAL_UPSTREAM, CitationTracker
+from app.agent.rag.retriever import RetrievedChunk
+
+
+def _fake_stream(monkeypatch, *outputs):
+    """
+    每次调用 stream_llm 依次吐出 outputs 里的下一组 delta；记录每次调用是否被提前关闭。
+    """
+    calls = []
+
+    async def fake_stream_llm(messages, **kw):
+        deltas = outputs[len(calls)]
+        record = {"messages": messages, "closed_early": True}
+        calls.append(record)
+        for d in deltas:
+            if isinstance(d, Exception):
+                raise d
+            yield d
+        record["closed_early"] = False
+
+    monkeypatch.setattr(answer, "stream_llm", fake_stream_llm)
+    return calls
+
+
+async def _collect(query):
+    return [e async for e in answer.ask_with_rag_stream(query, k=2)]
+
+
+def test_citation_tracker_handles_split_markers():
+    chunk = RetrievedChunk(cite_key="C1", chunk_id=5, title="t", chunk_index=0, content="x", score=-1.0)
+    tracker = CitationTracker([chunk])
+    assert tracker.feed("先讲情境 [C") == []
+    found = tracker.feed("1] 再讲结果 [C1]")
+    assert [f["cite_key"] for f in found] == ["C1"] and found[0]["sources"][0]["chunk_id"] == 5
+    assert tracker.feed(" 最后 [C7]") == [{"cite_key": "C7", "valid": False}]
+
+
+@pytest.mark.asyncio
+async def test_stream_emits_tokens_then_citations(indexed_kb, monkeypatch):
+    _fake_stream(monkeypatch, ["先讲情境", "再讲行动 [C", "1]"])
+    events = await _collect("行为面试 STAR 怎么准备")
+    kinds = [k for k, _ in events]
+    assert kinds == ["token", "token", "token", "citation", "citations"]
+    assert events[-1][1][0]["cite_key"] == "C1" and events[-1][1][0]["title"] == "interview"
+
+    # 第二次：回答缓存命中，不再调 LLM
+    events = await _collect("行为面试 STAR 怎么准备")
+    assert events[0] == ("token", "先讲情境再讲行动 [C1]")
+
+
+@pytest.mark.asyncio
+async def test_invalid_citation_retracts_early_and_retries(indexed_kb, monkeypatch):
+    calls = _fake_stream(monkeypatch, ["结论 [C9]", " 后面不会再读"], ["重写后的回答 [C1]"])
+    events = await _collect("行为面试 STAR 怎么准备")
+    kinds = [k for k, _ in events]
+    assert kinds == ["token", "citation", "retract", "token", "citation", "citations"]
+    assert events[2][1]["reason"] == "invalid_citation"
+    assert calls[0]["closed_early"] is True
+    assert answer.RETRY_NOTICE in calls[1]["messages"][-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_replace_when_retry_still_has_no_citation(indexed_kb, monkeypatch):
+    _fake_stream(monkeypatch, ["没有引用的回答"], ["还是没有引用"])
+    events = await _collect("行为面试 STAR 怎么准备")
+    kinds = [k for k, _ in events]
+    assert kinds == ["token", "retract", "token", "retract", "replace", "citations"]
+    assert events[4][1]["text"] == REFUSAL_NO_CITATION
+
+
+@pytest.mark.asyncio
+async def test_upstream_failure_mid_stream_is_replaced(indexed_kb, monkeypatch):
+    _fake_stream(monkeypatch, ["先讲情境", httpx.ReadTimeout("upstream too slow")])
+    events = await _collect("行为面试 STAR 怎么准备")
+    kinds = [k for k, _ in events]
+    assert kinds == ["token", "replace", "citations"]
+    assert events[1][1] == {"text": REFUSAL_UPSTREAM, "reason": "upstream_error"} and events[2][1] == []
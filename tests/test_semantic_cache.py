@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_semantic_cache.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.rag.semantic_cache import MinHasher, SemanticCache, containment, jaccard
+
+
+def test_minhash_estimates_jaccard():
+    h = MinHasher(256)
+    a = {f"x{i}" for i in range(100)}
+    b = {f"x{i}" for i in range(50, 150)}  # 真实 Jaccard = 50 / 150
+    assert abs(jaccard(h.signature(a), h.signature(b)) - 1 / 3) < 0.1
+    assert jaccard(h.signature(a), h.signature(set(a))) == 1.0
+    assert containment(1 / 3, 2, 10) == 1.0  # |A∩B| = 3 -> 小集合全在大集合里（截断到 1）
+
+
+def test_paraphrase_with_same_evidence_hits():
+    cache = SemanticCache(max_entries=10, evidence_threshold=0.75, query_threshold=0.5)
+    cache.add("行为面试STAR方法怎么回答？", k=4, generation=1, chunk_ids=[3, 7, 9])
+    assert cache.lookup("STAR 怎么答", 4, 1, [9, 7, 3]) == "行为面试STAR方法怎么回答？"
+    # 资料不同 / 问题不相干 / 版本号或 k 不同：都不命中
+    assert cache.lookup("STAR 怎么答", 4, 1, [1, 2, 5]) is None
+    assert cache.lookup("冠词怎么用", 4, 1, [3, 7, 9]) is None
+    assert cache.lookup("STAR 怎么答", 4, 2, [3, 7, 9]) is None
+    assert cache.lookup("STAR 怎么答", 3, 1, [3, 7, 9]) is None
+    stats = cache.stats()
+    assert stats["lookups"] == 5 and stats["hits"] == 1 and stats["rejected"] >= 1
+
+
+def test_lru_bound_and_discard():
+    cache = SemanticCache(max_entries=2, evidence_threshold=0.75, query_threshold=0.5)
+    for i in range(3):
+        cache.add(f"问题 {i} STAR", k=4, generation=1, chunk_ids=[i])
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("问题 0 STAR", 4, 1, [0]) is None
+    cache.discard("问题 2 STAR")
+    assert cache.lookup("问题 2 STAR", 4, 1, [2]) is None
+    assert cache.lookup("问题 1 STAR", 4, 1, [1]) == "问题 1 STAR"
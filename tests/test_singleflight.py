@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_singleflight.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import asyncio
+
+import pytest
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.singleflight import SingleFlight, llm_request_key
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_upstream():
+    sf = SingleFlight("test")
+    upstream_calls = 0
+
+    async def fake_llm():
+        nonlocal upstream_calls
+        upstream_calls += 1
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    key = llm_request_key("m", 0.2, [{"role": "user", "content": "STAR method"}])
+    results = await asyncio.gather(*[sf.do(key, fake_llm) for _ in range(5)])
+
+    assert results == ["answer"] * 5
+    assert upstream_calls == 1
+    assert sf.stats()["coalesced"] == 4
+    assert sf.stats()["inflight"] == 0
+
+
+def test_request_key_ignores_trailing_whitespace_only():
+    a = llm_request_key("m", 0.2, [{"role": "user", "content": "问题：\n  STAR  \n"}])
+    b = llm_request_key("m", 0.2, [{"role": "user", "content": "问题：\r\n  STAR"}])
+    c = llm_request_key("m", 0.3, [{"role": "user", "content": "问题：\n  STAR"}])
+    assert a == b
+    assert a != c
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_speculation.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import asyncio
+
+import pytest
+
+import sys
+import os
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent import speculation
+from app.agent.schemas import AgentPlan
+from app.agent.speculation import SpeculativePlan, SpeculationStats
+
+
+def _fake_stream(closed):
+    async def fake_generate_plan_stream(user_id, user_message, deadline=None):
+        try:
+            yield "intent", "plan"
+            await asyncio.sleep(0.05)
+            yield "step", (0, "每天 20 分钟")
+            yield "plan", AgentPlan(intent="plan", steps=["每天 20 分钟"])
+        finally:
+            closed.append(True)
+    return fake_generate_plan_stream
+
+
+@pytest.mark.asyncio
+async def test_commit_replays_buffered_events_in_order(monkeypatch):
+    closed = []
+    monkeypatch.setattr(speculation, "generate_plan_stream", _fake_stream(closed))
+    monkeypatch.setattr(speculation, "SPECULATION_STATS", SpeculationStats())
+
+    spec = SpeculativePlan("u1", "帮我安排一下")
+    await asyncio.sleep(0.01)  # 模拟 intent LLM 的等待
+    events = [e async for e in spec.events()]
+
+    assert [k for k, _ in events] == ["intent", "step", "plan"]
+    stats = speculation.SPECULATION_STATS.stats()
+    assert stats["committed"] == 1 and stats["saved_ms_total"] > 0
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_background_plan_and_counts_waste(monkeypatch):
+    closed = []
+    monkeypatch.setattr(speculation, "generate_plan_stream", _fake_stream(closed))
+    monkeypatch.setattr(speculation, "SPECULATION_STATS", SpeculationStats())
+
+    spec = SpeculativePlan("u1", "练口语")
+    await asyncio.sleep(0.01)
+    spec.cancel()
+    await asyncio.sleep(0)
+
+    assert closed == [True]  # 生成器被关闭（LLM 流、准入名额随之释放）
+    stats = speculation.SPECULATION_STATS.stats()
+    assert stats["cancelled"] == 1 and stats["committed"] == 0
+    assert stats["wasted_completed"] == 0 and stats["wasted_ms_total"] > 0
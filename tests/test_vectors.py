@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_vectors.py
+@Author ：zqy
+@Email : zqingy@work@163.com
+@note:
+"""
+import sys
+import os
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+np = pytest.importorskip("numpy")
+
+from app.agent.rag import answer
+from app.agent.rag.answer import REFUSAL_LOW_RELEVANCE
+from app.agent.rag.cache import RAG_CACHE
+from app.agent.rag.ingest import reindex_kb
+from app.agent.rag import retriever
+from app.agent.rag.retriever import _rrf_fuse, retrieve
+from app.agent.rag.vectors import VectorIndex, get_vector_index, mmr_select, vector_path, write_vector_file
+from app.infra.settings import settings
+
+
+@pytest.fixture(autouse=True)
+def vectors_enabled(monkeypatch):
+    monkeypatch.setattr(settings, "RAG_VECTOR_ENABLED", True)
+
+
+def test_rrf_fuse_prefers_items_ranked_by_both():
+    assert _rrf_fuse([[1, 2, 3], [2, 4, 5]], k=60)[:2] == [2, 1]
+    assert _rrf_fuse([[], [5, 6]], k=60) == [5, 6]
+
+
+def test_hybrid_recalls_what_bm25_misses(kb):
+    # unicode61 下整句中文是一个 token，bm25 查不到；向量按二元组能召回
+    reindex_kb(fts_mode="unicode61", kb_dir=kb)
+    chunks = retrieve("行为面试怎么准备", k=2)
+    assert chunks and chunks[0].title == "interview"
+    assert chunks[0].score == 0.0 and chunks[0].vector_score > 0  # 只被向量召回：bm25 分数为 0，带余弦相似度
+    assert [c.cite_key for c in chunks] == [f"C{i}" for i in range(1, len(chunks) + 1)]
+
+
+@pytest.mark.asyncio
+async def test_vector_only_hit_is_answerable(kb, monkeypatch):
+    async def fake_call_llm(messages, **kw):
+        return "先讲情境再讲行动 [C1]"
+
+    monkeypatch.setattr(answer, "call_llm", fake_call_llm)
+    reindex_kb(fts_mode="unicode61", kb_dir=kb)
+    text, chunks = await answer.ask_with_rag("行为面试怎么准备", k=2)
+    assert text != REFUSAL_LOW_RELEVANCE and chunks[0].title == "interview"
+    text, chunks = await answer.ask_with_rag("completely unrelated", k=2)
+    assert text == REFUSAL_LOW_RELEVANCE and chunks == []
+
+    # 相似度阈值可配置：调高后只被向量召回的结果也拒答
+    RAG_CACHE.invalidate()
+    monkeypatch.setattr(settings, "RAG_VECTOR_MIN_SIMILARITY", 0.9)
+    text, _ = await answer.ask_with_rag("行为面试怎么准备", k=2)
+    assert text == REFUSAL_LOW_RELEVANCE
+
+
+def test_vector_search_and_reload(kb):
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    index = get_vector_index()
+    assert index is not None and index.count == 3
+    assert isinstance(index.matrix, np.memmap)
+    hits = index.search("语法 时态", 3)
+    assert len(hits) == 1 and hits[0][1] > 0.3
+    assert index.search("completely unrelated", 3) == []
+
+    # 文件被替换（reindex）后重新映射
+    write_vector_file(vector_path(), np.array([42], dtype=np.int64), index.idf, np.asarray(index.matrix[:1]))
+    assert get_vector_index().count == 1
+    assert isinstance(VectorIndex(vector_path()).ids[0], np.int64)
+
+
+def test_mmr_skips_near_duplicates_and_caps_groups():
+    v = np.array([[1, 0, 0], [0.99, 0.14, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    rel = np.array([1.0, 0.95, 0.6, 0.5], dtype=np.float32)
+    assert mmr_select(v, rel, 2, lambda_=1.0) == [0, 1]
+    assert mmr_select(v, rel, 2, lambda_=0.5) == [0, 2]
+    # 软上限：其它组没有候选了，按 MMR 顺序从超上限的里补满 k 个
+    assert mmr_select(v, rel, 3, lambda_=1.0, groups=[1, 1, 1, 2], per_group=1) == [0, 3, 1]
+
+
+def test_retrieve_returns_diverse_chunks_with_doc_cap(kb, monkeypatch):
+    monkeypatch.setattr(settings, "RAG_VECTOR_ENABLED", False)
+    # 一篇很长的文档会被切成很多相邻、互相重叠的 chunk
+    (kb / "long.md").write_text("行为面试要准备具体的例子。" * 300, encoding="utf-8")
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    chunks = retrieve("行为面试", k=4)
+    titles = [c.title for c in chunks]
+    # 先按上限挑（其它文档的 chunk 优先），不够 k 个再从 long 里补
+    assert len(chunks) == 4
+    assert titles[:3].count("long") == settings.RAG_MAX_CHUNKS_PER_DOC and "interview" in titles[:3]
+
+
+@pytest.mark.parametrize("has_numpy", [True, False])
+def test_retrieve_fills_k_from_a_single_document(kb, monkeypatch, has_numpy):
+    monkeypatch.setattr(settings, "RAG_VECTOR_ENABLED", False)
+    monkeypatch.setattr(retriever, "HAS_NUMPY", has_numpy)
+    for p in kb.iterdir():
+        p.unlink()
+    (kb / "long.md").write_text("行为面试要准备具体的例子。" * 300, encoding="utf-8")
+    reindex_kb(fts_mode="bigram", kb_dir=kb)
+    for k in (1, 3, 4, 6):
+        chunks = retrieve("行为面试", k=k)
+        assert len(chunks) == k
+        assert len({c.chunk_id for c in chunks}) == k
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@File ：test_warmup.py
+@Author ：zqy
+@Email : zqingy@work@163.com 
+@note: 
+"""
+import asyncio
+import sys
+import os
+import time
+
+import pytest
+
+# 获取项目根目录（tests 文件夹的上一级）
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from app.agent.deadline import DeadlineExceeded
+from app.agent.rag import answer, warmup
+from app.agent.rag.cache import RAG_CACHE
+from app.agent.speaking_flow import SPEAKING_RAG_K, SPEAKING_RAG_QUERIES
+from app.infra.settings import settings
+
+
+@pytest.fixture
+def kb_files(kb_files):
+    del kb_files["interview.md"]
+    kb_files["star.md"] = "STAR method for behavioral questions: Situation, Task, Action, Result."
+    return kb_files
+
+
+def test_speaking_queries_are_registered():
+    for q in SPEAKING_RAG_QUERIES.values():
+        assert (q, SPEAKING_RAG_K) in warmup.warm_queries()
+
+
+@pytest.mark.asyncio
+async def test_warmup_fills_answer_cache_and_reports_ready(indexed_kb, monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_STATUS", warmup.WarmupStatus())
+    calls = []
+
+    async def fake_call_llm(messages, **kw):
+        calls.append(messages)
+        if "Situation Task" in messages[-1]["content"].split("资料片段")[0]:
+            raise RuntimeError("upstream down")
+        return "按 STAR 结构回答 [C1]"
+
+    monkeypatch.setattr(answer, "call_llm", fake_call_llm)
+    star = SPEAKING_RAG_QUERIES["structure"]
+    monkeypatch.setattr(warmup, "_WARM_QUERIES", [
+        ("STAR Situation Task", SPEAKING_RAG_K),  # LLM 失败
+        (star, SPEAKING_RAG_K),
+        ("dynamic programming", SPEAKING_RAG_K),  # 检索不到：拒答，不算 answered
+    ])
+
+    assert warmup.WARMUP_STATUS.ready is False
+    status = await warmup.warm_rag_cache("startup")
+    stats = status.stats()
+    assert status.ready and stats["state"] == "done"
+    assert stats["failed"] == 1 and stats["answered"] == 1
+    assert stats["generation"] == RAG_CACHE.generation()
+
+    generation = RAG_CACHE.generation()
+    cached = await RAG_CACHE.get_answer(star, SPEAKING_RAG_K, generation)
+    assert cached is not None and cached[0] == "按 STAR 结构回答 [C1]"
+
+
+@pytest.mark.asyncio
+async def test_slow_llm_does_not_hold_readiness(indexed_kb, monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_STATUS", warmup.WarmupStatus())
+    monkeypatch.setattr(settings, "RAG_WARMUP_TIMEOUT_SEC", 0.2)
+
+    async def slow_call_llm(messages, deadline=None, **kw):
+        # 和真的 call_llm 一样：等不到结果时按 deadline 放弃
+        try:
+            await asyncio.wait_for(asyncio.sleep(60), deadline.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("deadline exceeded") from None
+
+    monkeypatch.setattr(answer, "call_llm", slow_call_llm)
+    monkeypatch.setattr(warmup, "_WARM_QUERIES", [(SPEAKING_RAG_QUERIES["structure"], SPEAKING_RAG_K)])
+
+    start = time.perf_counter()
+    status = await warmup.warm_rag_cache("startup")
+    assert time.perf_counter() - start < 5
+    assert status.ready and status.stats()["failed"] == 1